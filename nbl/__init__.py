@@ -1,5 +1,3 @@
-print(f'Invoking __init__.py for {__name__}')
-
 __all__ = [
         'nbl_scrapper',
         'bball_stats',
@@ -7,7 +5,18 @@ __all__ = [
         ]
 
 from . import config
-from . import nbl
 
 # import nbl.bball_stats
 # import nbl.tools
+
+
+def __getattr__(name):
+    """Import sub-modules on first access (e.g., nbl.nbl), so importing the package stays cheap"""
+    import importlib
+
+    try:
+        return importlib.import_module(f".{name}", __name__)
+    except ModuleNotFoundError as e:
+        if e.name != f"{__name__}.{name}":   # sub-module exists but some dependency is missing
+            raise
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
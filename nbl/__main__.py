@@ -0,0 +1,38 @@
+"""
+Command line entry point of the package, e.g., to query the tables of a season folder in SQL (see nbl.query):
+
+    python -m nbl query "SELECT player, COUNT(*) AS stints FROM stint_players GROUP BY player" --data-dir data-22_23
+"""
+import argparse
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m nbl", description="NBL stats tools.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    query_parser = commands.add_parser('query', help='Run a SQL query on the tables saved in a season folder.')
+    query_parser.add_argument('sql', type=str,
+                              help='SQL query (tables games, players, stints, stint_stats, stint_players, pbp, ...).')
+    query_parser.add_argument('--data-dir', type=str, default='.',
+                              help='Season folder with the tables saved (default: %(default)s).')
+    query_parser.add_argument('--build', action='store_true', default=False,
+                              help='Build the database from the tables saved first (e.g., folders saved before it existed).')
+    query_parser.add_argument('--out', type=str,
+                              help='CSV file to save the result (default: printed).')
+    args = parser.parse_args(args)
+
+    if args.command == 'query':
+        from nbl import query
+
+        if args.build:
+            query.build_db(args.data_dir)
+        result_df = query.query(args.data_dir, args.sql)
+        if args.out:
+            result_df.to_csv(args.out, index=False)
+            print(f"Result with {result_df.shape[0]} rows saved in {args.out}")
+        else:
+            print(result_df.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Event-sourced stints and stint stats: a game is built by consuming its PBP events one at a time
+
+A GameAccumulator takes the raw PBP events of a game (as in the feed data.json), one at a time or in
+small batches, and keeps:
+
+1. the lineup of each team (StintTracker), giving each event the same stint ids as pbp_stints_extract()
+   and pbp_add_stint_col() would give on the whole game; and
+2. additive counters of the core stats (see bball_stats.CORE_STATS) per team and stint, for the plays of
+   the team and of its opponent in the stint.
+
+A snapshot of the stints and stint stats tables can be taken at any moment from the counters, in time
+linear in the number of stints (derived stats like ratings and percentages are calculated then).
+Processing a whole game is just replaying its events (see replay_game()), and the same code serves
+live games (see nbl.live), replays and backfills. To check it against the batch implementation:
+
+    python -m nbl.equivalence data/22_23 --synth 200 --candidate nbl.accumulator:replay_game
+"""
+import datetime
+
+import pandas as pd
+
+from nbl import tools, bball_stats
+
+import logging
+log = logging.getLogger("main.accumulator")
+
+
+def _period_start(period: int) -> datetime.time:
+    """Clock at the start of a period (overtimes are periods 5, 6...)"""
+    return datetime.time(hour=0, minute=10 if period < 5 else 5, second=0)
+
+
+PERIOD_END = datetime.time(hour=0, minute=0, second=0)
+
+
+class StintTracker:
+    """Lineup stints of a team, built incrementally from PBP events in game order
+
+    Gives the same stints (and stint ids) as pbp_stints_extract() and pbp_add_stint_col() on the full game:
+    a stint interval (period, start, end) has the plays with end <= clock < start, so plays at the clock of
+    a substitution still belong to the lineup before it. Subs at the same clock are applied together once
+    a later play arrives, as more subs (or free throws) may still come at that clock.
+    """
+
+    def __init__(self, starters: set, tno: int):
+        self.tno = tno
+        self.stints = {}            # closed intervals of each lineup, as in pbp_stints_extract()
+        self.ids = {}               # stint id of each lineup, in order of appearance (as pbp_add_stint_col())
+        self.lineup = frozenset(starters)
+        self.prev_lineup = None     # lineup before the last sub (plays at the sub clock are still theirs)
+        self.period = 0
+        self.start = None           # clock when the current (open) interval of the lineup started
+        self.clock = None           # clock of the last play seen in the current period
+        self.subs = {}              # subs at subs_clock not yet applied: player -> 'in' | 'out'
+        self.subs_clock = None
+
+    def _open(self, clock):
+        """Start an interval of the current lineup at clock"""
+        self.start = clock
+        self.stints.setdefault(self.lineup, [])
+        self.ids.setdefault(self.lineup, len(self.ids) + 1)
+
+    def _close(self, clock):
+        """End the current interval of the current lineup at clock"""
+        self.stints[self.lineup].append((self.period, self.start, clock))
+
+    def _apply_subs(self):
+        """Apply the subs at subs_clock: close the interval of the current lineup and open one for the new lineup"""
+        if self.subs_clock is None:
+            return
+        self._close(self.subs_clock)
+
+        players_in = {player for (player, sub) in self.subs.items() if sub == 'in'}
+        players_out = {player for (player, sub) in self.subs.items() if sub == 'out'}
+        # bad subs are reported in the anomalies table (see nbl.validate), so they are only logged for debugging
+        if players_in.intersection(self.lineup):
+            log.debug("Sub team %s @ %s in period %s: incoming players already in court: %s", self.tno, self.subs_clock, self.period, players_in.intersection(self.lineup))
+        if players_out.difference(self.lineup):
+            log.debug("Sub team %s @ %s in period %s: outcoming players not in court: %s", self.tno, self.subs_clock, self.period, players_out.difference(self.lineup))
+        players_in = players_in.difference(self.lineup)
+        players_out = players_out.intersection(self.lineup)
+        if len(players_in) != len(players_out):
+            log.debug("Sub team %s @ %s in period %s: number of in-subs (%s) different from numbers out-subs (%s)", self.tno, self.subs_clock, self.period, len(players_in), len(players_out))
+
+        self.prev_lineup = self.lineup
+        self.lineup = self.lineup.difference(players_out).union(players_in)
+        self._open(self.subs_clock)
+        self.subs, self.subs_clock = {}, None
+
+    def _end_period(self):
+        self._apply_subs()
+        self._close(PERIOD_END)
+
+    def _start_period(self, period):
+        if self.period > 0:
+            self._end_period()
+        self.period = period
+        self.prev_lineup = None
+        self.clock = None
+        self._open(_period_start(period))
+
+    def add(self, period: int, clock: datetime.time, tno: int, action_type: str, sub_type: str, player: str) -> int:
+        """Add a play and get the stint of the team it belongs to
+
+        Args:
+            period (int): period of the play (overtimes are periods 5, 6...)
+            clock (datetime.time): clock of the play
+            tno (int): team of the play
+            action_type (str): action type of the play
+            sub_type (str): sub-type of the play
+            player (str): player of the play (see tools.build_player_names())
+
+        Returns:
+            int: id of the stint of the team the play belongs to (-1 if none)
+        """
+        while self.period < period:
+            self._start_period(self.period + 1)
+
+        if period == self.period:
+            if self.subs_clock is not None and clock < self.subs_clock:
+                self._apply_subs()  # play after the subs, so all subs at that clock are in
+            if self.clock is None or clock < self.clock:
+                self.clock = clock
+            if action_type == 'substitution' and tno == self.tno:
+                if self.subs_clock is not None and clock != self.subs_clock:
+                    log.warning("Sub team %s @ %s in period %s arrived after later plays", self.tno, clock, period)
+                self.subs_clock = clock if self.subs_clock is None else self.subs_clock
+                self.subs[player] = sub_type    # the last sub of a player at a clock counts
+
+            if clock < self.start:
+                return self.ids[self.lineup]
+            if clock == self.start:
+                return self.ids[self.prev_lineup] if self.prev_lineup is not None else -1
+
+        return self.stint_of(period, clock)     # late play of an earlier interval
+
+    def stint_of(self, period: int, clock: datetime.time) -> int:
+        """Stint whose closed intervals contain a play (-1 if none)"""
+        for lineup, intervals in self.stints.items():
+            for (p, start, end) in intervals:
+                if p == period and end <= clock < start:
+                    return self.ids[lineup]
+        return -1
+
+    def finish(self):
+        """Close the stint in court at the end of the game"""
+        self._end_period()
+        self.start = self.clock = None
+
+    def stints_df(self) -> pd.DataFrame:
+        """Stints of the team so far, as in pbp_add_stint_col() (the stint in court runs up to the last play)"""
+        rows = []
+        for lineup, intervals in self.stints.items():
+            if lineup == self.lineup and self.start is not None:
+                intervals = intervals + [(self.period, self.start, self.clock if self.clock is not None else self.start)]
+            rows.append({'id': self.ids[lineup], 'lineup': sorted(lineup), 'intervals': intervals})
+        stints_df = pd.DataFrame(rows)
+        stints_df['mins'] = stints_df['intervals'].apply(tools.intervals_to_mins)
+        return stints_df
+
+
+
+def parse_event(event: dict) -> tuple:
+    """Get the fields of a raw PBP event used for stints and stats, as get_pbp_df() does for a whole game
+
+    Args:
+        event (dict): PBP event as in the game data (data.json)
+
+    Returns:
+        tuple(int, datetime.time, int, str, str, str, int): period (overtimes are periods 5, 6...), clock,
+            team, action type, sub type, player and success of the event
+    """
+    period = event['period'] + 4 if event['periodType'] == "OVERTIME" else event['period']
+    mins, secs, hundredths = event['clock'].split(':')
+    clock = datetime.time(hour=0, minute=int(mins), second=int(secs), microsecond=int(hundredths.ljust(6, '0')))
+    player = f"{event.get('internationalFirstName')} {event.get('internationalFamilyName')}"
+    return period, clock, event['tno'], event['actionType'], event['subType'], player, event['success']
+
+
+def game_order(event: dict) -> tuple:
+    """Sort key of raw PBP events in game order (by period, clock going down and action number, as get_pbp_df())"""
+    period, clock, *_ = parse_event(event)
+    return period, -(clock.minute * 60 + clock.second) * 10**6 - clock.microsecond, event['actionNumber']
+
+
+# core stats counted per stint: attempts (or plain count) and, for rate stats, those made
+COUNT_COLS = bball_stats.CORE_COUNT_COLS
+
+
+class GameAccumulator:
+    """Stints and stint stats of a game, updated with each PBP event consumed
+
+    Events must be added in game order (see game_order()), e.g., in the order the feed sends them.
+    """
+
+    def __init__(self, team_names: tuple, starters: dict):
+        """
+        Args:
+            team_names (tuple(str, str)): names of team 1 and 2
+            starters (dict): set of starter players of each team (1 and 2)
+        """
+        self.team_names = team_names
+        self.trackers = {tno: StintTracker(starters[tno], tno) for tno in [1, 2]}
+        # counters of each team by stint: [no of plays, COUNT_COLS...] for the plays of the team and its opponent
+        self.counts = {tno: {} for tno in [1, 2]}
+        self.opp_counts = {tno: {} for tno in [1, 2]}
+        self.no_events = 0
+        self._count_cols = {}   # (action type, sub type, success) -> positions of counters it adds to
+
+    @classmethod
+    def from_json(cls, game_json: dict):
+        """Build an accumulator for a game, with no events yet (teams and starters are taken from the game data)"""
+        team_names = tuple(name for (name, _) in bball_stats.get_team_names(game_json))
+        return cls(team_names, {tno: bball_stats.get_starters(game_json, tno) for tno in [1, 2]})
+
+    def _counters_of(self, action_type: str, sub_type: str, success: int) -> list:
+        """Positions of the counters a play adds to (memoized per kind of play)"""
+        key = (action_type, sub_type, success)
+        if key not in self._count_cols:
+            positions = []
+            for (name, _, rate, action_types, sub_types) in bball_stats.CORE_STATS:
+                if (action_types is None or action_type in action_types) and (sub_types is None or sub_type in sub_types):
+                    positions.append(1 + COUNT_COLS.index(f'{name}a' if rate else name))
+                    if rate and success == 1:
+                        positions.append(1 + COUNT_COLS.index(f'{name}m'))
+            self._count_cols[key] = positions
+        return self._count_cols[key]
+
+    def add(self, event: dict) -> tuple:
+        """Consume a PBP event
+
+        Args:
+            event (dict): PBP event as in the game data (data.json)
+
+        Returns:
+            tuple(int, int): stint of team 1 and of team 2 the event belongs to (-1 if none)
+        """
+        period, clock, tno, action_type, sub_type, player, success = parse_event(event)
+        stints = tuple(self.trackers[t].add(period, clock, tno, action_type, sub_type, player) for t in [1, 2])
+
+        if tno in [1, 2]:   # game events (e.g., period start/end) count for no team
+            positions = self._counters_of(action_type, sub_type, success)
+            for t, stint in zip([1, 2], stints):
+                counts = (self.counts if tno == t else self.opp_counts)[t]
+                if stint not in counts:
+                    counts[stint] = [0] * (len(COUNT_COLS) + 1)
+                row = counts[stint]
+                row[0] += 1
+                for i in positions:
+                    row[i] += 1
+        self.no_events += 1
+        return stints
+
+    def add_events(self, events: list):
+        """Consume a batch of PBP events (e.g., the new ones in a poll), sorted first in game order"""
+        for event in sorted(events, key=game_order):
+            self.add(event)
+
+    def finish(self):
+        """Close the last stints when the game ends"""
+        for tracker in self.trackers.values():
+            tracker.finish()
+
+    def _core_stats_df(self, counts: dict, stint_col: str) -> pd.DataFrame:
+        """Core stats table (as build_core_stats() in build_stats_df()) from the counters of each stint"""
+        df = pd.DataFrame([[stint] + row[1:] for (stint, row) in counts.items() if row[0] > 0],
+                          columns=[stint_col] + COUNT_COLS)
+        return bball_stats.core_stats_from_counts(df)
+
+    def team_stats_df(self, tno: int) -> pd.DataFrame:
+        """Stint stats of a team so far, as build_stats_df() for the stint column of the team
+
+        Args:
+            tno (int): team (1 or 2)
+
+        Returns:
+            pd.DataFrame: one row per stint where the team has plays
+        """
+        stint_col = f'stint{tno}'
+        stats_df = self._core_stats_df(self.counts[tno], stint_col).merge(
+                        self._core_stats_df(self.opp_counts[tno], stint_col), how='left', on=stint_col, suffixes=("", "_opp"))
+        stats_df.insert(0, 'tno', tno)
+        return bball_stats.add_team_opp_derived_stats(stats_df)
+
+    def tables(self) -> dict:
+        """Stints and stint stats tables of the game so far (as build_game_stints_stats_df())
+
+        Returns:
+            dict: the stints df and stint stats df of the game
+        """
+        stints_df, stint_stats_df = bball_stats.merge_stints_stats(self.team_stats_df(1), self.team_stats_df(2),
+                                                                   self.trackers[1].stints_df(), self.trackers[2].stints_df(),
+                                                                   self.team_names)
+        return {'stints_df': stints_df, 'stint_stats_df': stint_stats_df}
+
+
+def replay_game(game_json: dict, game_id=None) -> dict:
+    """Build the tables of a finished game by replaying its PBP events (an engine for nbl.equivalence)
+
+    Args:
+        game_json (dict): json dict data of the game
+        game_id (str): id of the game
+
+    Returns:
+        dict: stint stats, stints and players tables of the game
+    """
+    game = GameAccumulator.from_json(game_json)
+    game.add_events(game_json['pbp'])
+    game.finish()
+    return {**game.tables(), 'players_df': bball_stats.get_players_stats(game_json)}
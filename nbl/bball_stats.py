@@ -20,7 +20,7 @@ import datetime
 
 # Load constants
 from nbl.config import *
-from nbl import tools
+from nbl import tools, metrics
 
 from functools import reduce
 
@@ -107,7 +107,9 @@ def get_pbp_df(game_json):
     log.debug(f"Will extract PBP df for game {team_name_1} ({team_short_name_1}) vs {team_name_2} ({team_short_name_2})")
 
     # extract play-by-play data
-    pbp_df = pd.json_normalize(game_json, record_path =['pbp'])
+    with metrics.span('json_normalize'):
+        pbp_df = pd.json_normalize(game_json, record_path =['pbp'])
+    metrics.count('pbp_rows', pbp_df.shape[0])
 
     # standarize player's name to be used all over
     pbp_df['player'] = pbp_df.apply(lambda x: tools.build_player_names(x), axis=1)
@@ -177,15 +179,17 @@ def get_players_stats(game_json) -> pd.DataFrame:
 
 
 
-def build_game_stints_stats_df(game_json : dict, game_id = np.NaN) -> dict:
+def build_game_stints_stats_df(game_json : dict, game_id = np.NaN, splits: list = None) -> dict:
     """Build dataframe with stint statistics for a game, by extracting play-by-play data
 
     Args:
         game_json (dict): json dict data of the game
         game_id (int) : game id of the game, if any
+        splits (list(str)): splits of the stint stats to compute too, if any (see SPLITS)
 
     Returns:
-        dict: contains various data and df for the game (including pbp and stint stats dfs)
+        dict: contains various data and df for the game (including pbp and stint stats dfs, and the stint
+            stats by split if splits given)
     """
     # 1. Extract names of teams and scores in the game
     team_names = get_team_names(game_json)
@@ -194,7 +198,8 @@ def build_game_stints_stats_df(game_json : dict, game_id = np.NaN) -> dict:
     score_1, score_2 = get_team_scores(game_json)
 
     # 2. Read game JSON file
-    pbp_df = get_pbp_df(game_json)
+    with metrics.span('get_pbp_df'):
+        pbp_df = get_pbp_df(game_json)
 
     log.debug(f"Extracting stint stats for game {game_id} [{team_name_1} ({score_1}) vs {team_name_2} ({score_2})] - No of PBP: {pbp_df.shape[0]}.")
 
@@ -202,16 +207,54 @@ def build_game_stints_stats_df(game_json : dict, game_id = np.NaN) -> dict:
     # print(f"Play-by-play df for game {game_id}: {pbp_df.shape}")
 
     # 3. Compute stints (dictionaries) for each team
-    starters_1 = get_starters(game_json, 1)
-    starters_2 = get_starters(game_json, 2)
+    with metrics.span('get_starters'):
+        starters_1 = get_starters(game_json, 1)
+        starters_2 = get_starters(game_json, 2)
     log.debug(f"Starters for each team computed: {starters_1} / {starters_2}")
-    stints_1 = pbp_stints_extract(pbp_df, starters_1, 1)
-    stints_2 = pbp_stints_extract(pbp_df, starters_2, 2)
+    with metrics.span('pbp_stints_extract'):
+        stints_1 = pbp_stints_extract(pbp_df, starters_1, 1)
+        stints_2 = pbp_stints_extract(pbp_df, starters_2, 2)
+    metrics.count('stints', len(stints_1) + len(stints_2))
     log.debug(f"Stints for each team computed: {len(stints_1)} / {len(stints_2)}")
 
+    # 4-8. Annotate pbp with stints and build stints and stint stats tables (and stint stats by split)
+    tables = build_stints_stats_df(pbp_df, stints_1, stints_2, (team_name_1, team_name_2), splits)
+    pbp_df, stints_df, stint_stats_df = tables[:3]
+
+    # FINALLY, build result dictionary
+    result = {}
+    result["id"] = game_id
+    result["json_data"] = game_json
+    result["pbp_df"] = pbp_df
+    result["teams"] = [(team_name_1, score_1), (team_name_2, score_2)]
+    result["stint_stats_df"] = stint_stats_df
+    result['stints_df'] = stints_df
+    if splits:
+        result['splits_df'] = tables[3]
+
+    return result
+
+
+def build_stints_stats_df(pbp_df: pd.DataFrame, stints_1: dict, stints_2: dict, team_names: tuple,
+                          splits: list = None) -> tuple:
+    """Build the stints and stint stats tables of a game from its pbp and the stints of both teams
+
+    Args:
+        pbp_df (pd.DataFrame): play-by-play data of the game (see get_pbp_df())
+        stints_1 (dict): stints of team 1 (see pbp_stints_extract())
+        stints_2 (dict): stints of team 2 (see pbp_stints_extract())
+        team_names (tuple(str, str)): names of team 1 and 2
+        splits (list(str)): splits of the stint stats to compute in the same pass, if any (see SPLITS)
+
+    Returns:
+        tuple(pd.DataFrame, pd.DataFrame, pd.DataFrame):
+            pbp df with stint columns stint1 and stint2, stints df, and stint stats df
+            (and, if splits given, the stint stats by split in long format)
+    """
     # 4. Add stint columns to pbp df, one column per team having stint id number
-    stints1_df, pbp_df = pbp_add_stint_col(pbp_df, stints_1, "stint1")
-    stints2_df, pbp_df = pbp_add_stint_col(pbp_df, stints_2, "stint2")
+    with metrics.span('pbp_add_stint_col'):
+        stints1_df, pbp_df = pbp_add_stint_col(pbp_df, stints_1, "stint1")
+        stints2_df, pbp_df = pbp_add_stint_col(pbp_df, stints_2, "stint2")
     log.debug(f"Stints columns added to pbp df for both teams")
 
 
@@ -222,12 +265,46 @@ def build_game_stints_stats_df(game_json : dict, game_id = np.NaN) -> dict:
     # pbp_df.reset_index(inplace=True, drop=True)     # re-index as we may have dropped rows
 
     # 6. Build single stint stats dataframe containing both teams
-    stint_stats1_df = build_stats_df(pbp_df, 1, "stint1") # full stats for team 1
-    stint_stats2_df = build_stats_df(pbp_df, 2, "stint2") # full stats for team 2
+    with metrics.span('build_stats_df'):
+        if splits:  # stint stats by split too, from the same counts
+            stint_stats1_df, splits1_df = build_stats_df(pbp_df, 1, "stint1", splits)
+            stint_stats2_df, splits2_df = build_stats_df(pbp_df, 2, "stint2", splits)
+        else:
+            stint_stats1_df = build_stats_df(pbp_df, 1, "stint1") # full stats for team 1
+            stint_stats2_df = build_stats_df(pbp_df, 2, "stint2") # full stats for team 2
+
+    # 7-8. Put together the stint stats and the stint tables of both teams
+    stints_df, stint_stats_df = merge_stints_stats(stint_stats1_df, stint_stats2_df, stints1_df, stints2_df, team_names)
+
+    if not splits:
+        return pbp_df, stints_df, stint_stats_df
+
+    # long table of stint stats by split, with the columns of the stint stats table
+    splits_df = pd.concat([splits1_df.rename(columns={'stint1': 'stint'}),
+                           splits2_df.rename(columns={'stint2': 'stint'})], ignore_index=True)
+    splits_df = splits_df[['tno', 'stint', 'split', 'value'] + STATS_COLS + [f'{x}_opp' for x in STATS_COLS]]
+    return pbp_df, stints_df, stint_stats_df, splits_df
+
+
+def merge_stints_stats(stint_stats1_df: pd.DataFrame, stint_stats2_df: pd.DataFrame,
+                       stints1_df: pd.DataFrame, stints2_df: pd.DataFrame, team_names: tuple) -> tuple:
+    """Put together the stint stats and stints tables of both teams of a game
+
+    Args:
+        stint_stats1_df (pd.DataFrame): stint stats of team 1, by column stint1 (see build_stats_df())
+        stint_stats2_df (pd.DataFrame): stint stats of team 2, by column stint2 (see build_stats_df())
+        stints1_df (pd.DataFrame): stints of team 1 (see pbp_add_stint_col())
+        stints2_df (pd.DataFrame): stints of team 2 (see pbp_add_stint_col())
+        team_names (tuple(str, str)): names of team 1 and 2
+
+    Returns:
+        tuple(pd.DataFrame, pd.DataFrame): stints df and stint stats df of the game
+    """
+    team_name_1, team_name_2 = team_names
 
     # unify stint column name to just "stint"
-    stint_stats1_df.rename(columns={'stint1' : 'stint'}, inplace=True)
-    stint_stats2_df.rename(columns={'stint2' : 'stint'}, inplace=True)
+    stint_stats1_df = stint_stats1_df.rename(columns={'stint1' : 'stint'})
+    stint_stats2_df = stint_stats2_df.rename(columns={'stint2' : 'stint'})
 
     # put both stint stats together into a single dataframe
     stint_stats_df = pd.concat([stint_stats1_df, stint_stats2_df])
@@ -239,10 +316,8 @@ def build_game_stints_stats_df(game_json : dict, game_id = np.NaN) -> dict:
     stint_stats_df = stint_stats_df[index_col + STATS_COLS + [f'{x}_opp' for x in STATS_COLS]]
 
     # 7. Put together the final stint df
-    stints1_df['tno'] = 1
-    stints1_df['team'] = team_name_1
-    stints2_df['tno'] = 2
-    stints2_df['team'] = team_name_2
+    stints1_df = stints1_df.assign(tno=1, team=team_name_1)
+    stints2_df = stints2_df.assign(tno=2, team=team_name_2)
     stints_df = pd.concat([stints1_df, stints2_df])
     stints_df.reset_index(inplace=True, drop=True)
     index_col = ['id', 'tno', 'team']   # re-order cols
@@ -254,16 +329,8 @@ def build_game_stints_stats_df(game_json : dict, game_id = np.NaN) -> dict:
     team_name_col = stint_stats_df.pop('team')
     stint_stats_df.insert(1, "team", team_name_col)
 
-    # FINALLY, build result dictionary
-    result = {}
-    result["id"] = game_id
-    result["json_data"] = game_json
-    result["pbp_df"] = pbp_df
-    result["teams"] = [(team_name_1, score_1), (team_name_2, score_2)]
-    result["stint_stats_df"] = stint_stats_df
-    result['stints_df'] = stints_df
+    return stints_df, stint_stats_df
 
-    return result
 
 # ##########################################################
 # CODE USING P-B-P DATAFRAME
@@ -319,6 +386,7 @@ def pbp_stints_extract(pbp_df : pd.DataFrame, starter_team: set, team_no: int) -
         #   2004608: Period 2 05.600 - B. Kuol (team 2) come out, but then in and out
         #   2116381: Period 4 00:01:36 - Bul Kuol goes out and then in again!
         subs_df = subs_df.drop_duplicates(subset=['clock', 'player'], keep='last')
+        metrics.count('substitutions', subs_df.shape[0])
 
         # initialize tracking clocks
         prev_clock = datetime.time(hour=0, minute=10 if period < 5 else 5, second=0)
@@ -328,23 +396,25 @@ def pbp_stints_extract(pbp_df : pd.DataFrame, starter_team: set, team_no: int) -
         for sub_clock in list(subs_df['clock'].unique()) + [end_clock]:
             # interval = pd.Interval(datetime.datetime.timestamp(prev_clock), datetime.datetime.timestamp(sub_clock), closed='left')
             interval = (period, prev_clock, sub_clock)
-            log.debug(f"=====> Substitution in period {period} @ {sub_clock}")
+            log.debug("=====> Substitution in period %s @ %s", period, sub_clock)
 
             if current_team in stints:
                 stints[current_team].append(interval)   # append intervals of existing stint
             else:
                 stints[current_team] = [interval]   # new stint found!
-                log.debug(f"New stint was found: {current_team}")
+                log.debug("New stint was found: %s", current_team)
 
             players_in = set(subs_df.query("clock == @sub_clock and subType == 'in'")['player'].tolist())
             players_out = set(subs_df.query("clock == @sub_clock and subType == 'out'")['player'].tolist())
 
+            # inconsistent subs are reported in the anomalies table (see nbl.validate), so only logged when debugging
+            #   (with lazy formatting, as this runs for every sub)
             dummy_sub = False
             if players_in.intersection(current_team):
-                log.warning(f"Sub team {team_no} @ {sub_clock} in period {period}: incoming players already in court: {players_in.intersection(current_team)}")
+                log.debug("Sub team %s @ %s in period %s: incoming players already in court: %s", team_no, sub_clock, period, players_in.intersection(current_team))
                 dummy_sub = True
             if players_out.difference(current_team):
-                log.warning(f"Sub team {team_no} @ {sub_clock} in period {period}: outcoming players not in court: {players_out.difference(current_team)}")
+                log.debug("Sub team %s @ %s in period %s: outcoming players not in court: %s", team_no, sub_clock, period, players_out.difference(current_team))
                 dummy_sub = True
 
             # Try to fix the in/out sets (sometimes player goes out and in again at the same time)
@@ -353,15 +423,15 @@ def pbp_stints_extract(pbp_df : pd.DataFrame, starter_team: set, team_no: int) -
 
             # Hopefully we have a 1-to-1 substitution, otherwise report!
             if len(players_in) != len(players_out):
-                log.warning(f"Sub team {team_no} @ {sub_clock} in period {period}: number of in-subs ({len(players_in)}) different from numbers out-subs ({len(players_out)})")
+                log.debug("Sub team %s @ %s in period %s: number of in-subs (%s) different from numbers out-subs (%s)", team_no, sub_clock, period, len(players_in), len(players_out))
             elif dummy_sub:
-                log.info("Dummy subs fixed, good subs....")
+                log.debug("Dummy subs fixed, good subs....")
 
-            log.debug(f"Current team: {current_team}")
-            log.debug(f"Players out: {players_out}")
-            log.debug(f"Players in: {players_in}")
+            log.debug("Current team: %s", current_team)
+            log.debug("Players out: %s", players_out)
+            log.debug("Players in: %s", players_in)
             current_team = current_team.difference(players_out).union(players_in)
-            log.debug(f"New team: {current_team}")
+            log.debug("New team: %s", current_team)
 
             # reset prev clock for next subs
             prev_clock = sub_clock
@@ -456,18 +526,356 @@ def get_overtimes(pbp_df: pd.DataFrame) -> list:
 # ##########################################################
 # STINT STATISTICS BUILDER
 # ##########################################################
-def build_stats_df(pbp_df: pd.DataFrame, tno: int, agg_col = (lambda x: True)) -> pd.DataFrame:
+# Stats counted from plays: (name, default value, True if attemps/made/per, action types, sub types)
+#   a play counts for a stat if its action type and sub type are in the lists given (None: any)
+CORE_STATS = [ (F_AST, 0, False, ['assist'], None),
+        # points
+        (F_2PTFG, 0, True, ['2pt'], None),
+        (F_PATR, 0, True, None, ['layup', 'drivinglayup', 'dunk']),
+        (F_3PTFG, 0, True, ['3pt'], None),
+        (F_FT, 0, True, ['freethrow'], None),
+        # others
+        (F_REB, 0, False, ['rebound'], None),
+        (F_OREB, 0, False, ['rebound'], ['offensive']),
+        (F_ODREB, 0, False, ['rebound'], ['offensivedeadball']),
+        (F_DREB, 0, False, ['rebound'], ['defensive']),
+        (F_STL, 0, False, ['steal'], None),
+        (F_BLK, 0, False, ['block'], None),
+        #turnover types
+        (F_TOV, 0, False, ['turnover'], None),
+        (F_BALLHAND, 0, False, ['turnover'], ['ballhandling', 'doubledribble', 'travel']),
+        (F_BADPASS, 0, False, ['turnover'], ['badpass']),
+        (F_OFOUL, 0, False, ['turnover'], ['offensive']),
+        (F_3SEC, 0, False, ['turnover'], ['3sec']),
+        (F_8SEC, 0, False, ['turnover'], ['8sec']),
+        (F_24SEC, 0, False, ['turnover'], ['24sec'])
+]
+
+
+# counts of the core stats (attempts and made for stats with rate), additive across plays, stints and games
+CORE_COUNT_COLS = [col for (name, _, rate, _, _) in CORE_STATS for col in ([f'{name}a', f'{name}m'] if rate else [name])]
+
+
+def core_stat_mask(pbp_df: pd.DataFrame, action_types: list, sub_types: list) -> pd.Series:
+    """Mask of the plays of a pbp df that count for a core stat (see CORE_STATS)"""
+    mask = pd.Series(True, index=pbp_df.index)
+    if action_types is not None:
+        mask = mask & pbp_df['actionType'].isin(action_types)
+    if sub_types is not None:
+        mask = mask & pbp_df['subType'].isin(sub_types)
+    return mask
+
+
+def add_core_derived_stats(df: pd.DataFrame) -> pd.DataFrame:
+    """Calculate the stats of a team derived from its core stats counts (points, possessions, ratings, rates...)
+
+    Args:
+        df (pd.DataFrame): a table with the core stats counts (see CORE_STATS), e.g., one row per stint
+
+    Returns:
+        pd.DataFrame: the same table, extended with the derived stats
+    """
+    # calculate shooting stats
+    df[F_PTS] = 2*df[F_2PTFGM] + 3*df[F_3PTFGM] + df[F_FTM]
+    df[F_FGA] = df[F_2PTFGA] + df[F_3PTFGA]
+    df[F_FGM] = df[F_2PTFGM] + df[F_3PTFGM]
+    df[F_FGP] = tools.percent(df[F_FGM], df[F_FGA])
+
+    # # calculate home possessions (possessions only count change of hands, not offensive rebounds and new shots)
+    df[F_POSS] = df[F_2PTFGA] + df[F_3PTFGA] + 0.44*df[F_FTA] + df[F_TOV] - df[F_OREB]
+    df.loc[df[F_POSS] < 0, 'poss'] = 0
+
+    # calculate offensive rating
+    df[F_ORTG] = tools.percent(df[F_PTS], df[F_POSS])
+
+    # playmaking stats
+    df[F_FGMASTP] = tools.percent(df[F_AST], df[F_2PTFGM] + df[F_3PTFGM])
+
+    # total rebounds
+    df[F_TRB] = df[F_DREB] + df[F_OREB]
+
+    #calculate rates
+    df[F_BLKR] = tools.percent(df[F_BLK], df[F_POSS])
+    df[F_STLR] = tools.percent(df[F_STL], df[F_POSS])
+    df[F_ASTR] = tools.percent(df[F_AST], df[F_POSS])
+    df[F_TOVR] = tools.percent(df[F_TOV], df[F_POSS])
+
+    # TS% = true shooting percentage, combines 2pts, 3pts, ft
+    df[F_TSP] = tools.percent(df[F_PTS], 2*(df[F_FGA] + 0.44*df[F_FTA]))
+
+    # Fill all NaN with 0
+    # This is not correct: NaN will arise when dividing by 0 (for %), and we want to keep NaN which is different from having 0
+    # for example: orebs/rebs will give % of orebs, but if rebs = 0 (no rebounds taken), we don't want to have 0%!
+    # df.fillna(0, inplace=True)
+
+    return df
+
+
+def core_stats_from_counts(df: pd.DataFrame) -> pd.DataFrame:
+    """Calculate the core stats of a team from its counts (see CORE_COUNT_COLS), as build_stats_df() does
+
+    Args:
+        df (pd.DataFrame): a table with the core stats counts, e.g., one row per stint (or summed over games)
+
+    Returns:
+        pd.DataFrame: the same table, extended with percentages and the derived stats
+    """
+    for (name, default, rate, _, _) in CORE_STATS:
+        if rate:    # percentage with no attempts is the default
+            df[f'{name}p'] = tools.percent(df[f'{name}m'], df[f'{name}a']).where(df[f'{name}a'] > 0, default)
+    return add_core_derived_stats(df)
+
+
+def add_team_opp_derived_stats(stats_df: pd.DataFrame) -> pd.DataFrame:
+    """Calculate the stats that need both the team and the opponent stats (columns with suffix _opp)
+
+    Args:
+        stats_df (pd.DataFrame): a table with the core stats of the team and of its opponent
+
+    Returns:
+        pd.DataFrame: the same table, extended with the stats
+    """
+    # for the team
+    stats_df[F_DRTG] = tools.percent(stats_df[f'{F_PTS}_opp'], stats_df[f'{F_POSS}_opp']) # drtg = defensive rating
+    stats_df[F_NRTG] = stats_df[F_ORTG] - stats_df[F_DRTG]    # net rating: offensive rating - defensive rating
+
+    stats_df[F_DREBC] = stats_df[F_DREB] + stats_df[f'{F_OREB}_opp']
+    stats_df[F_DREBP] = tools.percent(stats_df[F_DREB], stats_df[F_DREB] + stats_df[f'{F_OREB}_opp'])
+    stats_df[F_OREBC] = stats_df[F_OREB] + stats_df[f'{F_DREB}_opp']
+    stats_df[F_OREBP] = tools.percent(stats_df[F_OREB], stats_df[F_OREB] + stats_df[f'{F_DREB}_opp'])
+    stats_df[F_TRBR] = tools.percent(stats_df[F_TRB],
+                                    stats_df[F_OREB] +
+                                    stats_df[F_DREB] +
+                                    stats_df[f'{F_OREB}_opp'] +
+                                    stats_df[f'{F_DREB}_opp'])
+    stats_df[F_OPPFGABLK] = tools.percent(stats_df[F_BLK], stats_df[f'{F_FGA}_opp'])
+
+    # # for the opponent (same stats as team)
+    stats_df[f'{F_DRTG}_opp'] = tools.percent(stats_df[F_PTS], stats_df[F_POSS])
+    stats_df[f'{F_NRTG}_opp'] = stats_df[f'{F_ORTG}_opp'] - stats_df[f'{F_DRTG}_opp']
+
+    stats_df[f'{F_DREBC}_opp'] = stats_df[f'{F_DREB}_opp'] + stats_df[F_OREB]
+    stats_df[f'{F_DREBP}_opp'] = tools.percent(stats_df[f'{F_DREB}_opp'], stats_df[f'{F_DREB}_opp'] + stats_df[F_OREB])
+    stats_df[f'{F_OREBC}_opp'] = stats_df[f'{F_OREB}_opp'] + stats_df[F_DREB]
+    stats_df[f'{F_OREBP}_opp'] = tools.percent(stats_df[f'{F_OREB}_opp'], stats_df[f'{F_OREB}_opp'] + stats_df[F_DREB])
+    stats_df[f'{F_TRBR}_opp'] = tools.percent(stats_df[f'{F_TRB}_opp'],
+                                    stats_df[f'{F_OREB}_opp'] +
+                                    stats_df[f'{F_DREB}_opp'] +
+                                    stats_df[F_OREB] +
+                                    stats_df[F_DREB])
+    stats_df[f'{F_OPPFGABLK}_opp'] = tools.percent(stats_df[f'{F_BLK}_opp'], stats_df[F_FGA])
+
+    return stats_df
+
+
+# Splits of the plays of a game, as extra dimensions to group stats by (see build_split_stats_df())
+CLUTCH_TIME = datetime.time(hour=0, minute=5, second=0)    # clutch time: last 5 minutes of Q4 and overtimes...
+CLUTCH_MARGIN = 5                                           # ... with a score margin of at most 5 points
+
+
+def clutch_mask(pbp_df: pd.DataFrame) -> pd.Series:
+    """Mask of the plays in clutch time: last 5 minutes of the 4th period or an overtime with a margin <= 5
+
+    The margin is the one before the play (running scores s1 and s2 of the previous play in game order),
+    so the play that takes the margin over 5 is still clutch. Scores are cast to numbers, as the feed may
+    send them as strings; missing scores carry the last known ones.
+
+    Args:
+        pbp_df (pd.DataFrame): play-by-play data of a whole game, in game order (see get_pbp_df())
+
+    Returns:
+        pd.Series: True for the plays in clutch time
+    """
+    scores = pbp_df[['s1', 's2']].apply(pd.to_numeric, errors='coerce').ffill().fillna(0)
+    margin = (scores['s1'] - scores['s2']).shift(fill_value=0).abs()
+    return (pbp_df['period'] >= 4) & (pbp_df['clock'] <= CLUTCH_TIME) & (margin <= CLUTCH_MARGIN)
+
+
+SPLITS = {
+    'period': lambda pbp_df: np.where(pbp_df['period'] <= 4, 'Q' + pbp_df['period'].astype(str),
+                                      'OT' + (pbp_df['period'] - 4).astype(str)),
+    'half': lambda pbp_df: np.select([pbp_df['period'] <= 2, pbp_df['period'] <= 4], ['H1', 'H2'], 'OT'),
+    'period_type': lambda pbp_df: pbp_df['periodType'].str.lower(),
+    'clutch': lambda pbp_df: np.where(clutch_mask(pbp_df), 'clutch', 'non_clutch'),
+}
+
+
+def core_counts_df(pbp_df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Count the core stats (see CORE_COUNT_COLS) of the plays of a pbp df, grouped by some columns in one pass
+
+    Args:
+        pbp_df (pd.DataFrame): a play-by-play table with the columns in keys
+        keys (list(str)): columns to group by (rows with NaN keys are kept)
+
+    Returns:
+        pd.DataFrame: one row per value of keys, with the count of each core stat
+    """
+    made = pbp_df['success'] == 1
+    counts = {}
+    for (name, _, rate, action_types, sub_types) in CORE_STATS:
+        mask = core_stat_mask(pbp_df, action_types, sub_types)
+        counts[f'{name}a' if rate else name] = mask
+        if rate:
+            counts[f'{name}m'] = mask & made
+    counts_df = pd.DataFrame(counts, index=pbp_df.index, columns=CORE_COUNT_COLS).astype(int)
+    return counts_df.groupby([pbp_df[key] for key in keys], dropna=False).sum().reset_index()
+
+
+def build_split_stats_df(pbp_df: pd.DataFrame, tno: int, agg_col: str, splits: list) -> tuple:
+    """Build the full statistics of a team by column agg_col, for the whole game and for each split
+
+    The core stats of the team and its opponent are counted once, grouped by agg_col and all the splits;
+    as counts are additive, the whole-game stats and the stats of each split are sums of those counts.
+
+    Args:
+        pbp_df (pd.DataFrame): play-by-play data for a game, in game order
+        tno (int): team number to extract stats for
+        agg_col (str): the column to group by (e.g., a stint column)
+        splits (list(str)): splits to compute (keys of SPLITS)
+
+    Returns:
+        tuple(pd.DataFrame, pd.DataFrame): stats by agg_col (as build_stats_df()) and stats by agg_col
+            and split in long format (columns split and value)
+    """
+    pbp_df = pbp_df.assign(**{name: SPLITS[name](pbp_df) for name in splits})
+    team_counts_df = core_counts_df(pbp_df.loc[pbp_df['tno'] == tno], [agg_col] + list(splits))
+    opp_counts_df = core_counts_df(pbp_df.loc[pbp_df['tno'] == (2 if tno == 1 else 1)], [agg_col] + list(splits))
+
+    def sum_stats_df(by: list, all_rows=False) -> pd.DataFrame:
+        """Stats of the team and its opponent (as columns _opp) from the counts summed by columns by
+
+        Rows are those with plays of the team (as build_stats_df()) or, if all_rows, with plays of any team
+        """
+        team_df = team_counts_df.groupby(by, dropna=False)[CORE_COUNT_COLS].sum().reset_index()
+        opp_df = opp_counts_df.groupby(by, dropna=False)[CORE_COUNT_COLS].sum().reset_index()
+        if all_rows:
+            team_df = team_df.merge(opp_df[by], how='outer', on=by).fillna(0)
+        stats_df = core_stats_from_counts(team_df).merge(core_stats_from_counts(opp_df), how='left', on=by,
+                                                         suffixes=("", "_opp"))
+        stats_df.insert(0, 'tno', tno)
+        return add_team_opp_derived_stats(stats_df)
+
+    # whole game, in order of appearance of agg_col (as build_stats_df())
+    stats_df = pd.DataFrame({agg_col: pbp_df.loc[pbp_df['tno'] == tno, agg_col].unique()}) \
+                 .merge(sum_stats_df([agg_col]), how='left', on=agg_col)
+    stats_df.insert(0, 'tno', stats_df.pop('tno'))
+
+    splits_dfs = []
+    for name in splits:
+        split_df = sum_stats_df([agg_col, name], all_rows=True).rename(columns={name: 'value'})
+        split_df.insert(2, 'split', name)
+        splits_dfs.append(split_df)
+    splits_df = pd.concat(splits_dfs, ignore_index=True)
+    splits_df.insert(3, 'value', splits_df.pop('value'))
+
+    return stats_df, splits_df
+
+
+# counts of a team table that are not stats columns, kept so tables can be accumulated (see accumulate_team_stats())
+TEAM_EXTRA_COLS = [col for col in CORE_COUNT_COLS if col not in STATS_COLS]
+
+
+def build_team_stats_df(pbp_df: pd.DataFrame) -> pd.DataFrame:
+    """Build the whole-game stats of both teams of a game (box score and advanced stats) in one pass
+
+    Args:
+        pbp_df (pd.DataFrame): play-by-play data for a game (or some of its plays)
+
+    Returns:
+        pd.DataFrame: one row per team (tno 1 and 2) with the stats of the team and of its opponent (columns
+            _opp), as the stint stats tables, and the counts not in the stats (TEAM_EXTRA_COLS)
+    """
+    counts_df = core_counts_df(pbp_df.loc[pbp_df['tno'].isin([1, 2])], ['tno'])
+    counts_df = counts_df.set_index('tno').reindex([1, 2], fill_value=0)
+    return team_stats_from_counts(counts_df.reset_index(), counts_df.loc[[2, 1]].reset_index(drop=True))
+
+
+def team_stats_from_counts(counts_df: pd.DataFrame, opp_counts_df: pd.DataFrame) -> pd.DataFrame:
+    """Stats of teams (and of their opponents, as columns _opp) from their counts, row by row
+
+    Args:
+        counts_df (pd.DataFrame): key columns and the counts of each team (see CORE_COUNT_COLS)
+        opp_counts_df (pd.DataFrame): counts of the opponent of each team, in the same row order
+
+    Returns:
+        pd.DataFrame: key columns, stats (STATS_COLS), opponent stats and counts not in the stats
+    """
+    keys = [col for col in counts_df.columns if col not in CORE_COUNT_COLS]
+    team_df = core_stats_from_counts(counts_df[CORE_COUNT_COLS].reset_index(drop=True))
+    opp_df = core_stats_from_counts(opp_counts_df[CORE_COUNT_COLS].reset_index(drop=True))
+    stats_df = add_team_opp_derived_stats(pd.concat([team_df, opp_df.add_suffix('_opp')], axis=1))
+    stats_df = pd.concat([counts_df[keys].reset_index(drop=True), stats_df], axis=1)
+    return stats_df[keys + STATS_COLS + [f'{x}_opp' for x in STATS_COLS] +
+                    TEAM_EXTRA_COLS + [f'{x}_opp' for x in TEAM_EXTRA_COLS]]
+
+
+def accumulate_team_stats(team_stats_df: pd.DataFrame, by=('team',)) -> pd.DataFrame:
+    """Accumulate team stats (e.g., of the games of a season) by summing their counts
+
+    Rows may be team-game stats (see build_team_stats_df()) or already accumulated ones (with column games),
+    so a season table is updated with new games by accumulating it together with their team-game rows.
+
+    Args:
+        team_stats_df (pd.DataFrame): team stats with the counts of each team and its opponent
+        by (tuple(str)): columns to accumulate by (default: team)
+
+    Returns:
+        pd.DataFrame: one row per value of by, with number of games and the stats computed from the summed counts
+    """
+    by = list(by)
+    opp_cols = [f'{col}_opp' for col in CORE_COUNT_COLS]
+    df = team_stats_df.assign(games=team_stats_df['games'].fillna(1) if 'games' in team_stats_df else 1)
+    sums_df = df.groupby(by, sort=True)[['games'] + CORE_COUNT_COLS + opp_cols].sum().reset_index()
+    return team_stats_from_counts(sums_df[by + ['games'] + CORE_COUNT_COLS],
+                                  sums_df[opp_cols].set_axis(CORE_COUNT_COLS, axis=1))
+
+
+def update_team_stats(team_stats_df: pd.DataFrame, new_df: pd.DataFrame, old_df: pd.DataFrame = None,
+                      by=('team',)) -> pd.DataFrame:
+    """Update accumulated team stats with the team-game stats of new games, without summing all games again
+
+    The counts of the new games are added to the accumulated ones and those of games replaced (e.g., games
+    whose data changed, now in new_df) are subtracted; stats are then computed from the updated counts.
+
+    Args:
+        team_stats_df (pd.DataFrame): accumulated team stats (see accumulate_team_stats())
+        new_df (pd.DataFrame): team-game stats of the new games (see build_team_stats_df())
+        old_df (pd.DataFrame): team-game stats replaced by those in new_df, if any
+        by (tuple(str)): columns accumulated by (default: team)
+
+    Returns:
+        pd.DataFrame: one row per value of by with games left, as accumulate_team_stats()
+    """
+    count_cols = ['games'] + CORE_COUNT_COLS + [f'{col}_opp' for col in CORE_COUNT_COLS]
+    dfs = [team_stats_df, new_df.assign(games=1)]
+    if old_df is not None and old_df.shape[0] > 0:
+        old_df = old_df.assign(games=1)
+        old_df[count_cols] = -old_df[count_cols]
+        dfs.append(old_df)
+    team_stats_df = accumulate_team_stats(pd.concat([df[list(by) + count_cols] for df in dfs], ignore_index=True), by)
+    return team_stats_df[team_stats_df['games'] > 0].reset_index(drop=True)
+
+
+def build_stats_df(pbp_df: pd.DataFrame, tno: int, agg_col: str = None, splits: list = None):
     """Build a dataframe with full statistics for a team
 
     Args:
         pbp_df (pd.DataFrame): play-by-play data for a game
         tno (int): team number to extract stats for
-        agg_col (str): the column to group by (if any)
+        agg_col (str): the column to group by (e.g., a stint column); if None, the stats of the team for all
+            the plays given (see build_team_stats_df())
+        splits (list(str)): splits to compute in the same pass, if any (see SPLITS and build_split_stats_df())
 
     Returns:
-        pd.DataFrame: _description_
+        pd.DataFrame: the stats by agg_col (and, if splits given, a second table with the stats of each split)
     """
-    def build_core_stats(pbp_df: pd.DataFrame, agg_col = (lambda x: True)) -> pd.DataFrame:
+    if agg_col is None:
+        team_stats_df = build_team_stats_df(pbp_df)
+        return team_stats_df.loc[team_stats_df['tno'] == tno].reset_index(drop=True)
+    if splits:
+        return build_split_stats_df(pbp_df, tno, agg_col, splits)
+
+    def build_core_stats(pbp_df: pd.DataFrame, agg_col: str) -> pd.DataFrame:
         """Build the core stats table aggregated by column agg_col (usually, a stint column, with stint id for a team)
 
         Args:
@@ -477,36 +885,12 @@ def build_stats_df(pbp_df: pd.DataFrame, tno: int, agg_col = (lambda x: True)) -
         Returns:
             pd.DataFrame: a table with various stats for each value in agg_col
         """
-
-        # tuples (name, default value, True if attemps/made/per, mask)
-        stats = [ (F_AST, 0, False, pbp_df['actionType'] == 'assist'),
-                # points
-                (F_2PTFG, 0, True, pbp_df['actionType'] == '2pt'),
-                (F_PATR, 0, True, pbp_df['subType'].isin(['layup', 'drivinglayup', 'dunk'])),
-                (F_3PTFG, 0, True, pbp_df['actionType'] == '3pt'),
-                (F_FT, 0, True, pbp_df['actionType'] == 'freethrow'),
-                # others
-                (F_REB, 0, False, pbp_df['actionType'] == 'rebound'),
-                (F_OREB, 0, False, (pbp_df['actionType'] == 'rebound') & (pbp_df['subType'] == 'offensive')),
-                (F_ODREB, 0, False, (pbp_df['actionType'] == 'rebound') & (pbp_df['subType'] == 'offensivedeadball')),
-                (F_DREB, 0, False, (pbp_df['actionType'] == 'rebound') & (pbp_df['subType'] == 'defensive')),
-                (F_STL, 0, False, pbp_df['actionType'] == 'steal'),
-                (F_BLK, 0, False, pbp_df['actionType'] == 'block'),
-                #turnover types
-                (F_TOV, 0, False, pbp_df['actionType'] == 'turnover'),
-                (F_BALLHAND, 0, False, (pbp_df['actionType'] == 'turnover') &
-                                        (pbp_df['subType'].isin(['ballhandling', 'doubledribble', 'travel'])) ),
-                (F_BADPASS, 0, False, (pbp_df['actionType'] == 'turnover') & (pbp_df['subType'] == 'badpass') ),
-                (F_OFOUL, 0, False, (pbp_df['actionType'] == 'turnover') & (pbp_df['subType'] == 'offensive') ),
-                (F_3SEC, 0, False, (pbp_df['actionType'] == 'turnover') & (pbp_df['subType'] == '3sec') ),
-                (F_8SEC, 0, False, (pbp_df['actionType'] == 'turnover') & (pbp_df['subType'] == '8sec') ),
-                (F_24SEC, 0, False, (pbp_df['actionType'] == 'turnover') & (pbp_df['subType'] == '24sec') )
-        ]
         # start with a dummy df for full left join with one row per stint number: 1,2,3,...,N
         stats_dfs = [pd.DataFrame({agg_col : pbp_df[agg_col].unique()})] 
 
-        for stat in stats:  # for each stat, compute a dataframe df (and add it to stats_dfs)
-            name, default, rate, mask = stat
+        for stat in CORE_STATS:  # for each stat, compute a dataframe df (and add it to stats_dfs)
+            name, default, rate, action_types, sub_types = stat
+            mask = core_stat_mask(pbp_df, action_types, sub_types)
             name_a = f'{name}a' if rate else name
             name_m = f'{name}m'
             name_p = f'{name}p'
@@ -525,48 +909,15 @@ def build_stats_df(pbp_df: pd.DataFrame, tno: int, agg_col = (lambda x: True)) -
             stats_dfs.append(df)
 
         # finally, join all dfs computed (one per stat)
-        df = reduce(lambda df1, df2: df1.merge(df2, "left"), stats_dfs)
+        with metrics.span('build_core_stats_merge'):
+            df = reduce(lambda df1, df2: df1.merge(df2, "left"), stats_dfs)
 
         # fill all NaN with 0 - These ones it is correct as they are just counting
         df.fillna(0, inplace=True)
 
-
         # Now, calculate complex stats from prev columns using the merged df
         # --------------------------------------------------
-        # calculate shooting stats
-        df[F_PTS] = 2*df[F_2PTFGM] + 3*df[F_3PTFGM] + df[F_FTM]
-        df[F_FGA] = df[F_2PTFGA] + df[F_3PTFGA]
-        df[F_FGM] = df[F_2PTFGM] + df[F_3PTFGM]
-        df[F_FGP] = tools.percent(df[F_FGM], df[F_FGA])
-
-        # # calculate home possessions (possessions only count change of hands, not offensive rebounds and new shots)
-        df[F_POSS] = df[F_2PTFGA] + df[F_3PTFGA] + 0.44*df[F_FTA] + df[F_TOV] - df[F_OREB]
-        df.loc[df[F_POSS] < 0, 'poss'] = 0
-
-        # calculate offensive rating
-        df[F_ORTG] = tools.percent(df[F_PTS], df[F_POSS])
-
-        # playmaking stats
-        df[F_FGMASTP] = tools.percent(df[F_AST], df[F_2PTFGM] + df[F_3PTFGM])
-
-        # total rebounds
-        df[F_TRB] = df[F_DREB] + df[F_OREB]
-
-        #calculate rates
-        df[F_BLKR] = tools.percent(df[F_BLK], df[F_POSS])
-        df[F_STLR] = tools.percent(df[F_STL], df[F_POSS])
-        df[F_ASTR] = tools.percent(df[F_AST], df[F_POSS])
-        df[F_TOVR] = tools.percent(df[F_TOV], df[F_POSS])
-
-        # TS% = true shooting percentage, combines 2pts, 3pts, ft
-        df[F_TSP] = tools.percent(df[F_PTS], 2*(df[F_FGA] + 0.44*df[F_FTA]))
-
-        # Fill all NaN with 0
-        # This is not correct: NaN will arise when dividing by 0 (for %), and we want to keep NaN which is different from having 0
-        # for example: orebs/rebs will give % of orebs, but if rebs = 0 (no rebounds taken), we don't want to have 0%!
-        # df.fillna(0, inplace=True)
-
-        return df
+        return add_core_derived_stats(df)
 
     ##############################################
     # Compute stint stat data for the team tno
@@ -581,38 +932,7 @@ def build_stats_df(pbp_df: pd.DataFrame, tno: int, agg_col = (lambda x: True)) -
     stats_df.insert(0, 'tno', tno)    # these stats are for team tno
 
     # 4. calculate stats that need both team and opp stats
-    # for the team
-    stats_df[F_DRTG] = tools.percent(stats_df[f'{F_PTS}_opp'], stats_df[f'{F_POSS}_opp']) # drtg = defensive rating
-    stats_df[F_NRTG] = stats_df[F_ORTG] - stats_df[F_DRTG]    # net rating: offensive rating - defensive rating
-
-    stats_df[F_DREBC] = stats_df[F_DREB] + stats_df[f'{F_OREB}_opp']
-    stats_df[F_DREBP] = tools.percent(stats_df[F_DREB], stats_df[F_DREB] + stats_df[f'{F_OREB}_opp'])
-    stats_df[F_OREBC] = stats_df[F_OREB] + stats_df[f'{F_DREB}_opp']
-    stats_df[F_OREBP] = tools.percent(stats_df[F_OREB], stats_df[F_OREB] + stats_df[f'{F_DREB}_opp'])
-    stats_df[F_TRBR] = tools.percent(stats_df[F_TRB],
-                                    stats_df[F_OREB] +
-                                    stats_df[F_DREB] +
-                                    stats_df[f'{F_OREB}_opp'] +
-                                    stats_df[f'{F_DREB}_opp'])
-    stats_df[F_OPPFGABLK] = tools.percent(stats_df[F_BLK], stats_df[f'{F_FGA}_opp'])
-
-    # # for the opponent (same stats as team)
-    stats_df[f'{F_DRTG}_opp'] = tools.percent(stats_df[F_PTS], stats_df[F_POSS])
-    stats_df[f'{F_NRTG}_opp'] = stats_df[f'{F_ORTG}_opp'] - stats_df[f'{F_DRTG}_opp']
-
-    stats_df[f'{F_DREBC}_opp'] = stats_df[f'{F_DREB}_opp'] + stats_df[F_OREB]
-    stats_df[f'{F_DREBP}_opp'] = tools.percent(stats_df[f'{F_DREB}_opp'], stats_df[f'{F_DREB}_opp'] + stats_df[F_OREB])
-    stats_df[f'{F_OREBC}_opp'] = stats_df[f'{F_OREB}_opp'] + stats_df[F_DREB]
-    stats_df[f'{F_OREBP}_opp'] = tools.percent(stats_df[f'{F_OREB}_opp'], stats_df[f'{F_OREB}_opp'] + stats_df[F_DREB])
-    stats_df[f'{F_TRBR}_opp'] = tools.percent(stats_df[f'{F_TRB}_opp'],
-                                    stats_df[f'{F_OREB}_opp'] +
-                                    stats_df[f'{F_DREB}_opp'] +
-                                    stats_df[F_OREB] +
-                                    stats_df[F_DREB])
-    stats_df[f'{F_OPPFGABLK}_opp'] = tools.percent(stats_df[f'{F_BLK}_opp'], stats_df[F_FGA])
-
-
-    return stats_df
+    return add_team_opp_derived_stats(stats_df)
 
 
 
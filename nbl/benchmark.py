@@ -0,0 +1,249 @@
+"""
+Benchmark of the game pipeline stages over cached games, to track performance between commits
+
+Runs offline over season folders with cached game files (data-<game_id>.json, as left by the scrapper)
+and measures each stage of the pipeline on its own, per game and per season (totals over its games):
+
+    json_load, get_pbp_df, get_starters, pbp_stints_extract, pbp_add_stint_col,
+    build_stats_df, get_players_stats and the full build_game_stints_stats_df
+
+Time is the best of a few runs of the stage (perf_counter); memory is the peak of Python allocations
+(including numpy/pandas buffers) in an extra run traced with tracemalloc. The inputs of each stage are
+the outputs of the previous ones, computed outside the measure.
+
+Results are saved as JSON (by default benchmark-<git commit>.json) and can be compared with the
+results of a previous commit; exit code is 1 if some stage got slower than the threshold. Examples:
+
+    python -m nbl.benchmark test/ --runs 5
+    python -m nbl.benchmark data/22_23 data/23_24 --out new.json --compare benchmark-6060913.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+from nbl import tools, bball_stats
+
+import logging
+log = logging.getLogger("main.benchmark")
+
+BENCHMARK_RUNS = 3          # runs of each stage, the best one is taken
+REGRESSION_THRESHOLD = 0.10 # a stage is slower if it takes more than 10% longer than in the base results
+
+
+# Each stage is (name, function to measure, name to store its output for later stages).
+# Functions take the game folder, id and the outputs of previous stages.
+STAGES = [
+    ('json_load', lambda dir, game_id, out: tools.get_json_data(game_id, dir=dir), 'json'),
+    ('get_pbp_df', lambda dir, game_id, out: bball_stats.get_pbp_df(out['json']), 'pbp_df'),
+    ('get_starters', lambda dir, game_id, out: (bball_stats.get_starters(out['json'], 1),
+                                                bball_stats.get_starters(out['json'], 2)), 'starters'),
+    ('pbp_stints_extract', lambda dir, game_id, out: (bball_stats.pbp_stints_extract(out['pbp_df'], out['starters'][0], 1),
+                                                      bball_stats.pbp_stints_extract(out['pbp_df'], out['starters'][1], 2)), 'stints'),
+    ('pbp_add_stint_col', lambda dir, game_id, out: bball_stats.pbp_add_stint_col(
+                                bball_stats.pbp_add_stint_col(out['pbp_df'], out['stints'][0], "stint1")[1],
+                                out['stints'][1], "stint2")[1], 'pbp_stints_df'),
+    ('build_stats_df', lambda dir, game_id, out: (bball_stats.build_stats_df(out['pbp_stints_df'], 1, "stint1"),
+                                                  bball_stats.build_stats_df(out['pbp_stints_df'], 2, "stint2")), None),
+    ('get_players_stats', lambda dir, game_id, out: bball_stats.get_players_stats(out['json']), None),
+    ('build_game_stints_stats_df', lambda dir, game_id, out: bball_stats.build_game_stints_stats_df(out['json'], game_id), None),
+]
+STAGE_NAMES = [name for (name, _, _) in STAGES]
+
+
+def get_game_ids(data_dir) -> list:
+    """Get the ids of the games cached in a folder (files data-<game_id>.json)
+
+    Args:
+        data_dir (str | Path): folder of the season
+
+    Returns:
+        list(str): ids of the games, sorted
+    """
+    return sorted(file.stem[len("data-"):] for file in Path(data_dir).glob("data-*.json"))
+
+
+def measure(fun, runs=BENCHMARK_RUNS):
+    """Measure time (best of the runs) and peak memory (one extra traced run) of a function
+
+    Args:
+        fun (function): function with no arguments to measure
+        runs (int): number of timed runs
+
+    Returns:
+        tuple(object, float, float): output of the function, seconds and peak memory in MB
+    """
+    secs = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = fun()
+        secs.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fun()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return output, min(secs), peak / 2**20
+
+
+def benchmark_game(data_dir, game_id, runs=BENCHMARK_RUNS) -> dict:
+    """Benchmark every stage of the pipeline on a cached game
+
+    Args:
+        data_dir (str | Path): folder with the game file
+        game_id (str): id of the game
+        runs (int): number of timed runs of each stage
+
+    Returns:
+        dict: seconds and peak memory (MB) of each stage, by stage name
+    """
+    results = {}
+    outputs = {}
+    for (name, fun, output_name) in STAGES:
+        output, secs, peak_mb = measure(lambda: fun(str(data_dir), game_id, outputs), runs)
+        if output_name is not None:
+            outputs[output_name] = output
+        results[name] = {'secs': round(secs, 5), 'peak_mb': round(peak_mb, 2)}
+    return results
+
+
+def benchmark_season(data_dir, runs=BENCHMARK_RUNS, max_games=None) -> dict:
+    """Benchmark every stage of the pipeline on the games cached in a season folder
+
+    Args:
+        data_dir (str | Path): folder with the game files of the season
+        runs (int): number of timed runs of each stage
+        max_games (int): max number of games to benchmark (all if None)
+
+    Returns:
+        dict: number of games, stage totals over the season (seconds, mean seconds per game, max peak memory)
+            and the results of each game
+    """
+    game_ids = get_game_ids(data_dir)[:max_games]
+    games = {}
+    for i, game_id in enumerate(game_ids, start=1):
+        log.info(f"Benchmarking game {game_id} ({i}/{len(game_ids)}) in {data_dir}")
+        games[game_id] = benchmark_game(data_dir, game_id, runs)
+
+    stages = {}
+    for name in STAGE_NAMES:
+        secs = sum(game[name]['secs'] for game in games.values())
+        stages[name] = {'secs': round(secs, 4),
+                        'secs_per_game': round(secs / len(games), 5) if games else None,
+                        'peak_mb': max((game[name]['peak_mb'] for game in games.values()), default=None)}
+
+    return {'no_games': len(games), 'stages': stages, 'games': games}
+
+
+def git_commit() -> str:
+    """Short id of the git commit of the package code (None if not in a git repo)"""
+    try:
+        proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True)
+        return proc.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(data_dirs: list, runs=BENCHMARK_RUNS, max_games=None) -> dict:
+    """Benchmark the pipeline stages on various season folders
+
+    Args:
+        data_dirs (list(str)): season folders with cached game files
+        runs (int): number of timed runs of each stage
+        max_games (int): max number of games to benchmark per season (all if None)
+
+    Returns:
+        dict: the results, with the environment (commit, python, pandas) and the results of each season
+    """
+    import pandas as pd
+
+    return {'commit': git_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'runs': runs,
+            'seasons': {str(data_dir): benchmark_season(data_dir, runs, max_games) for data_dir in data_dirs}}
+
+
+def compare(base: dict, new: dict, threshold=REGRESSION_THRESHOLD) -> list:
+    """Compare the season stage results of two benchmarks (only seasons and stages in both)
+
+    Stages are compared on the mean time per game, so seasons benchmarked with different
+    number of games can still be compared.
+
+    Args:
+        base (dict): base results (e.g., of a previous commit)
+        new (dict): new results
+        threshold (float): relative slowdown from which a stage is a regression
+
+    Returns:
+        list(dict): one row per season and stage, with base and new seconds per game, ratio new/base
+            and whether it is a regression
+    """
+    rows = []
+    for season, new_season in new['seasons'].items():
+        if season not in base['seasons']:
+            continue
+        base_stages = base['seasons'][season]['stages']
+        for name, stage in new_season['stages'].items():
+            if name not in base_stages or not base_stages[name]['secs_per_game']:
+                continue
+            base_secs, new_secs = base_stages[name]['secs_per_game'], stage['secs_per_game']
+            ratio = new_secs / base_secs
+            rows.append({'season': season, 'stage': name, 'base': base_secs, 'new': new_secs,
+                         'ratio': round(ratio, 3), 'regression': ratio > 1 + threshold})
+    return rows
+
+
+def print_results(results: dict):
+    """Print the stage totals of each season"""
+    for season, season_results in results['seasons'].items():
+        print(f"Season {season} - {season_results['no_games']} games")
+        print(f"    {'stage':30} {'secs':>9} {'secs/game':>10} {'peak MB':>8}")
+        for name, stage in season_results['stages'].items():
+            print(f"    {name:30} {stage['secs']:9.4f} {stage['secs_per_game'] or 0:10.5f} {stage['peak_mb'] or 0:8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the game pipeline over cached games.")
+    parser.add_argument('data_dirs', nargs='+',
+                        help='Season folders with cached game files data-<game_id>.json.')
+    parser.add_argument('--runs', type=int, default=BENCHMARK_RUNS,
+                        help='Timed runs of each stage, the best one is taken (default: %(default)s).')
+    parser.add_argument('--max-games', type=int,
+                        help='Max number of games to benchmark per season (default: all).')
+    parser.add_argument('--out', type=str,
+                        help='File to save results to (default: benchmark-<git commit>.json).')
+    parser.add_argument('--compare', type=str, metavar='BASE',
+                        help='Results file to compare with (e.g., of a previous commit).')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='Relative slowdown of a stage reported as a regression (default: %(default)s).')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    results = run_benchmark(args.data_dirs, args.runs, args.max_games)
+    print_results(results)
+
+    out_file = args.out or f"benchmark-{results['commit'] or time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(out_file, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"Results saved in {out_file}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        rows = compare(base, results, args.threshold)
+        print(f"Comparison with {args.compare} (commit {base.get('commit')}), seconds per game:")
+        for row in rows:
+            print(f"    {row['season']:20} {row['stage']:30} {row['base']:10.5f} {row['new']:10.5f} "
+                  f"x{row['ratio']:.3f}{'  <== SLOWER' if row['regression'] else ''}")
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
@@ -0,0 +1,219 @@
+"""
+Bootstrap confidence intervals for lineup and player on/off ratings
+
+Ratings of a lineup (ortg, drtg, nrtg) often come from a few possessions. To show how much they could
+move, the units of each lineup (its matchups with each opponent lineup in each game: points and
+possessions of both teams, see nbl.matchups) are resampled with replacement, and the ratings computed
+again on each replicate. All the replicates of all the lineups are one array computation: the resampled
+unit indices are drawn as a (replicates x units) array, offset into the units of each group, and summed
+per group with np.add.reduceat. Replicates are drawn in chunks to bound memory, from a generator with a
+fixed seed, so intervals are reproducible.
+
+Player on/off ratings resample the units of the team as a whole, so the on and off ratings of all its
+players, and their differences, come from the same replicates (see on_off_df()). Lineups and players are
+keyed by the ids of the players (see nbl.registry), with names only shown.
+"""
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
+from nbl.config import *
+
+import logging
+log = logging.getLogger("main.bootstrap")
+
+BOOTSTRAP_REPLICATES = 1000     # replicates of each group
+BOOTSTRAP_LEVEL = 0.9           # confidence level of the intervals
+BOOTSTRAP_SEED = 2023           # seed of the random generator (same data, same intervals)
+BOOTSTRAP_CHUNK = 4_000_000     # max resampled values held in memory at once
+
+RATING_COUNTS = [F_PTS, F_POSS, f'{F_PTS}_opp', f'{F_POSS}_opp']    # additive counts behind the ratings
+
+
+def lineup_units_df(matchups_df: pd.DataFrame) -> pd.DataFrame:
+    """Units to resample: the counts behind the ratings of each lineup against each opponent lineup in a game
+
+    Args:
+        matchups_df (pd.DataFrame): matchups of the games (see matchups.build_game_matchups_df())
+
+    Returns:
+        pd.DataFrame: one row per matchup with some possession, with the team, lineup ids and the points and
+            possessions of both teams
+    """
+    units_df = matchups_df.loc[(matchups_df[F_POSS] > 0) | (matchups_df[f'{F_POSS}_opp'] > 0),
+                               ['team', 'lineup_ids'] + RATING_COUNTS]
+    return units_df.reset_index(drop=True)
+
+
+def resample_sums(counts: np.ndarray, starts: np.ndarray, replicates=BOOTSTRAP_REPLICATES,
+                  seed=BOOTSTRAP_SEED, chunk=BOOTSTRAP_CHUNK) -> np.ndarray:
+    """Resample the units of each group with replacement and sum their counts, for all groups at once
+
+    Args:
+        counts (np.ndarray): counts of each unit (units x counts), with the units of each group contiguous
+        starts (np.ndarray): position of the first unit of each group
+        replicates (int): number of replicates
+        seed (int): seed of the random generator
+        chunk (int): max number of resampled values held at once
+
+    Returns:
+        np.ndarray: the sums of the counts of each group in each replicate (replicates x groups x counts)
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    sizes = np.diff(np.append(starts, len(counts)))
+    unit_start = np.repeat(starts, sizes)   # for each unit, the first unit of its group (and group size)
+    unit_size = np.repeat(sizes, sizes)
+
+    step = max(1, chunk // max(counts.size, 1))
+    sums = []
+    for done in range(0, replicates, step):
+        draws = rng.random((min(step, replicates - done), len(counts)))
+        idx = unit_start + (draws * unit_size).astype(int)
+        sums.append(np.add.reduceat(counts[idx], starts, axis=1))
+    return np.concatenate(sums)
+
+
+def ratings(sums: np.ndarray) -> dict:
+    """Offensive, defensive and net ratings from summed counts (last axis as in RATING_COUNTS)"""
+    import numpy as np
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ortg = np.where(sums[..., 1] > 0, 100 * sums[..., 0] / sums[..., 1], np.nan)
+        drtg = np.where(sums[..., 3] > 0, 100 * sums[..., 2] / sums[..., 3], np.nan)
+    return {F_ORTG: ortg, F_DRTG: drtg, F_NRTG: ortg - drtg}
+
+
+def intervals(values: dict, level=BOOTSTRAP_LEVEL) -> dict:
+    """Percentile intervals of each stat over the replicates (replicates with no possessions are left out)
+
+    Args:
+        values (dict): values of each stat (replicates x groups)
+        level (float): confidence level
+
+    Returns:
+        dict: columns <stat>_lo and <stat>_hi, with the bounds for each group
+    """
+    import numpy as np
+
+    cis = {}
+    for stat, array in values.items():
+        # sorted once for both bounds (NaN go last), interpolated as np.percentile on the valid values
+        array = np.sort(array, axis=0)
+        valid = (~np.isnan(array)).sum(axis=0)
+        for bound, q in [('lo', (1 - level) / 2), ('hi', (1 + level) / 2)]:
+            pos = np.maximum(valid - 1, 0) * q
+            below = np.take_along_axis(array, np.floor(pos).astype(int)[None], axis=0)[0]
+            above = np.take_along_axis(array, np.ceil(pos).astype(int)[None], axis=0)[0]
+            cis[f'{stat}_{bound}'] = (below + (above - below) * (pos - np.floor(pos))).round(2)
+    return cis
+
+
+def lineup_cis_df(matchups_df: pd.DataFrame, replicates=BOOTSTRAP_REPLICATES, level=BOOTSTRAP_LEVEL,
+                  seed=BOOTSTRAP_SEED) -> pd.DataFrame:
+    """Bootstrap confidence intervals of the ratings of each lineup in a season
+
+    Args:
+        matchups_df (pd.DataFrame): matchups of the games (see matchups.build_game_matchups_df())
+        replicates (int): number of replicates
+        level (float): confidence level
+        seed (int): seed of the random generator
+
+    Returns:
+        pd.DataFrame: one row per team and lineup (ids) with the bounds of ortg, drtg and nrtg
+    """
+    import numpy as np
+    import pandas as pd
+
+    units_df = lineup_units_df(matchups_df).sort_values(['team', 'lineup_ids'], kind='stable', ignore_index=True)
+    keys_df = units_df[['team', 'lineup_ids']]
+    starts = np.flatnonzero(~keys_df.duplicated().to_numpy())
+
+    sums = resample_sums(units_df[RATING_COUNTS].to_numpy(dtype=float), starts, replicates, seed)
+    cis_df = pd.DataFrame(intervals(ratings(sums), level))
+    return pd.concat([keys_df.iloc[starts].reset_index(drop=True), cis_df], axis=1)
+
+
+def add_lineup_cis(lineups_df: pd.DataFrame, matchups_df: pd.DataFrame, **kwargs) -> pd.DataFrame:
+    """Add the bootstrap intervals of the ratings to a season table of lineups (see lineup_cis_df())
+
+    Args:
+        lineups_df (pd.DataFrame): season table by team and lineup ids (see matchups.accumulate_matchups())
+        matchups_df (pd.DataFrame): matchups of the games of the season
+
+    Returns:
+        pd.DataFrame: the lineups table with columns ortg_lo, ortg_hi, drtg_lo, drtg_hi, nrtg_lo and nrtg_hi
+    """
+    cis_df = lineup_cis_df(matchups_df, **kwargs)
+    lineups_df = lineups_df.drop(columns=cis_df.columns.drop(['team', 'lineup_ids']), errors='ignore')
+    return lineups_df.merge(cis_df, on=['team', 'lineup_ids'], how='left')
+
+
+def on_off_df(matchups_df: pd.DataFrame, ci=False, replicates=BOOTSTRAP_REPLICATES, level=BOOTSTRAP_LEVEL,
+              seed=BOOTSTRAP_SEED, names=None) -> pd.DataFrame:
+    """Ratings of each team with each of its players on and off court in a season
+
+    The units of a team are resampled once per replicate for all its players: the number of times each
+    unit is drawn (replicates x units) times the counts of each player on court gives the on sums of all
+    players in one matrix product, and the off sums are the rest of the team sums.
+
+    Args:
+        matchups_df (pd.DataFrame): matchups of the games (see matchups.build_game_matchups_df())
+        ci (bool): add bootstrap intervals of the on ratings and of the on-off net rating
+        replicates (int): number of replicates
+        level (float): confidence level
+        seed (int): seed of the random generator
+        names (function): name to show of a player id (e.g., registry.PlayerRegistry.name()), if any
+
+    Returns:
+        pd.DataFrame: one row per team and player (id, and name if names given) with possessions and ratings
+            on and off court, and the difference of the net ratings (on_off)
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    units_df = lineup_units_df(matchups_df)
+    team_dfs = []
+    for team, team_units_df in units_df.groupby('team', sort=True):
+        counts = team_units_df[RATING_COUNTS].to_numpy(dtype=float)
+        on_df = pd.get_dummies(team_units_df['lineup_ids'].explode().dropna().astype('int64')).groupby(level=0).max()
+        on_df = on_df.reindex(team_units_df.index, fill_value=False)
+        on = on_df.to_numpy(dtype=float)                        # units x players
+        on_counts = on[:, :, None] * counts[:, None, :]         # units x players x counts
+
+        team_df = pd.DataFrame({'team': team, 'player_id': on_df.columns})
+        if names:
+            team_df['player'] = [names(id) for id in on_df.columns]
+        team_df = pd.concat([team_df, on_off_ratings(on_counts.sum(axis=0), counts.sum(axis=0))], axis=1)
+        if ci:
+            # times each unit is drawn in each replicate
+            weights = rng.multinomial(len(counts), np.full(len(counts), 1 / len(counts)), size=replicates)
+            on_sums = (weights @ on_counts.reshape(len(counts), -1)).reshape(replicates, on.shape[1], -1)
+            values = on_off_values(on_sums, (weights @ counts)[:, None, :])
+            team_df = pd.concat([team_df, pd.DataFrame(intervals(values, level))], axis=1)
+        team_dfs.append(team_df)
+
+    on_off_df = pd.concat(team_dfs, ignore_index=True)
+    return on_off_df.sort_values(f'{F_POSS}_on', ascending=False, ignore_index=True)
+
+
+def on_off_values(on_sums: np.ndarray, team_sums: np.ndarray) -> dict:
+    """Ratings on court and on-off net rating from the sums of the players on court and of the team"""
+    on_ratings, off_ratings = ratings(on_sums), ratings(team_sums - on_sums)
+    values = {f'{stat}_on': on_ratings[stat] for stat in on_ratings}
+    values['on_off'] = on_ratings[F_NRTG] - off_ratings[F_NRTG]
+    return values
+
+
+def on_off_ratings(on_sums: np.ndarray, team_sums: np.ndarray) -> pd.DataFrame:
+    """Possessions and ratings on and off court of each player (sums of counts: players x counts)"""
+    import pandas as pd
+
+    off_sums = team_sums - on_sums
+    on_ratings, off_ratings = ratings(on_sums), ratings(off_sums)
+    ratings_df = pd.DataFrame({f'{F_POSS}_on': on_sums[:, 1],
+                               **{f'{stat}_on': values for stat, values in on_ratings.items()},
+                               f'{F_POSS}_off': off_sums[:, 1],
+                               **{f'{stat}_off': values for stat, values in off_ratings.items()},
+                               'on_off': on_ratings[F_NRTG] - off_ratings[F_NRTG]})
+    return ratings_df.round(2)
@@ -4,6 +4,10 @@ URL_FIBA_LIVESTATS = 'http://www.fibalivestats.com/data'
 # where already processed data is saved
 data_dir = "data/"
 
+# HTTP connections
+HTTP_TIMEOUT = 30       # seconds to wait for the server
+HTTP_POOL_SIZE = 8      # connections kept alive by the shared HTTP session
+
 # action types and subtypes that should be ignored for stats
 ACT_NON_STATS = ['period', 'game', 'substitution']
 ACTSSUB_NON_STATS = ['startperiod']
@@ -0,0 +1,324 @@
+"""
+Equivalence harness to check a candidate engine computes the same tables as the reference one
+
+Any faster way of computing stints and stint stats must give the same numbers as the reference
+implementation in bball_stats (build_game_stints_stats_df(), pbp_stints_extract(), pbp_add_stint_col()...),
+otherwise the published lineup stats would shift silently.
+
+An engine is a function taking the JSON data and id of a game and returning its tables:
+
+    {'stint_stats_df': ..., 'stints_df': ..., 'players_df': ...}
+
+Both engines are run over a corpus of cached games (data-<game_id>.json files) and synthetic games
+(see nbl.synth, every other one with its running scores given as strings), and tables are compared row by row (matched by their key columns) with per-column
+tolerances and NaN semantics (see COLUMN_RULES). For each game that differs, the first differing
+table, team, stint (or player) and column is reported. Exit code is 1 if some game differs. Examples:
+
+    python -m nbl.equivalence data/22_23 --candidate mymodule:build_tables
+    python -m nbl.equivalence data/22_23 --synth 500 --replace mymodule:pbp_stints_extract
+    python -m nbl.equivalence --synth 500 --replace pbp_add_stint_col=mymodule:add_stint_col_fast
+
+The stint stats computed along the splits (see bball_stats.SPLITS) are checked with the built-in splits_engine:
+
+    python -m nbl.equivalence data/22_23 --synth 50 --candidate nbl.equivalence:splits_engine
+"""
+import sys
+import json
+import math
+import argparse
+import importlib
+from pathlib import Path
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from nbl import bball_stats, synth
+from nbl.benchmark import get_game_ids
+
+import logging
+log = logging.getLogger("main.equivalence")
+
+# columns identifying the rows of each table (rows are matched on them, not on their position)
+TABLE_KEYS = {'stint_stats_df': ['tno', 'stint'],
+              'stints_df': ['tno', 'id'],
+              'players_df': ['tno', 'player']}
+
+# Rule to compare numeric columns: (relative tolerance, absolute tolerance, NaN semantics), where NaN is
+#   'equal': NaN only matches NaN (e.g., a percentage with no attempts must stay undefined)
+#   'zero': NaN matches 0 too (e.g., a count an engine may leave empty)
+DEFAULT_RULE = (1e-9, 1e-9, 'equal')
+COLUMN_RULES = {'mins': (0, 1e-6, 'equal')}
+
+
+def reference_engine(game_json: dict, game_id) -> dict:
+    """Compute the tables of a game with the reference implementation
+
+    Args:
+        game_json (dict): json dict data of the game
+        game_id (str): id of the game
+
+    Returns:
+        dict: stint stats, stints and players tables of the game
+    """
+    result = bball_stats.build_game_stints_stats_df(game_json, game_id)
+    return {'stint_stats_df': result['stint_stats_df'],
+            'stints_df': result['stints_df'],
+            'players_df': bball_stats.get_players_stats(game_json)}
+
+
+def splits_engine(game_json: dict, game_id) -> dict:
+    """Compute the tables of a game with the stint stats counted along all splits, as the scrapper does
+
+    Args:
+        game_json (dict): json dict data of the game
+        game_id (str): id of the game
+
+    Returns:
+        dict: stint stats, stints and players tables of the game
+    """
+    result = bball_stats.build_game_stints_stats_df(game_json, game_id, splits=list(bball_stats.SPLITS))
+    return {'stint_stats_df': result['stint_stats_df'],
+            'stints_df': result['stints_df'],
+            'players_df': bball_stats.get_players_stats(game_json)}
+
+
+@contextmanager
+def replaced(functions: dict):
+    """Temporarily replace functions of bball_stats (e.g., a faster pbp_stints_extract())
+
+    Args:
+        functions (dict): new functions, by the name of the bball_stats function they replace
+    """
+    originals = {name: getattr(bball_stats, name) for name in functions}
+    try:
+        for name, fun in functions.items():
+            setattr(bball_stats, name, fun)
+        yield
+    finally:
+        for name, fun in originals.items():
+            setattr(bball_stats, name, fun)
+
+
+def replacing_engine(functions: dict):
+    """Build an engine that runs the reference implementation with some of its functions replaced
+
+    Args:
+        functions (dict): new functions, by the name of the bball_stats function they replace
+
+    Returns:
+        function: the engine
+    """
+    def engine(game_json, game_id):
+        with replaced(functions):
+            return reference_engine(game_json, game_id)
+    return engine
+
+
+def load_function(spec: str):
+    """Load a function given as MODULE:FUNCTION (e.g., mymodule:build_tables)"""
+    module, name = spec.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _values_equal(ref, cand) -> bool:
+    """Compare two non-numeric values (lineups, intervals, names...), NaN/None matching each other"""
+    if isinstance(ref, (list, tuple, set, frozenset, np.ndarray)) or isinstance(cand, (list, tuple, set, frozenset, np.ndarray)):
+        return list(ref) == list(cand) if not isinstance(ref, (set, frozenset)) else set(ref) == set(cand)
+    if pd.isna(ref) and pd.isna(cand):
+        return True
+    return ref == cand
+
+
+def _numeric_mismatch(ref: pd.Series, cand: pd.Series, rule: tuple) -> np.ndarray:
+    """Mask of the rows where two numeric columns differ, according to a column rule"""
+    rtol, atol, nan = rule
+    ref = ref.to_numpy(dtype=float)
+    cand = cand.to_numpy(dtype=float)
+    if nan == 'zero':
+        ref = np.nan_to_num(ref, nan=0.0)
+        cand = np.nan_to_num(cand, nan=0.0)
+    return ~np.isclose(cand, ref, rtol=rtol, atol=atol, equal_nan=True)
+
+
+def compare_tables(ref_df: pd.DataFrame, cand_df: pd.DataFrame, keys: list, rules: dict = None) -> dict:
+    """Compare two versions of a table and find the first difference
+
+    Rows are matched by the key columns; the first difference is the one in the first row
+    (by key order) that differs, and the first differing column in that row.
+
+    Args:
+        ref_df (pd.DataFrame): reference table
+        cand_df (pd.DataFrame): candidate table
+        keys (list(str)): key columns of the table
+        rules (dict): comparison rules of numeric columns, by column (DEFAULT_RULE for the others)
+
+    Returns:
+        dict: first difference (key values, column, reference and candidate values, reason), or None if equivalent
+    """
+    rules = COLUMN_RULES if rules is None else rules
+
+    # 1. Same columns
+    missing = [c for c in ref_df.columns if c not in cand_df.columns]
+    extra = [c for c in cand_df.columns if c not in ref_df.columns]
+    if missing or extra:
+        return {'reason': 'columns', 'missing': missing, 'extra': extra}
+
+    # 2. Same rows (by key)
+    ref_df = ref_df.sort_values(keys).reset_index(drop=True)
+    cand_df = cand_df.sort_values(keys).reset_index(drop=True)
+    ref_keys = list(ref_df[keys].itertuples(index=False, name=None))
+    cand_keys = list(cand_df[keys].itertuples(index=False, name=None))
+    if ref_keys != cand_keys:
+        only_ref = sorted(set(ref_keys) - set(cand_keys))
+        only_cand = sorted(set(cand_keys) - set(ref_keys))
+        return {'reason': 'rows', 'keys': dict(zip(keys, (only_ref or only_cand or [ref_keys[0]])[0])),
+                'missing': only_ref, 'extra': only_cand}
+
+    # 3. Same values: first row with a difference, and its first differing column
+    mismatches = {}
+    for col in ref_df.columns:
+        if pd.api.types.is_numeric_dtype(ref_df[col]) and pd.api.types.is_numeric_dtype(cand_df[col]) \
+                and not pd.api.types.is_bool_dtype(ref_df[col]):
+            mask = _numeric_mismatch(ref_df[col], cand_df[col], rules.get(col, DEFAULT_RULE))
+        else:
+            mask = np.array([not _values_equal(r, c) for r, c in zip(ref_df[col], cand_df[col])], dtype=bool)
+        if mask.any():
+            mismatches[col] = np.argmax(mask)
+    if not mismatches:
+        return None
+
+    row = min(mismatches.values())
+    col = next(c for c in ref_df.columns if mismatches.get(c) == row)
+    return {'reason': 'values', 'keys': dict(zip(keys, ref_keys[row])), 'column': col,
+            'reference': ref_df.at[row, col], 'candidate': cand_df.at[row, col]}
+
+
+def compare_game(game_json: dict, game_id, candidate, reference=reference_engine, rules: dict = None) -> dict:
+    """Run both engines on a game and find the first difference in its tables
+
+    Args:
+        game_json (dict): json dict data of the game
+        game_id (str): id of the game
+        candidate (function): candidate engine
+        reference (function): reference engine
+        rules (dict): comparison rules of numeric columns, by column
+
+    Returns:
+        dict: first difference (table, key values, column...), or None if both engines agree
+    """
+    ref_tables = reference(game_json, game_id)
+    try:
+        cand_tables = candidate(game_json, game_id)
+    except Exception as e:
+        return {'table': None, 'reason': 'error', 'error': repr(e)}
+
+    for table, keys in TABLE_KEYS.items():
+        if table not in cand_tables:
+            return {'table': table, 'reason': 'missing table'}
+        diff = compare_tables(ref_tables[table], cand_tables[table], keys, rules)
+        if diff is not None:
+            return {'table': table, **diff}
+    return None
+
+
+def iter_corpus(data_dirs: list, no_synth=0, seed=0):
+    """Iterate over the games of a corpus of cached and synthetic games
+
+    Args:
+        data_dirs (list(str)): folders with cached game files data-<game_id>.json
+        no_synth (int): number of synthetic games to add (generated in memory, every other one with its
+            running scores as strings)
+        seed (int): random seed of the synthetic games
+
+    Yields:
+        tuple(str, dict): game id (prefixed with its folder, or synth) and json data of each game
+    """
+    for data_dir in data_dirs:
+        for game_id in get_game_ids(data_dir):
+            with open(Path(data_dir, f"data-{game_id}.json")) as f:
+                yield f"{data_dir}:{game_id}", json.load(f)
+    for i in range(no_synth):
+        game_id = synth.GAME_ID_BASE + i
+        yield f"synth:{game_id}", synth.generate_game(seed, game_id, string_scores=i % 2 == 1)
+
+
+def check_equivalence(corpus, candidate, reference=reference_engine, rules: dict = None, fail_fast=False) -> dict:
+    """Check a candidate engine against the reference over a corpus of games
+
+    Args:
+        corpus (iterable): (game id, json data) of each game (see iter_corpus())
+        candidate (function): candidate engine
+        reference (function): reference engine
+        rules (dict): comparison rules of numeric columns, by column
+        fail_fast (bool): stop at the first game that differs
+
+    Returns:
+        dict: first difference of each game that differs, by game id (empty if engines are equivalent)
+    """
+    diffs = {}
+    for i, (game_id, game_json) in enumerate(corpus, start=1):
+        diff = compare_game(game_json, game_id.split(':')[-1], candidate, reference, rules)
+        if diff is not None:
+            diffs[game_id] = diff
+            log.info(f"Game {game_id} differs: {format_diff(diff)}")
+            if fail_fast:
+                break
+        if i % 100 == 0:
+            log.info(f"Checked {i} games, {len(diffs)} differ")
+    return diffs
+
+
+def format_diff(diff: dict) -> str:
+    """Describe a difference found by compare_game() in one line"""
+    where = f"table {diff['table']}"
+    if 'keys' in diff:
+        where += " " + " ".join(f"{k}={v}" for k, v in diff['keys'].items())
+    if diff['reason'] == 'values':
+        ref, cand = diff['reference'], diff['candidate']
+        if isinstance(ref, float) and isinstance(cand, float) and not (math.isnan(ref) or math.isnan(cand)):
+            return f"{where} column {diff['column']}: reference {ref!r} vs candidate {cand!r} (diff {cand - ref:.3g})"
+        return f"{where} column {diff['column']}: reference {ref!r} vs candidate {cand!r}"
+    return f"{where}: {diff['reason']} " + ", ".join(f"{k}={v}" for k, v in diff.items()
+                                                    if k not in ('table', 'reason', 'keys'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a candidate engine computes the same tables as the reference implementation.")
+    parser.add_argument('data_dirs', nargs='*',
+                        help='Folders with cached game files data-<game_id>.json.')
+    parser.add_argument('--candidate', type=str, metavar='MODULE:FUNCTION',
+                        help='Candidate engine: function(game_json, game_id) returning stint_stats_df, stints_df and players_df.')
+    parser.add_argument('--replace', type=str, nargs='+', default=[], metavar='[NAME=]MODULE:FUNCTION',
+                        help='Functions replacing bball_stats function NAME (default: same name) in the reference engine.')
+    parser.add_argument('--synth', type=int, default=0,
+                        help='Number of synthetic games to add to the corpus (default: %(default)s).')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of the synthetic games (default: %(default)s).')
+    parser.add_argument('--fail-fast', action='store_true', default=False,
+                        help='Stop at the first game that differs.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.candidate and args.replace:
+        parser.error("use either --candidate or --replace")
+    if args.candidate:
+        candidate = load_function(args.candidate)
+    elif args.replace:
+        functions = {}
+        for spec in args.replace:
+            name, _, spec = spec.rpartition('=')
+            name = name or spec.split(':')[1]
+            if not callable(getattr(bball_stats, name, None)):
+                parser.error(f"no function {name} in bball_stats to replace")
+            functions[name] = load_function(spec)
+        candidate = replacing_engine(functions)
+    else:
+        parser.error("a candidate engine is needed: --candidate or --replace")
+
+    diffs = check_equivalence(iter_corpus(args.data_dirs, args.synth, args.seed), candidate, fail_fast=args.fail_fast)
+    if diffs:
+        game_id, diff = next(iter(diffs.items()))
+        print(f"{len(diffs)} games differ; first one is {game_id}: {format_diff(diff)}")
+        sys.exit(1)
+    print("Candidate engine is equivalent to the reference one")
@@ -0,0 +1,84 @@
+"""
+Import-time budget check for the package
+
+Runs `python -X importtime` in a fresh interpreter to import a module of the package and checks that:
+
+1. the import takes less than a time budget; and
+2. no heavy module (pandas, numpy, requests, bs4, ...) is imported, as those must be loaded
+   only by the stages that need them.
+
+Exit code is 1 if the check fails, so it can be used in CI or the cron wrapper. Examples:
+
+    python -m nbl.importtime
+    python -m nbl.importtime --module nbl --budget 0.05
+"""
+import re
+import sys
+import argparse
+import subprocess
+
+IMPORT_BUDGET = 0.2     # seconds allowed to import the scrapper (its own modules, not the interpreter)
+HEAVY_MODULES = ['pandas', 'numpy', 'requests', 'bs4', 'coloredlogs', 'scipy', 'pyarrow']
+
+# e.g., "import time:       337 |        337 |   nbl.store"
+RE_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure_import(module: str) -> dict:
+    """Import a module in a fresh interpreter and get the (cumulative) import time of each module imported
+
+    Args:
+        module (str): the module to import (e.g., nbl.nbl_scrapper)
+
+    Returns:
+        dict: cumulative import time in seconds of each module imported, by module name
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = RE_IMPORTTIME.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2)) / 1e6
+    return times
+
+
+def check_import(module: str, budget: float = IMPORT_BUDGET, runs: int = 3) -> list:
+    """Check the import of a module is within the time budget and loads no heavy module
+
+    The best of a few runs is taken, to avoid noise from disk caches.
+
+    Args:
+        module (str): the module to import
+        budget (float): seconds allowed for the import
+        runs (int): number of imports to measure
+
+    Returns:
+        list(str): problems found (empty if the check passes)
+    """
+    measures = [measure_import(module) for _ in range(runs)]
+    best = min(measures, key=lambda times: times.get(module, 0))
+
+    problems = []
+    if best.get(module, 0) > budget:
+        problems.append(f"Import of {module} took {best[module]:.3f}s, over budget of {budget:.3f}s")
+    for heavy in HEAVY_MODULES:
+        if heavy in best:
+            problems.append(f"Import of {module} loads heavy module {heavy} ({best[heavy]:.3f}s)")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the import time of a module of the package is within budget.")
+    parser.add_argument('--module', type=str, default='nbl.nbl_scrapper',
+                        help='Module to import (default: %(default)s).')
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET,
+                        help='Seconds allowed for the import (default: %(default)s).')
+    args = parser.parse_args()
+
+    problems = check_import(args.module, args.budget)
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print(f"Import of {args.module} within budget of {args.budget}s and loads no heavy module")
@@ -0,0 +1,145 @@
+"""
+Live mode: follow a game in progress and keep its stints and stint stats up to date
+
+The data.json of a game in progress is polled every few seconds. Each poll only processes the PBP events
+newer than the last actionNumber seen, feeding them to the game accumulator (see nbl.accumulator), which
+extends the lineup state of each team and adds to the stat counters of the stints they belong to. Nothing
+is re-computed for the events already processed.
+
+When the game end event arrives the last stints are closed, and the tables are the same as those
+built for the finished game. Example:
+
+    python -m nbl.live 2087737 --interval 20 --data-dir data/ --out live-2087737.csv
+"""
+import time
+import json
+import argparse
+from pathlib import Path
+from urllib.error import HTTPError
+
+from nbl import tools, store
+from nbl.accumulator import GameAccumulator
+
+import logging
+log = logging.getLogger("main.live")
+
+POLL_INTERVAL = 15  # seconds between polls of a game in progress
+
+
+class LiveGame:
+    """A game followed while in progress, whose stints and stint stats are updated with each new PBP event"""
+
+    def __init__(self, game_id, data_dir=None):
+        self.game_id = game_id
+        self.data_dir = data_dir
+        self.last_action = 0        # actionNumber of the last PBP event processed
+        self.ended = False
+        self.game_json = None       # game data of the last update
+        self.accumulator = None     # stints and stint stats so far (see GameAccumulator)
+
+    def poll(self) -> int:
+        """Fetch the game data from the server and process the new PBP events
+
+        Returns:
+            int: number of new PBP events
+        """
+        return self.update(tools.fetch_live_json_data(self.game_id))
+
+    def update(self, game_json: dict) -> int:
+        """Process the PBP events of the game data newer than the last one processed
+
+        Args:
+            game_json (dict): json dict data of the game (e.g., as fetched in a poll)
+
+        Returns:
+            int: number of new PBP events
+        """
+        if self.ended:
+            return 0
+        self.game_json = game_json
+        if self.accumulator is None:
+            self.accumulator = GameAccumulator.from_json(game_json)
+
+        events = [event for event in game_json['pbp'] or [] if event['actionNumber'] > self.last_action]
+        if events:
+            self.accumulator.add_events(events)
+            self.last_action = max(event['actionNumber'] for event in events)
+            tracker = self.accumulator.trackers[1]
+            log.info(f"Game {self.game_id}: {len(events)} new events, up to period {tracker.period} @ {tracker.clock}")
+
+        if tools.game_ended(game_json):
+            self.finish()
+        return len(events)
+
+    def finish(self):
+        """Close the last stints of the game and save its data, if a data folder was given
+
+        Called when the game end event arrives, but can also be called to finish games whose feed
+        never sends it (see README, unfinished games).
+        """
+        self.accumulator.finish()
+        self.ended = True
+        if self.data_dir is not None:
+            with store.atomic_path(Path(self.data_dir, f"data-{self.game_id}.json")) as tmp, open(tmp, 'w') as f:
+                json.dump(self.game_json, f)
+        log.info(f"Game {self.game_id} has ended")
+
+    def tables(self) -> dict:
+        """Stints and stint stats tables of the game so far (as build_game_stints_stats_df())
+
+        Returns:
+            dict: the stints df and stint stats df of the game
+        """
+        return self.accumulator.tables()
+
+
+def follow_game(game_id, interval=POLL_INTERVAL, data_dir=None, out_file=None, max_idle=None) -> LiveGame:
+    """Poll a game until it ends, keeping its stints and stint stats up to date
+
+    Args:
+        game_id (str): id of the game
+        interval (float): seconds between polls
+        data_dir (str): folder where to save the game data when it ends, if any
+        out_file (str): file where to save the stint stats after each poll with new events, if any
+        max_idle (float): seconds with no new events after which the game is taken as finished (None to wait for the game end)
+
+    Returns:
+        LiveGame: the finished game
+    """
+    game = LiveGame(game_id, data_dir)
+    last_event = time.monotonic()
+    while not game.ended:
+        try:
+            new_events = game.poll()
+        except (HTTPError, OSError, ValueError) as e:
+            log.warning(f"Could not poll game {game_id}, will try again: {e}")
+            new_events = 0
+        if new_events:
+            last_event = time.monotonic()
+        elif max_idle is not None and game.accumulator is not None and time.monotonic() - last_event > max_idle:
+            log.warning(f"No new events in game {game_id} for {max_idle} secs, finishing it")
+            game.finish()
+        if (new_events or game.ended) and out_file is not None:
+            store.save_table(game.tables()['stint_stats_df'], out_file, exts=(Path(out_file).suffix or '.csv',))
+        if not game.ended:
+            time.sleep(interval)
+    return game
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow a game in progress, updating its stints and stint stats.")
+    parser.add_argument('game_id', type=str,
+                        help='Id of the game to follow.')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                        help='Seconds between polls (default: %(default)s).')
+    parser.add_argument('--data-dir', type=str,
+                        help='Folder where to save the game data once it ends (default: not saved).')
+    parser.add_argument('--out', type=str,
+                        help='File where to save the stint stats after each update, as .csv or .pkl (default: not saved).')
+    parser.add_argument('--max-idle', type=float,
+                        help='Seconds with no new events after which the game is taken as finished (default: wait for game end).')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    game = follow_game(args.game_id, args.interval, args.data_dir, args.out, args.max_idle)
+    print(game.tables()['stint_stats_df'][['tno', 'team', 'stint', 'lineup', 'mins', 'pts', 'pts_opp']])
@@ -0,0 +1,160 @@
+"""
+Lineup vs lineup matchups: how each lineup of a team did against each lineup of the opponent
+
+Once the PBP of a game is annotated with the stint of both teams (columns stint1 and stint2, see
+bball_stats.pbp_add_stint_col()), the plays are grouped once by (stint1, stint2) to count the core stats
+(see bball_stats.CORE_STATS) of both teams for every pairing of lineups. The minutes of a pairing are the
+overlap of the intervals of both stints.
+
+The matchups table of a game has one row per team and pairing (as the stint stats table, with the stats of
+the opponent lineup as columns _opp), with the ids of the players of both lineups next to their names (see
+nbl.registry). Counts and minutes are additive, so the matchups of many games are accumulated by lineup
+(the ids of the players in it) into a season matrix, with stats and ratings computed again from the
+summed counts (see accumulate_matchups()).
+"""
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
+from nbl.config import *
+from nbl import bball_stats
+
+import logging
+log = logging.getLogger("main.matchups")
+
+MATCHUP_KEYS = ['tno', 'team', 'stint', 'lineup', 'lineup_ids', 'opp_team', 'opp_stint', 'opp_lineup', 'opp_lineup_ids']
+LINEUP_KEYS = ['team', 'lineup_ids', 'opp_team', 'opp_lineup_ids']  # keys of a matchup across games
+LINEUP_NAMES = {'lineup_ids': 'lineup', 'opp_lineup_ids': 'opp_lineup'}    # names of the players of lineup keys
+
+
+def pbp_counts_df(pbp_df: pd.DataFrame) -> pd.DataFrame:
+    """Count the core stats of both teams for each pairing of stints, in one grouped pass over the plays
+
+    Args:
+        pbp_df (pd.DataFrame): PBP of a game with the stint of each team (columns stint1 and stint2)
+
+    Returns:
+        pd.DataFrame: one row per (stint1, stint2) with plays, the counts of team 1 (suffix 1) and of team 2 (suffix 2)
+    """
+    import numpy as np
+    import pandas as pd
+
+    plays_df = pbp_df.loc[pbp_df['tno'].isin([1, 2]) & (pbp_df['stint1'] > 0) & (pbp_df['stint2'] > 0)]
+    made = (plays_df['success'] == 1).to_numpy()
+    counts = {}
+    for (name, _, rate, action_types, sub_types) in bball_stats.CORE_STATS:
+        mask = bball_stats.core_stat_mask(plays_df, action_types, sub_types).to_numpy()
+        counts[f'{name}a' if rate else name] = mask
+        if rate:
+            counts[f'{name}m'] = mask & made
+    counts_df = pd.DataFrame(counts, index=plays_df.index, columns=bball_stats.CORE_COUNT_COLS).astype(int)
+    counts_df.insert(0, 'plays', 1)
+
+    team1 = (plays_df['tno'] == 1).to_numpy()[:, None]
+    both_df = pd.concat([counts_df.mul(team1).add_suffix('1'), counts_df.mul(~team1).add_suffix('2')], axis=1)
+    return both_df.groupby([plays_df['stint1'], plays_df['stint2']]).sum().reset_index()
+
+
+def overlap_mins_df(stints_df: pd.DataFrame) -> pd.DataFrame:
+    """Minutes each pair of stints of both teams of a game were on court together
+
+    Args:
+        stints_df (pd.DataFrame): stints of the game (id, tno, intervals)
+
+    Returns:
+        pd.DataFrame: one row per (stint1, stint2) on court together, with their minutes together (mins)
+    """
+    import numpy as np
+    import pandas as pd
+
+    intervals_df = stints_df[['tno', 'id', 'intervals']].explode('intervals').dropna(subset=['intervals'])
+    ends_df = pd.DataFrame(intervals_df['intervals'].tolist(), columns=['period', 'from', 'to'])
+    ends_df['from'] = pd.to_timedelta(ends_df['from'].astype(str)).dt.total_seconds()
+    ends_df['to'] = pd.to_timedelta(ends_df['to'].astype(str)).dt.total_seconds()
+    ends_df[['tno', 'id']] = intervals_df[['tno', 'id']].to_numpy()
+
+    pairs_df = ends_df[ends_df['tno'] == 1].merge(ends_df[ends_df['tno'] == 2], on='period', suffixes=('1', '2'))
+    secs = np.minimum(pairs_df['from1'], pairs_df['from2']) - np.maximum(pairs_df['to1'], pairs_df['to2'])
+    pairs_df = pairs_df.assign(mins=secs / 60).rename(columns={'id1': 'stint1', 'id2': 'stint2'})
+    return pairs_df[pairs_df['mins'] > 0].groupby(['stint1', 'stint2'], as_index=False)['mins'].sum()
+
+
+def team_stats_df(counts_df: pd.DataFrame, suffix: str, opp_suffix: str) -> pd.DataFrame:
+    """Stats of a team (and its opponent, as columns _opp) from the counts of both teams of each pairing"""
+    import pandas as pd
+
+    cols = bball_stats.CORE_COUNT_COLS
+    team_df = bball_stats.core_stats_from_counts(counts_df[[f'{col}{suffix}' for col in cols]].set_axis(cols, axis=1))
+    opp_df = bball_stats.core_stats_from_counts(counts_df[[f'{col}{opp_suffix}' for col in cols]].set_axis(cols, axis=1))
+    return bball_stats.add_team_opp_derived_stats(pd.concat([team_df, opp_df.add_suffix('_opp')], axis=1))
+
+
+def order_cols(matchups_df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Order the columns of a matchups table as the stint stats table (keys, minutes, stats, opponent stats, rest)"""
+    cols = keys + ['mins'] + STATS_COLS + [f'{col}_opp' for col in STATS_COLS]
+    return matchups_df[cols + [col for col in matchups_df.columns if col not in cols]]
+
+
+def build_game_matchups_df(pbp_df: pd.DataFrame, stints_df: pd.DataFrame) -> pd.DataFrame:
+    """Build the lineup vs lineup matchups of a game
+
+    Args:
+        pbp_df (pd.DataFrame): PBP of the game with the stint of each team (see bball_stats.build_stints_stats_df())
+        stints_df (pd.DataFrame): stints of the game (id, tno, team, lineup, lineup_ids, intervals)
+
+    Returns:
+        pd.DataFrame: one row per team and pairing of its stint with an opponent stint (on court together
+            or with plays together), with minutes together and the stats of both lineups
+    """
+    import pandas as pd
+
+    counts_df = pbp_counts_df(pbp_df).merge(overlap_mins_df(stints_df), on=['stint1', 'stint2'], how='outer')
+    counts_df = counts_df.fillna(0).astype({'stint1': int, 'stint2': int})
+
+    teams = stints_df.drop_duplicates('tno').set_index('tno')['team']
+    lineups_df = stints_df.set_index(['tno', 'id'])[['lineup', 'lineup_ids']].apply(lambda col: col.map(tuple))
+    matchups_dfs = []
+    for tno, opp in [(1, 2), (2, 1)]:
+        team_df = lineups_df.reindex(pd.MultiIndex.from_arrays([[tno] * len(counts_df), counts_df[f'stint{tno}']]))
+        opp_df = lineups_df.reindex(pd.MultiIndex.from_arrays([[opp] * len(counts_df), counts_df[f'stint{opp}']]))
+        keys_df = pd.DataFrame({'tno': tno, 'team': teams.get(tno),
+                                'stint': counts_df[f'stint{tno}'],
+                                'lineup': team_df['lineup'].to_numpy(),
+                                'lineup_ids': team_df['lineup_ids'].to_numpy(),
+                                'opp_team': teams.get(opp),
+                                'opp_stint': counts_df[f'stint{opp}'],
+                                'opp_lineup': opp_df['lineup'].to_numpy(),
+                                'opp_lineup_ids': opp_df['lineup_ids'].to_numpy(),
+                                'mins': counts_df['mins']})
+        matchups_dfs.append(pd.concat([keys_df, team_stats_df(counts_df, str(tno), str(opp))], axis=1))
+
+    matchups_df = pd.concat(matchups_dfs, ignore_index=True)
+    return order_cols(matchups_df, MATCHUP_KEYS).sort_values(['tno', 'stint', 'opp_stint'], ignore_index=True)
+
+
+def accumulate_matchups(matchups_df: pd.DataFrame, by=LINEUP_KEYS) -> pd.DataFrame:
+    """Accumulate the matchups of many games (e.g., a season) by lineup, into a lineup vs lineup matrix
+
+    Counts and minutes are summed and stats (percentages, ratings, rates) computed again from the sums.
+    Lineups are keyed by the ids of their players, with the names last seen shown next to them (see
+    LINEUP_NAMES).
+
+    Args:
+        matchups_df (pd.DataFrame): matchups of the games (see build_game_matchups_df()), with column game_id
+        by (list(str)): columns to accumulate by (default: team and lineup ids of both sides)
+
+    Returns:
+        pd.DataFrame: one row per matchup with the number of games, minutes and stats of both lineups
+    """
+    import pandas as pd
+
+    cols = bball_stats.CORE_COUNT_COLS
+    names = {LINEUP_NAMES[key]: (LINEUP_NAMES[key], 'last') for key in by if key in LINEUP_NAMES}
+    sums_df = matchups_df.groupby(by, sort=False).agg(**names, games=('game_id', 'nunique'), mins=('mins', 'sum'),
+                                                     **{col: (col, 'sum') for col in cols},
+                                                     **{f'{col}_opp': (f'{col}_opp', 'sum') for col in cols})
+    team_df = bball_stats.core_stats_from_counts(sums_df[cols].copy())
+    opp_df = bball_stats.core_stats_from_counts(sums_df[[f'{col}_opp' for col in cols]].set_axis(cols, axis=1))
+    stats_df = bball_stats.add_team_opp_derived_stats(pd.concat([team_df, opp_df.add_suffix('_opp')], axis=1))
+
+    season_df = pd.concat([sums_df[list(names) + ['games', 'mins']], stats_df], axis=1).reset_index()
+    keys = [col for key in by for col in ([LINEUP_NAMES[key], key] if key in LINEUP_NAMES else [key])]
+    return order_cols(season_df, keys + ['games']).sort_values('mins', ascending=False, ignore_index=True)
@@ -0,0 +1,164 @@
+"""
+Peak-memory check of incremental saves: adding new games to the per-game tables saved in parts (see
+nbl.store) must take memory that scales with the new games, not with the games already saved
+
+A few synthetic games are computed (see nbl.synth) and replicated, with new ids, into two seasons saved in
+parts, one SCALE times larger than the other. Then, in a fresh interpreter for each season, the tables of
+the new games are added as the scrapper does when saving (nbl_scrapper.save_tables(): a new part and the
+CSV and Excel files written again part by part) and the peak resident memory over the baseline of the
+process is measured. The check fails (exit code 1) if the peak of the larger season is more than
+TOLERANCE (plus MARGIN_MB, for noise) over that of the smaller one. E.g.:
+
+    python -m nbl.memcheck --games 50 --scale 4 --new 2
+
+Tables the season tables are built from (games, players, stints, matchups, team_games) are still loaded whole
+by the scrapper, so the memory of a full run grows with them (they are much smaller than those in parts).
+"""
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+
+from nbl import metrics, store
+
+import logging
+log = logging.getLogger("main.memcheck")
+
+SCALE = 4           # the larger season has SCALE times the games of the smaller one
+TOLERANCE = 0.1     # peak memory of the larger season allowed over that of the smaller one (fraction)
+MARGIN_MB = 10      # and MB allowed on top (noise of the allocator)
+NEW_GAMES_FILE = "new_games.pkl"    # tables of the new games, in the season folder
+
+
+def compute_games(no_games: int, seed: int = 0) -> list:
+    """Compute the tables of some synthetic games
+
+    Args:
+        no_games (int): number of games
+        seed (int): random seed of the games (see synth.generate_game())
+
+    Returns:
+        list(dict): tables of each game by name (see nbl_scrapper.compute_game())
+    """
+    from nbl import synth, nbl_scrapper
+
+    return [nbl_scrapper.compute_game(synth.generate_game(seed, synth.GAME_ID_BASE + i), str(synth.GAME_ID_BASE + i))
+            for i in range(no_games)]
+
+
+def game_tables(games: list, game_ids: list) -> dict:
+    """Tables in parts (store.PART_TABLES) of some games, from computed games reused in turns with new ids"""
+    import pandas as pd
+
+    return {name: pd.concat([games[i % len(games)][name].assign(game_id=game_id) for (i, game_id) in enumerate(game_ids)],
+                            ignore_index=True)
+            for name in store.PART_TABLES}
+
+
+def build_season(data_dir, games: list, no_games: int, new_games: int):
+    """Save a season of replicated games in parts and the tables of its new games, to measure their save
+
+    Args:
+        data_dir (str | Path): season folder
+        games (list(dict)): computed games to replicate (see compute_games())
+        no_games (int): games saved in the season
+        new_games (int): games to add in the measure (see measure_save())
+    """
+    import pandas as pd
+    from nbl import synth, nbl_scrapper
+
+    FILES = nbl_scrapper.get_save_files(data_dir)
+    game_ids = [str(synth.GAME_ID_BASE + i) for i in range(no_games + new_games)]
+    for i in range(0, no_games, store.PART_GAMES):     # one part in memory at a time
+        part_ids = game_ids[i:min(i + store.PART_GAMES, no_games)]
+        for name, df in game_tables(games, part_ids).items():
+            store.save_parts(FILES[name], df, part_ids)
+    store.save_table(pd.DataFrame({'game_id': game_ids[:no_games]}), FILES['games'], exts=('.pkl',))
+    pd.to_pickle({'game_ids': game_ids[no_games:], **game_tables(games, game_ids[no_games:])},
+                 Path(data_dir, NEW_GAMES_FILE))
+
+
+def measure_save(data_dir) -> dict:
+    """Add the new games of a season built with build_season() to its tables, as the scrapper saves them
+
+    Returns:
+        dict: baseline and peak resident memory of the process in MB, and the peak over the baseline
+    """
+    import pandas as pd
+    from nbl import nbl_scrapper
+
+    FILES = nbl_scrapper.get_save_files(data_dir)
+    new_tables = pd.read_pickle(Path(data_dir, NEW_GAMES_FILE))
+    game_ids = new_tables.pop('game_ids')
+    games_df = pd.concat([pd.read_pickle(FILES['games']), pd.DataFrame({'game_id': game_ids})], ignore_index=True)
+    baseline = metrics.rss_mb()
+    nbl_scrapper.save_tables({**new_tables, 'games': games_df}, FILES, game_ids)
+    peak = metrics.peak_rss_mb()
+    return {'games': games_df.shape[0], 'baseline_mb': baseline, 'peak_mb': peak, 'delta_mb': round(peak - baseline, 1)}
+
+
+def check_memory(no_games: int, scale: int = SCALE, new_games: int = 2, tolerance: float = TOLERANCE,
+                 seed: int = 0) -> tuple:
+    """Measure the peak memory of adding new games to a season and to one scale times larger
+
+    Each measure runs in a fresh interpreter, so its peak is not that of building the seasons.
+
+    Args:
+        no_games (int): games saved in the smaller season
+        scale (int): the larger season has scale times its games
+        new_games (int): games added to each season
+        tolerance (float): peak memory of the larger season allowed over that of the smaller one
+        seed (int): random seed of the games computed
+
+    Returns:
+        tuple(list(dict), list(str)): the measure of each season (see measure_save()) and the problems
+            found (empty if the check passes)
+    """
+    games = compute_games(new_games, seed)
+    measures = []
+    for size in [no_games, no_games * scale]:
+        with tempfile.TemporaryDirectory() as data_dir:
+            build_season(data_dir, games, size, new_games)
+            proc = subprocess.run([sys.executable, "-m", "nbl.memcheck", "--measure", data_dir],
+                                  capture_output=True, text=True, check=True)
+            measures.append(json.loads(proc.stdout.splitlines()[-1]))
+
+    small, large = measures
+    problems = []
+    if large['delta_mb'] > small['delta_mb'] * (1 + tolerance) + MARGIN_MB:
+        problems.append(f"Adding {new_games} games took {large['delta_mb']} MB with {large['games']} games saved, "
+                        f"over {small['delta_mb']} MB with {small['games']} games saved (tolerance {tolerance:.0%})")
+    return measures, problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the memory of saving new games does not grow with the season.")
+    parser.add_argument('--games', type=int, default=50,
+                        help='Games saved in the smaller season (default: %(default)s).')
+    parser.add_argument('--scale', type=int, default=SCALE,
+                        help='The larger season has this many times the games (default: %(default)s).')
+    parser.add_argument('--new', type=int, default=2,
+                        help='New games added to each season (default: %(default)s).')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='Peak memory of the larger season allowed over the smaller one (default: %(default)s).')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of the games computed (default: %(default)s).')
+    parser.add_argument('--measure', type=str, metavar='DIR',
+                        help=argparse.SUPPRESS)     # season folder to measure in this process (see check_memory())
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_save(args.measure)))
+        sys.exit(0)
+
+    measures, problems = check_memory(args.games, args.scale, args.new, args.tolerance, args.seed)
+    for measure in measures:
+        print(f"{measure['games']} games: peak {measure['peak_mb']} MB, {measure['delta_mb']} MB over "
+              f"baseline of {measure['baseline_mb']} MB")
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print(f"Memory of adding {args.new} games does not grow with the games saved (tolerance {args.tolerance:.0%})")
@@ -0,0 +1,201 @@
+"""
+Lightweight instrumentation of runs: timing spans, counters and memory, reported as JSON
+
+Code marks stages with timing spans and counts things (PBP rows, HTTP bytes, cache hits, etc.):
+
+    from nbl import metrics
+
+    with metrics.span('pbp_stints_extract'):
+        ...
+    metrics.count('pbp_rows', pbp_df.shape[0])
+
+Spans and counters inside `with metrics.game(game_id):` are recorded for that game; others for the
+whole run. The report (see report()) has per-stage totals across games, each game's numbers, and
+the memory peak, and can be saved as JSON next to the log file.
+
+Recording is a couple of perf_counter() calls and dict updates, so it is always on.
+"""
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+import logging
+log = logging.getLogger("main.metrics")
+
+
+class RunMetrics:
+    """Spans, counters and memory samples recorded in a run (for the whole run and per game)"""
+
+    def __init__(self):
+        self.start = time.time()
+        self.current_game = None
+        self.spans = {}     # stage -> [calls, total secs] for stages not in a game
+        self.counters = {}  # counter -> value for counts not in a game
+        self.games = {}     # game id -> {'spans': {stage: [calls, secs]}, 'counters': {...}, 'rss_mb': float}
+
+    def _target(self):
+        """Spans and counters dicts where to record now (those of the current game, if any)"""
+        if self.current_game is None:
+            return self.spans, self.counters
+        game = self.games.setdefault(self.current_game, {'spans': {}, 'counters': {}})
+        return game['spans'], game['counters']
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time a stage, adding it to the stage total (of the current game, if any)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            spans, _ = self._target()
+            calls_secs = spans.setdefault(stage, [0, 0.0])
+            calls_secs[0] += 1
+            calls_secs[1] += time.perf_counter() - start
+
+    def count(self, name: str, n=1):
+        """Add n to a counter (of the current game, if any)"""
+        _, counters = self._target()
+        counters[name] = counters.get(name, 0) + n
+
+    @contextmanager
+    def game(self, game_id):
+        """Record all spans and counters inside into the given game, then sample memory"""
+        previous, self.current_game = self.current_game, str(game_id)
+        try:
+            yield
+        finally:
+            self.games.setdefault(self.current_game, {'spans': {}, 'counters': {}})['rss_mb'] = rss_mb()
+            self.current_game = previous
+
+    def take_game(self, game_id) -> dict:
+        """Remove and return what was recorded for a game (e.g., to send it from a worker process)"""
+        return self.games.pop(str(game_id), {'spans': {}, 'counters': {}})
+
+    def add_game(self, game_id, data: dict):
+        """Add what was recorded for a game (e.g., in a worker process); see take_game()"""
+        game = self.games.setdefault(str(game_id), {'spans': {}, 'counters': {}})
+        for stage, (calls, secs) in data['spans'].items():
+            calls_secs = game['spans'].setdefault(stage, [0, 0.0])
+            calls_secs[0] += calls
+            calls_secs[1] += secs
+        for name, n in data['counters'].items():
+            game['counters'][name] = game['counters'].get(name, 0) + n
+        if 'rss_mb' in data:
+            game['rss_mb'] = max(game.get('rss_mb', 0), data['rss_mb'])
+
+    def report(self) -> dict:
+        """Build the run report: stage totals (run and all games), counters, games and memory
+
+        Stages can be nested (e.g., json_normalize inside get_pbp_df), so stage times do not add up to the run time.
+
+        Returns:
+            dict: the report, ready to be saved as JSON
+        """
+        stages = {stage: {'calls': calls, 'secs': secs} for (stage, (calls, secs)) in self.spans.items()}
+        counters = dict(self.counters)
+        for game in self.games.values():
+            for stage, (calls, secs) in game['spans'].items():
+                total = stages.setdefault(stage, {'calls': 0, 'secs': 0.0})
+                total['calls'] += calls
+                total['secs'] += secs
+            for name, n in game['counters'].items():
+                counters[name] = counters.get(name, 0) + n
+        for total in stages.values():
+            total['secs'] = round(total['secs'], 4)
+
+        return {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start)),
+                'elapsed_secs': round(time.time() - self.start, 3),
+                'argv': sys.argv,
+                'peak_rss_mb': peak_rss_mb(),
+                'no_games': len(self.games),
+                'stages': dict(sorted(stages.items(), key=lambda x: -x[1]['secs'])),
+                'counters': counters,
+                'games': {game_id: {'secs': {stage: round(secs, 4) for (stage, (_, secs)) in game['spans'].items()},
+                                    'counters': game['counters'],
+                                    'rss_mb': game.get('rss_mb')}
+                          for (game_id, game) in self.games.items()}}
+
+    def save(self, file):
+        """Save the run report as a JSON file"""
+        with open(file, 'w') as f:
+            json.dump(self.report(), f, indent=1, default=str)
+        log.info(f"Run report saved in {file}")
+
+
+def _psutil_memory():
+    """Memory info of the process from psutil (e.g., in Windows, with no /proc nor resource), None if not installed"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info()
+
+
+def rss_mb() -> float:
+    """Current resident memory of the process in MB (0 if not available in the platform)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20, 1)
+    except (OSError, ValueError, AttributeError):   # no /proc (macOS) or no os.sysconf (Windows)
+        memory = _psutil_memory()
+        return 0.0 if memory is None else round(memory.rss / 2**20, 1)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of the process (and its finished children, e.g., compute pool) in MB
+
+    The resource module is Unix only; elsewhere the peak of the process is taken from psutil (if
+    installed, 0 otherwise).
+    """
+    try:
+        import resource
+    except ImportError:
+        memory = _psutil_memory()
+        return 0.0 if memory is None else round(getattr(memory, 'peak_wset', memory.rss) / 2**20, 1)
+
+    scale = 2**20 if sys.platform == 'darwin' else 2**10  # ru_maxrss is in bytes in macOS, KB in Linux
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / scale, 1)
+
+
+@contextmanager
+def profile(file, profiler='cprofile'):
+    """Profile the code inside with cProfile or pyinstrument (if installed), saving the result to file
+
+    Args:
+        file (str): output file (cProfile stats to load with pstats/snakeviz, or pyinstrument HTML)
+        profiler (str): 'cprofile' or 'pyinstrument'
+    """
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler   # optional dependency, only needed for this profiler
+
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            with open(file, 'w') as f:
+                f.write(prof.output_html())
+    else:
+        import cProfile
+
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            prof.dump_stats(file)
+    log.info(f"Profile saved in {file}")
+
+
+# metrics of the current process
+METRICS = RunMetrics()
+
+span = METRICS.span
+count = METRICS.count
+game = METRICS.game
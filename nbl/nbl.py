@@ -39,194 +39,182 @@ import logging
 
 
 import os
-import json
-from urllib.request import urlopen
+import pickle
+from pathlib import Path
 
-class Game:
-    def __init__(self, game_id, round_no=np.NaN) -> None:
-        self.game_id = game_id
-        self.round_no = round_no
-        self.game_json = self.load_json()
-
-        self.teams = dict()
-        self.score = dict()
-        self.players_df = dict()
-        self.starters = dict()
-
-        self.players_stats_df = None
-        self.stints_df = None
-        self.stints_stats_df = None
-        self.pbp_df = None
-
-        self._setup()
-
-
-    def load_json(self, dir=None) -> bool:
-        """Load a game into a JSON object.
-            Data will be loaded from local file data-{game_id}.json if exists
-            Otherwise will be fetched from server
-
-        Args:
-            game_id (int): id of the game
-            dir (str): folder where to check and save a copy
-
-        Returns:
-            bool: true if successfully loaded
-        """
-        game_url = os.path.join(URL_LIVESTATS, str(self.game_id), "data.json")
-
-        if dir is not None and os.path.exists(file_json):
-            file_json = os.path.join(dir, f"data-{self.game_id}.json")
-            game_json = json.load(open(file_json))
-            # print(f"Game data loaded from local file: {game_file}")
-        else:   # get if from URL
-            # store the response of URL
-            response = urlopen(game_url)
-
-            # storing the JSON response
-            # from url in data
-            game_json = json.loads(response.read())
-
-            # assume no json file if game is not yet over!
-            game_ended = game_json['pbp'] and game_json['pbp'][0]['actionType'] == "game"
-            if not game_ended:
-                raise ValueError('Game has not finished yet')
-
-            if dir is not None:
-                with open(file_json, 'w') as f:
-                    json.dump(game_json, f)
-        return game_json
-
-    def get_teams(self):
-        return self.teams
+from nbl import bball_stats
+from nbl.store import atomic_path
 
-    def _setup(self):
-        """Extract team names from JSON game
+GAME_CACHE_DIR = "cache"    # sub-folder of the data folder where derived data of games is cached
 
-        Args:
-            data_json (json-object): JSON live data of a game
-
-        Returns:
-            list(tuple(string, string)): full and short names of both teams
-        """
-        for tm in [1, 2]:
-            self.teams[tm] = (self.game_json['tm'][str(tm)]['name'], self.game_json['tm'][str(tm)]['shortName'])
-            self.score[tm] = self.game_json['tm'][str(tm)]['full_score']
 
-            # https://pandas.pydata.org/docs/reference/api/pandas.json_normalize.html
-            self.players_df[tm] = pd.json_normalize(self.game_json['tm'][str(tm)]['pl'].values())
-            self.starters[tm] = set(tools.build_player_names(self.players_df[tm].query("starter == 1")).to_list())
+class _lazy:
+    """Attribute of a Game computed on first access and memoized
 
-        self.pbp = PBP(self.game_json, self.teams)
-        self.pbp_df = self.pbp.get_df()
+    If persist is True and the game has a data folder, the value is also cached on disk
+    (see Game._read_cache()), so a later Game object for the same game does not compute it again.
+    """
+    def __init__(self, persist=False):
+        self.persist = persist
 
-        return True
+    def __call__(self, fn):
+        self.fn = fn
+        self.name = fn.__name__
+        self.__doc__ = fn.__doc__
+        return self
 
-    def _compute_stats(self):
-        self.players_stats_df = self._extract_players_stats()
-        self.stints_df, self.stints_stats_df = self._extract_stints_stats_df()
+    def __get__(self, game, owner=None):
+        if game is None:
+            return self
+        if self.name not in game._cache:
+            value = game._read_cache(self.name) if self.persist else None
+            if value is None:
+                value = self.fn(game)
+                if self.persist:
+                    game._write_cache(self.name, value)
+            game._cache[self.name] = value
+        return game._cache[self.name]
 
 
-    def _extract_players_stats(self) -> pd.DataFrame:
-        """Extract game stats for each player form game JSOn data
-
-        Args:
-            game_json (json dict): the json data of a game
+class Game:
+    """A game, whose data is computed lazily: only what is accessed gets loaded or computed
 
-        Returns:
-            pd.DataFrame: a table with stats per player in the game for both teams
-        """
-        players_dfs = []
-        for tno in [1, 2]:
-            players_df = pd.json_normalize(self.game_json['tm'][str(tno)]['pl'].values())
-            players_df.insert(0, 'tno', tno)
-            players_df.insert(1, 'player', tools.build_player_names(players_df))
-            players_df.insert(2, 'shirtNumber', players_df.pop('shirtNumber'))
-            players_df['captain'] = (players_df.captain == 1.0)
+    Creating a Game does no I/O. The JSON data is loaded (from data_dir if there, otherwise
+    from the server) the first time it is needed; the pbp, stints and stats tables are computed
+    on first access and memoized. With a data_dir, tables are also cached on disk under
+    GAME_CACHE_DIR and re-used as long as they are newer than the game JSON file.
 
-            players_df['sMinutes'] = pd.to_datetime(players_df['sMinutes'], format="%M:%S").dt.time
-            players_df.drop(players_df[players_df.sMinutes < datetime.time(0, 0, 1)].index, inplace=True)   # drop players with no minutes on court
-            players_dfs.append(players_df)
+    Use invalidate() to drop memoized values (and everything computed from them).
+    """
+    __slots__ = ('game_id', 'round_no', 'data_dir', '_cache')
 
-        players_df = pd.concat(players_dfs)
-        players_df.reset_index(drop=True, inplace=True)
+    # values computed from each value (to invalidate them too)
+    DEPENDS = {'json': ('teams', 'score', 'starters', 'pbp_df', 'players_stats_df'),
+               'starters': ('stints',),
+               'pbp_df': ('stints', 'stint_tables'),
+               'stints': ('stint_tables',),
+               'stint_tables': ('pbp_stints_df', 'stints_df', 'stint_stats_df')}
 
-        return players_df
+    def __init__(self, game_id, round_no=np.nan, data_dir=None) -> None:
+        self.game_id = game_id
+        self.round_no = round_no
+        self.data_dir = data_dir
+        self._cache = {}
+
+    def __repr__(self) -> str:
+        return f"Game({self.game_id!r}, round_no={self.round_no!r}, data_dir={self.data_dir!r})"
+
+    ##############################################
+    # Lazy data of the game
+    ##############################################
+    @_lazy()
+    def json(self) -> dict:
+        """JSON data of the game (data.json), from data_dir if saved there"""
+        return tools.get_json_data(self.game_id, dir=self.data_dir)
+
+    @_lazy()
+    def teams(self) -> dict:
+        """Full and short names of each team (1 and 2)"""
+        return dict(enumerate(bball_stats.get_team_names(self.json), start=1))
+
+    @_lazy()
+    def score(self) -> dict:
+        """Final score of each team (1 and 2)"""
+        return dict(enumerate(bball_stats.get_team_scores(self.json), start=1))
+
+    @_lazy()
+    def starters(self) -> dict:
+        """Set of starter players of each team (1 and 2)"""
+        return {tno: bball_stats.get_starters(self.json, tno) for tno in [1, 2]}
+
+    @_lazy(persist=True)
+    def pbp_df(self) -> pd.DataFrame:
+        """Play-by-play table of the game"""
+        return bball_stats.get_pbp_df(self.json)
+
+    @_lazy(persist=True)
+    def stints(self) -> dict:
+        """Stints of each team (1 and 2), as extracted by bball_stats.pbp_stints_extract()"""
+        return {tno: bball_stats.pbp_stints_extract(self.pbp_df, self.starters[tno], tno) for tno in [1, 2]}
+
+    @_lazy(persist=True)
+    def stint_tables(self) -> tuple:
+        """pbp annotated with stint columns, stints table and stint stats table (computed together)"""
+        team_names = (self.teams[1][0], self.teams[2][0])
+        return bball_stats.build_stints_stats_df(self.pbp_df, self.stints[1], self.stints[2], team_names)
+
+    @_lazy()
+    def pbp_stints_df(self) -> pd.DataFrame:
+        """Play-by-play table of the game with stint columns stint1 and stint2"""
+        return self.stint_tables[0]
+
+    @_lazy()
+    def stints_df(self) -> pd.DataFrame:
+        """Table of stints of both teams"""
+        return self.stint_tables[1]
+
+    @_lazy()
+    def stint_stats_df(self) -> pd.DataFrame:
+        """Table of stats of each stint of both teams"""
+        return self.stint_tables[2]
+
+    @_lazy(persist=True)
+    def players_stats_df(self) -> pd.DataFrame:
+        """Table of box-score stats of each player of both teams"""
+        return bball_stats.get_players_stats(self.json)
+
+    # old names, kept for compatibility
+    game_json = json
+    stints_stats_df = stint_stats_df
 
+    def get_teams(self):
+        return self.teams
 
-    def _extract_stints_stats_df(self) -> dict:
-        """Build dataframe with stint statistics for a game, by extracting play-by-play data
+    ##############################################
+    # Memoization and disk cache
+    ##############################################
+    def invalidate(self, *names):
+        """Drop memoized values (in memory and on disk), and all values computed from them
 
         Args:
-            game_json (dict): json dict data of the game
-            game_id (int) : game id of the game, if any
-
-        Returns:
-            dict: contains various data and df for the game (including pbp and stint stats dfs)
+            names (str): values to drop (e.g., "json", "stints"); all values if none given
         """
-        # 1. Extract names of teams and scores in the game
-        team_name_1, _ = self.teams[1]
-        team_name_2, _ = self.teams[2]
-        score_1, score_2 = self.score[1], self.score[2]
-
-        # 2. Read game JSON file
-        logging.debug(f"Extracting stint stats for game {self.game_id} [{team_name_1} ({score_1}) vs {team_name_2} ({score_2})] - No of PBP: {self.pbp_df.shape[0]}.")
-
-        # print(f"====> Game {team_name_1} ({team_short_name_1}) vs {team_name_2} ({team_short_name_2})")
-        # print(f"Play-by-play df for game {game_id}: {pbp_df.shape}")
-
-        # 3. Compute stints (dictionaries) for each team
-        logging.debug(f"Starters for each team computed: {self.starters[1]} / {self.starters[2]}")
-        stints_1 = pbp_stints_extract(self.pbp_df, self.starters[1], 1)
-        stints_2 = pbp_stints_extract(self.pbp_df, self.starters[2], 2)
-        logging.debug(f"Stints for each team computed: {len(stints_1)} / {len(stints_2)}")
-
-        # 4. Add stint columns to pbp df, one column per team having stint id number
-        stints1_df, self.pbp_df = pbp_add_stint_col(self.pbp_df, stints_1, "stint1")
-        stints2_df, self.pbp_df = pbp_add_stint_col(self.pbp_df, stints_2, "stint2")
-        logging.debug(f"Stints columns added to pbp df for both teams")
-
-
-        # 5. Drop plays that are not for statistics (game events, like start/end)
-        # Why do we drop plays? Just leave them, who cares..
-        # pbp_df = pbp_df.loc[(~pbp_df['actionType'].isin(ACT_NON_STATS))]
-        # pbp_df = pbp_df.loc[(~pbp_df['subType'].isin(ACTSSUB_NON_STATS))]
-        # pbp_df.reset_index(inplace=True, drop=True)     # re-index as we may have dropped rows
-
-        # 6. Build single stint stats dataframe containing both teams
-        stint_stats1_df = self.pbp.build_stats_df(1, "stint1") # full stats for team 1
-        stint_stats2_df = self.pbp.build_stats_df(2, "stint2") # full stats for team 2
-
-        # unify stint column name to just "stint"
-        stint_stats1_df.rename(columns={'stint1' : 'stint'}, inplace=True)
-        stint_stats2_df.rename(columns={'stint2' : 'stint'}, inplace=True)
-
-        # put both stint stats together into a single dataframe
-        stint_stats_df = pd.concat([stint_stats1_df, stint_stats2_df])
-        stint_stats_df.reset_index(inplace=True, drop=True)
-        logging.debug(f"Stint lineup stats df computed (for both teams)")
-
-        # finally, re-order columns (_opp at the end)
-        index_col = ['tno', 'stint']
-        stint_stats_df = stint_stats_df[index_col + STATS_COLS + [f'{x}_opp' for x in STATS_COLS]]
-
-        # 7. Put together the final stint df
-        stints1_df['tno'] = 1
-        stints1_df['team'] = team_name_1
-        stints2_df['tno'] = 2
-        stints2_df['team'] = team_name_2
-        stints_df = pd.concat([stints1_df, stints2_df])
-        stints_df.reset_index(inplace=True, drop=True)
-        index_col = ['id', 'tno', 'team']   # re-order cols
-        stints_df = stints_df[index_col + list(filter(lambda x: x not in index_col, stints_df.columns))]
-
-        # 8. Merge stint stats table with stint table to get stint info to stints stats (e.g., intervals and stint players)
-        stint_stats_df = stint_stats_df.merge(stints_df, left_on=['tno', 'stint'], right_on=['tno', 'id'])
-        stint_stats_df.drop('id', axis=1, inplace=True) # we don't need it, already in stint col
-        team_name_col = stint_stats_df.pop('team')
-        stint_stats_df.insert(1, "team", team_name_col)
-
-        return stints_df, stint_stats_df
+        for name in names or self.DEPENDS:
+            self._cache.pop(name, None)
+            file = self._cache_file(name)
+            if file is not None and file.exists():
+                file.unlink()
+            for dependent in self.DEPENDS.get(name, ()):
+                self.invalidate(dependent)
+
+    def _cache_file(self, name):
+        if self.data_dir is None:
+            return None
+        return Path(self.data_dir, GAME_CACHE_DIR, f"{self.game_id}-{name}.pkl")
+
+    def _read_cache(self, name):
+        """Value cached on disk, or None if not cached (or older than the game JSON file)"""
+        file = self._cache_file(name)
+        if file is None or not file.exists():
+            return None
+        file_json = Path(self.data_dir, f"data-{self.game_id}.json")
+        if file_json.exists() and os.path.getmtime(file_json) > os.path.getmtime(file):
+            return None
+        try:
+            with open(file, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Cannot read cached {name} of game {self.game_id}: {e}")
+            return None
+
+    def _write_cache(self, name, value):
+        file = self._cache_file(name)
+        if file is None:
+            return
+        file.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_path(file) as tmp:
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f)
 
 
 class PBP:
@@ -473,18 +461,21 @@ class PBP:
         return self.pbp_df.loc[(self.pbp_df['periodType'] == "OVERTIME"), ['period', 'periodType']].drop_duplicates().to_records(index=False).tolist()
 
 
-    def build_stats_df(self, tno: int, agg_col = (lambda x: True)) -> pd.DataFrame:
+    def build_stats_df(self, tno: int, agg_col: str = None) -> pd.DataFrame:
         """Build a dataframe with full statistics for a team
 
         Args:
             pbp_df (pd.DataFrame): play-by-play data for a game
             tno (int): team number to extract stats for
-            agg_col (str): the column to group by (if any)
+            agg_col (str): the column to group by (if None, whole-game stats of the team)
 
         Returns:
             pd.DataFrame: _description_
         """
-        def build_core_stats(pbp_df: pd.DataFrame, agg_col = (lambda x: True)) -> pd.DataFrame:
+        if agg_col is None:     # whole game (see bball_stats.build_team_stats_df())
+            return bball_stats.build_stats_df(self.pbp_df, tno)
+
+        def build_core_stats(pbp_df: pd.DataFrame, agg_col: str) -> pd.DataFrame:
             """Build the core stats table aggregated by column agg_col (usually, a stint column, with stint id for a team)
 
             Args:
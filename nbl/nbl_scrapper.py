@@ -17,56 +17,71 @@ The data comes as a raw JSON file using the game id (e.g., `2087737`):
     https://fibalivestats.dcd.shared.geniussports.com/data/2087737/data.json
 """
 
-##########################################
-# LOGGING = START
-##########################################
-import coloredlogs, logging
-# coloredlogs.install()
-# logging.info("It works!")
-
-# Create top level logger
-log = logging.getLogger("main")
-
-# Add console handler using our custom ColoredFormatter
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-cf = coloredlogs.ColoredFormatter("[%(name)s][%(levelname)s]  %(message)s (%(filename)s:%(lineno)d)")
-ch.setFormatter(cf)
-log.addHandler(ch)
-
-# Add file handler
-fh = logging.FileHandler('app.log')
-fh.setLevel(logging.DEBUG)
-ff = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(ff)
-log.addHandler(fh)
-
-# Set log level
-log.setLevel(logging.INFO)
-# log.setLevel(logging.CRITICAL + 1)
-##########################################
-# LOGGING = END
-##########################################
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
 
+# NOTE: heavy modules (pandas, numpy, bball_stats, requests, bs4) are imported only in the
+#   stages that need them, so that --help or a run with no new games to compute starts fast
 import os
+import json
+import math
 import argparse
 from pathlib import Path
-import pandas as pd
-import numpy as np
 
 import datetime
-import os
 import shutil
-from pathlib import Path
 from urllib.error import HTTPError
 import importlib
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor
 
 from nbl.config import *
-from nbl import bball_stats, tools
+from nbl import tools, store, metrics, pbp_store, query, stint_index, registry
+from nbl.store import Checkpoint
+from nbl.schedule import parse_round
+from nbl.scheduler import GameScheduler, round_key
 # import tools
 # from games_22_23 import GAMES
 
+import logging
+log = logging.getLogger("main")
+
+LOG_FILE = 'app.log'
+REPORT_FILE = 'app-report.json'     # run report (timings, counters, memory), next to the log file
+PROFILE_FILE = 'app-profile'        # profile output (extension depends on the profiler)
+
+
+def setup_logging(log_file=LOG_FILE):
+    """Set up logging to the console (colored) and to a log file
+
+    Args:
+        log_file (str): file where to log
+    """
+    import coloredlogs
+    # coloredlogs.install()
+    # logging.info("It works!")
+
+    # Add console handler using our custom ColoredFormatter
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    cf = coloredlogs.ColoredFormatter("[%(name)s][%(levelname)s]  %(message)s (%(filename)s:%(lineno)d)")
+    ch.setFormatter(cf)
+    log.addHandler(ch)
+
+    # Add file handler
+    fh = logging.FileHandler(log_file)
+    fh.setLevel(logging.DEBUG)
+    ff = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fh.setFormatter(ff)
+    log.addHandler(fh)
+
+    # Set log level
+    log.setLevel(logging.INFO)
+    # log.setLevel(logging.CRITICAL + 1)
+
+
 DATA_DIR_DEFAULT = 'test/'
+GAME_INFO_FILE = 'games_info.json'  # cache of dates and venues scraped, in each season data folder
+SEASON_TABLES = ['minutes', 'team_season', 'lineups', 'lineup_matchups', 'on_off', 'rapm']  # tables built from all games of a season (see build_season_tables())
 
 # Set folder with data files and Pickle tables saved on disk
 def get_save_files(dir):
@@ -75,114 +90,440 @@ def get_save_files(dir):
     FILES['stints'] = Path(dir, "stints_df").with_suffix('.pkl')
     FILES['games'] = Path(dir, "games_df").with_suffix('.pkl')
     FILES['players'] = Path(dir, "players_df").with_suffix('.pkl')
+    FILES['anomalies'] = Path(dir, "anomalies_df").with_suffix('.pkl')
+    FILES['matchups'] = Path(dir, "matchups_df").with_suffix('.pkl')
+    FILES['splits'] = Path(dir, "splits_df").with_suffix('.pkl')
+    FILES['team_games'] = Path(dir, "team_games_df").with_suffix('.pkl')
+    FILES['team_season'] = Path(dir, "team_season_df").with_suffix('.pkl')
+    FILES['minutes'] = Path(dir, "minutes_df").with_suffix('.pkl')
+    FILES['lineups'] = Path(dir, "lineups_df").with_suffix('.pkl')
+    FILES['lineup_matchups'] = Path(dir, "lineup_matchups_df").with_suffix('.pkl')
+    FILES['on_off'] = Path(dir, "on_off_df").with_suffix('.pkl')
+    FILES['rapm'] = Path(dir, "rapm_df").with_suffix('.pkl')
 
     return FILES
 
-if __name__=="__main__":
-    parser = argparse.ArgumentParser(
-        description=
-        'Statistics scrapper for  Australian NBL league. Computes players and stint lineups stats.\n'
-        'Examples:\n\n'
-        '\t python -m nbl.nbl_scrapper\n'
-        '\t python -m nbl.nbl_scrapper --games games_22_23\n'
-        '\t python -m nbl.nbl_scrapper --games games_22_23 --data-dir test --save\n',
-        formatter_class=argparse.RawTextHelpFormatter
-        # formatter_class = argparse.ArgumentDefaultsHelpFormatter
-    )
-    parser.add_argument(
-        '--data-dir',
-        type=str,
-        default=DATA_DIR_DEFAULT,
-        help='Directory to read and write data (e.g., csv and json files) (default: %(default)s).'
-    )
-    parser.add_argument(
-        '--games',
-        type=str,
-        default='games.py',
-        help='File containing the games to scrape (defines list variable GAMES) (default: %(default)s).'
-    )
-    parser.add_argument(
-        '--reload',
-        action='store_true',
-        default=False,
-        help='Reload all games from scratch; do not use store files (default: %(default)s).'
-    )
-    parser.add_argument(
-        '--save',
-        action='store_true',
-        default=False,
-        help='Append games scraped to current set of games (default: %(default)s).'
-    )
 
+def load_games(games_module: str) -> list:
+    """Import the list of games GAMES defined in a module
 
-    args = parser.parse_args()
-    log.debug(args)
+    Args:
+        games_module (str): name of the module (e.g., games_22_23)
 
-    log.info(f"File to import game list: {args.games}")
+    Returns:
+        list: the games defined in the module, as tuples (game id, round number)
+    """
+    log.info(f"File to import game list: {games_module}")
     try:
-        games_module = importlib.import_module(args.games)
-        GAMES=games_module.GAMES
+        return importlib.import_module(games_module).GAMES
     except ModuleNotFoundError:
-        log.error(f"Game module {args.games} not found. Cannot initialize GAMES variable.")
+        log.error(f"Game module {games_module} not found. Cannot initialize GAMES variable.")
         exit(1)
     except AttributeError:
-        log.error(f"Variable GAMES not defined in module {args.games}. Check format.")
+        log.error(f"Variable GAMES not defined in module {games_module}. Check format.")
         exit(1)
 
-    if not os.path.exists(args.data_dir):
-        log.error(f"Data folder *{args.data_dir}* does not exist! Exit...")
-        exit(1)
-    data_dir = args.data_dir
 
+def load_saved_tables(FILES: dict) -> dict:
+    """Load tables saved in a previous run, keeping only the games fully saved
+
+    Tables saved in parts (see store.save_parts()) are not loaded: rows of new games are added to them
+    as a new part, so the rows saved before are not needed (see save_tables()). Read them with
+    store.read_table() if needed.
+
+    Args:
+        FILES (dict): the Pickle file of each table
+
+    Returns:
+        dict: the saved tables by name (games, players, stints, and stint_stats, anomalies, matchups,
+            splits and team_games if saved and not in parts), or None if no tables saved
+    """
+    import pandas as pd
+
+    log.debug(f"Loading recorded dataframes from files")
+    tables, parts = {}, {}
+    try:
+        with metrics.span('load_tables'):
+            for name in store.TABLES + store.EXTRA_TABLES:
+                if name in store.PART_TABLES and store.has_parts(FILES[name]):
+                    parts[name] = store.parts_games(FILES[name])
+                elif name in store.TABLES or os.path.exists(FILES[name]):
+                    tables[name] = pd.read_pickle(FILES[name])
+    except FileNotFoundError as e:
+        print("Error loading Pickle files: ", e)
+        return None
+
+    # tables saved before players had ids get them (see nbl.registry)
+    registry.intern_tables(tables)
+
+    # drop games partially saved (e.g., run killed while saving) so they are computed again
+    saved_games = store.check_tables({**tables, **parts})
+    return {name: df[df.game_id.isin(saved_games)] for (name, df) in tables.items()}
+
+
+def save_tables(tables: dict, FILES: dict, game_ids: list, reload=False):
+    """Save the tables of a season (each file written atomically), the games table last
+
+    A game is saved only once it is in the games table. Tables in parts (store.PART_TABLES) get a new
+    part with the rows of the given games, and their CSV and Excel files are written again part by part;
+    so those tables are never in memory whole. A table still saved whole (older folders) or reloaded is
+    saved in parts from scratch, with all its rows.
+
+    Args:
+        tables (dict): tables of the season (those in parts with the rows of the given games only, or all
+            of them if not saved in parts yet)
+        FILES (dict): the Pickle file of each table
+        game_ids (list(str)): games new or changed
+        reload (bool): tables were computed from scratch (tables in parts are saved again from scratch)
+    """
+    saved_games = tables['games'].game_id
+    for name in ['stint_stats', 'stints', 'players'] + store.EXTRA_TABLES + SEASON_TABLES + ['games']:
+        if name not in tables:
+            continue
+        if name not in store.PART_TABLES:
+            store.save_table(tables[name], FILES[name])
+            continue
+        whole = reload or not store.has_parts(FILES[name])
+        if whole:
+            store.clear_parts(FILES[name])
+        store.save_parts(FILES[name], tables[name], set(game_ids) | (set(tables[name].game_id) if whole else set()))
+        if whole and os.path.exists(FILES[name]):  # the table is now read from its parts
+            os.remove(FILES[name])
+        store.save_table_chunks(lambda: store.iter_parts(FILES[name], game_ids=saved_games), FILES[name],
+                                store.parts_columns(FILES[name]))
+
+
+def compute_game(game_json: dict, game_id, profiler=None) -> dict:
+    """Compute the players, stints and stint stats tables of a game (run in the compute pool)
+
+    Args:
+        game_json (dict): json dict data of the game
+        game_id (str): id of the game
+        profiler (str): profiler to profile the game with, if any (see metrics.profile())
+
+    Returns:
+        dict: teams (name and score), the players, stints, stint stats, anomalies, matchups, stint stats by
+            split and team stats tables of the game, its compact annotated PBP (see nbl.pbp_store) and its metrics
+    """
+    from nbl import bball_stats, validate, matchups, pbp_store
+
+    profile_file = f"{PROFILE_FILE}-{game_id}.{'html' if profiler == 'pyinstrument' else 'prof'}"
+    with metrics.game(game_id), (metrics.profile(profile_file, profiler) if profiler else nullcontext()):
+        result = bball_stats.build_game_stints_stats_df(game_json, game_id, splits=list(bball_stats.SPLITS))
+        game_stint_stats_df = result['stint_stats_df']   #  this is basically what we care, the stint stats
+        game_stints_df = result['stints_df']
+        game_splits_df = result['splits_df']    # stint stats by period, half, period type and clutch time
+
+        # Add the game id column to game tables
+        game_stint_stats_df.insert(0, 'game_id', game_id)
+        game_stints_df.insert(0, 'game_id', game_id)
+        game_splits_df.insert(0, 'game_id', game_id)
+
+        # Extract players in the game
+        with metrics.span('get_players_stats'):
+            players_df = bball_stats.get_players_stats(game_json)
+        players_df.insert(0, 'game_id', game_id)
+
+        # Integer ids of the players, next to their names (see nbl.registry)
+        registry.intern_tables({'players': players_df, 'stints': game_stints_df, 'stint_stats': game_stint_stats_df})
+
+        # Check the substitutions of the game (see nbl.validate)
+        with metrics.span('validate'):
+            anomalies_df = validate.validate_game(game_json, game_id, result['pbp_df'], game_stints_df, players_df)
+        metrics.count('anomalies', anomalies_df.shape[0])
+
+        # Whole-game stats of both teams
+        with metrics.span('build_team_stats_df'):
+            team_games_df = bball_stats.build_team_stats_df(result['pbp_df'])
+        team_games_df.insert(0, 'game_id', game_id)
+        team_games_df.insert(2, 'team', [name for (name, _) in result['teams']])
+
+        # Lineup vs lineup matchups of the game (see nbl.matchups)
+        with metrics.span('build_game_matchups_df'):
+            matchups_df = matchups.build_game_matchups_df(result['pbp_df'], game_stints_df)
+        matchups_df.insert(0, 'game_id', game_id)
+
+        # PBP annotated with the stints of both teams, to be stored (see nbl.pbp_store)
+        with metrics.span('compact_pbp_df'):
+            pbp_df = pbp_store.compact_pbp_df(result['pbp_df'], game_json, game_id)
+
+    return {'teams': result['teams'],
+            'players': players_df,
+            'stints': game_stints_df,
+            'stint_stats': game_stint_stats_df,
+            'anomalies': anomalies_df,
+            'matchups': matchups_df,
+            'splits': game_splits_df,
+            'team_games': team_games_df,
+            'pbp': pbp_df,
+            'metrics': metrics.METRICS.take_game(game_id)}   # send back metrics if computed in a worker
+
+
+def reconcile_season(games_df: pd.DataFrame, stints_df: pd.DataFrame, players_df: pd.DataFrame) -> tuple:
+    """Reconcile the minutes of players in the stints with the box score, for all games of a season in one pass
+
+    Games whose stints misplace too many minutes (e.g., a broken chain of subs) are flagged as
+    quarantined in the games table, together with their score (see validate.score_games()).
+
+    Args:
+        games_df (pd.DataFrame): games of the season
+        stints_df (pd.DataFrame): stints of the games
+        players_df (pd.DataFrame): players of the games
+
+    Returns:
+        tuple(pd.DataFrame, pd.DataFrame): games table with the score of each game and minutes of each player
+            in stints and box score
+    """
+    from nbl import validate
+
+    with metrics.span('reconcile_minutes'):
+        minutes_df = validate.reconcile_minutes(stints_df, players_df)
+        scores_df = validate.score_games(minutes_df)
+    games_df = games_df.drop(columns=scores_df.columns.drop('game_id'), errors='ignore') \
+                    .merge(scores_df, on='game_id', how='left').fillna({'quarantined': False})
+    return games_df, minutes_df
+
+
+def fit_rapm(matchups_df: pd.DataFrame, games_df: pd.DataFrame, file=None, names=None) -> pd.DataFrame:
+    """Fit the RAPM of players from the matchups of the games not quarantined (see nbl.rapm)
+
+    Args:
+        matchups_df (pd.DataFrame): matchups of the games
+        games_df (pd.DataFrame): games, with column quarantined (see reconcile_season())
+        file (str | Path): Pickle file of a previous fit to warm-start from, if it exists
+        names (function): name to show of a player id (see registry.PlayerRegistry.name())
+
+    Returns:
+        pd.DataFrame: the RAPM of each player
+    """
+    import pandas as pd
+    from nbl import rapm
+
+    init_df = pd.read_pickle(file) if file is not None and os.path.exists(file) else None
+    quarantined = games_df.loc[games_df['quarantined'], 'game_id'] if 'quarantined' in games_df else []
+    with metrics.span('fit_rapm'):
+        return rapm.fit_rapm(matchups_df[~matchups_df['game_id'].isin(quarantined)], init_df=init_df, names=names)
+
+
+def build_team_season(team_games_df: pd.DataFrame, file=None, game_ids: list = None,
+                      old_team_games_df: pd.DataFrame = None) -> pd.DataFrame:
+    """Build the team stats of a season by updating the saved ones with the team games of new or changed games
+
+    The counts of the new games are added to those of the saved table and the counts saved of changed
+    games are subtracted (see bball_stats.update_team_stats()), so the season is not summed again. If there
+    is no saved table, or it does not add up to the team games saved (e.g., run killed while saving), all
+    team games are summed.
+
+    Args:
+        team_games_df (pd.DataFrame): team games of the season (with the new ones)
+        file (str | Path): Pickle file of the saved team stats of the season, if it exists
+        game_ids (list(str)): games new or changed (None to sum all team games)
+        old_team_games_df (pd.DataFrame): team games saved of the changed games, if any
+
+    Returns:
+        pd.DataFrame: the team stats of the season, one row per team
+    """
+    import pandas as pd
+    from nbl import bball_stats
+
+    if game_ids is None or file is None or not os.path.exists(file):
+        return bball_stats.accumulate_team_stats(team_games_df)
+    team_season_df = pd.read_pickle(file)
+    new_df = team_games_df[team_games_df['game_id'].isin(game_ids)]
+    old_df = old_team_games_df if old_team_games_df is not None else new_df.iloc[:0]
+    if team_season_df['games'].sum() != team_games_df.shape[0] - new_df.shape[0] + old_df.shape[0]:
+        log.warning("Saved team stats do not add up to the team games saved, summing all team games")
+        return bball_stats.accumulate_team_stats(team_games_df)
+    return bball_stats.update_team_stats(team_season_df, new_df, old_df)
+
+
+def build_season_tables(tables: dict, FILES: dict = None, ci=False, game_ids: list = None,
+                        old_team_games_df: pd.DataFrame = None) -> dict:
+    """Build the tables derived from all the games of a season: minutes reconciliation, team stats, lineups,
+    lineup matchups matrix, players on/off and RAPM of players
+
+    Args:
+        tables (dict): tables of the season (games, players, stints, and team_games and matchups, if any)
+        FILES (dict): the Pickle file of each table, to warm-start the RAPM and update the team stats from
+            the saved ones
+        ci (bool): add bootstrap confidence intervals of the ratings to the lineups and on/off tables
+        game_ids (list(str)): games new or changed since the saved tables (None if computed from scratch)
+        old_team_games_df (pd.DataFrame): team games saved of the changed games, if any
+
+    Returns:
+        dict: the same tables, with the games table scored (see reconcile_season()) and tables minutes,
+            team_season (saved counts updated with the team games, see build_team_season()), lineups
+            and lineup_matchups (accumulated by lineup, see matchups.accumulate_matchups()), on_off (see
+            bootstrap.on_off_df()) and rapm
+    """
+    from nbl import matchups, bootstrap
+
+    tables['games'], tables['minutes'] = reconcile_season(tables['games'], tables['stints'], tables['players'])
+    if tables.get('team_games') is not None and tables['team_games'].shape[0] > 0:
+        with metrics.span('team_season'):
+            tables['team_season'] = build_team_season(tables['team_games'], FILES and FILES['team_season'],
+                                                      game_ids, old_team_games_df)
+    if tables.get('matchups') is not None and tables['matchups'].shape[0] > 0:
+        # lineups and players are keyed by the ids of the players, names are those last seen (see nbl.registry)
+        players = registry.PlayerRegistry()
+        players.add_players(tables['players'])
+        with metrics.span('accumulate_matchups'):
+            tables['lineups'] = matchups.accumulate_matchups(tables['matchups'], by=['team', 'lineup_ids'])
+            tables['lineup_matchups'] = matchups.accumulate_matchups(tables['matchups'])
+        with metrics.span('on_off'):
+            tables['on_off'] = bootstrap.on_off_df(tables['matchups'], ci=ci, names=players.name)
+        if ci:
+            with metrics.span('lineup_cis'):
+                tables['lineups'] = bootstrap.add_lineup_cis(tables['lineups'], tables['matchups'])
+        tables['rapm'] = fit_rapm(tables['matchups'], tables['games'], FILES and FILES['rapm'], players.name)
+    return tables
+
+
+def build_game_record(game_id, round_no, teams: list) -> dict:
+    """Build the record of a game for the games table
+
+    Args:
+        game_id (str): id of the game
+        round_no (int): round of the game
+        teams (list): name and score of each team (see compute_game())
+
+    Returns:
+        dict: the game record (id, date, round, teams, scores, winner and venue)
+    """
+    game_team1, game_team2 = teams
+
+    # first, extract date of game from HTML page
+    try:
+        with metrics.game(game_id), metrics.span('get_game_info'):
+            game_info = tools.get_game_info(game_id)
+    except:
+        log.warning("No venue/date available")
+        game_info = { "venue" : math.nan, "date": math.nan}
+
+    return {"game_id": game_id,
+            "date" : game_info['date'],
+            "round": round_no,
+            "team1": game_team1[0],
+            "team2": game_team2[0],
+            "s1": game_team1[1],
+            "s2": game_team2[1],
+            "winner": 1 if game_team1[1] > game_team2[1] else 2,
+            "venue" : game_info["venue"]}
+
+
+def scrape_season(GAMES: list, data_dir: str, reload=False, save=False, resume=True, pool=None,
+                  profile_game=None, profiler='cprofile', scheduler=None, ci=False) -> dict:
+    """Scrape the games of a season not yet saved, compute their tables and add them to the saved ones
+
+    Args:
+        GAMES (list): games of the season, as tuples (game id, round number)
+        data_dir (str): folder to read JSON files and read/write tables of the season
+        reload (bool): compute all games from scratch, ignoring saved tables
+        save (bool): save the tables (with new games) in data_dir
+        resume (bool): resume games committed by a previous interrupted run
+        pool (Executor): pool to compute games in, if any (otherwise games computed here)
+        profile_game (str): id of a game to profile, if any
+        profiler (str): profiler to use for profile_game (see metrics.profile())
+        scheduler (GameScheduler): scheduler of the pending games, to probe only those due (all probed if None)
+        ci (bool): add bootstrap confidence intervals of ratings to the season lineup tables (see nbl.bootstrap)
+
+    Returns:
+        dict: tables of the season (games, players, stints, stint_stats, ...) and number of NEW games; tables
+            saved in parts (store.PART_TABLES: stint_stats, anomalies, splits) have only the rows of the new
+            games (see load_saved_tables())
+    """
     log.info(f"Starting to scrape games on: {datetime.datetime.now().strftime('%m/%d/%Y, %H:%M:%S')}")
     # sort games by rounds (second component of tuple) and get min/max rounds
-    GAMES.sort(key = lambda x: x[1])
+    #   rounds may be given as strings (e.g., ("2266873", "1")), so they are made numbers first
+    GAMES = sorted([(game[0], parse_round(game[1])) if isinstance(game, tuple) else game for game in GAMES],
+                   key=lambda x: round_key(x[1] if isinstance(x, tuple) else math.nan))
     first_round = GAMES[0][1]
     last_round = GAMES[-1][1]   # last round to scrape (start with last of season)
 
     print(f"Number of games to scrape ({len(GAMES)}) - Rounds {first_round} to {last_round}")
     log.debug(f"Games to scrape ({len(GAMES)}): {GAMES}")
     print(f"Folder to be used: {data_dir}")
-    print(f"Reload games? {args.reload}")
+    print(f"Reload games? {reload}")
 
     # We start by loading all saved previous games, if any, as we want to append to that database (and we don't want to recompute them).
-    saved_stint_stats_df = None
-    saved_stints_df = None
-    saved_games_df = None
-    saved_players_df = None
-    existing_games = []
-
+    #   tables themselves are only loaded if there are new games to add to them
     FILES = get_save_files(data_dir)
-
-    if not args.reload:
-        # load the stat dataframe already stored as a file
-        log.debug(f"Loading recorded dataframes from files")
-        try:
-            saved_stint_stats_df = pd.read_pickle(FILES['stint_stats'])
-            saved_stints_df = pd.read_pickle(FILES['stints'])
-            saved_games_df = pd.read_pickle(FILES['games'])
-            saved_players_df = pd.read_pickle(FILES['players'])
-            # collect game ids of all games recovered from file
-            existing_games = saved_games_df.game_id.unique()
-        except FileNotFoundError as e:
-            print("Error loading Pickle files: ", e)
-            saved_stint_stats_df = None
-            saved_stints_df = None
-            saved_games_df = None
-            saved_players_df = None
-            existing_games = []
-    else:
-        existing_games = []
+    saved_tables = None
+    existing_games = set() if reload else store.load_saved_games(data_dir)
+    if existing_games is None:  # no list of saved games (older data folder): get them from the tables
+        saved_tables = load_saved_tables(FILES)
+        existing_games = set() if saved_tables is None else set(saved_tables['games'].game_id)
+        if saved_tables is not None:    # record them, so next runs do not need to load the tables
+            store.save_saved_games(data_dir, existing_games)
 
     print(f"Number of games recovered from previous saves: {len(existing_games)}")
     print()
     log.debug(f"Games recovered ({len(existing_games)}): {existing_games}")
 
+    # dates and venues of games already scraped
+    tools.load_game_info_cache(Path(data_dir, GAME_INFO_FILE))
+
     # initialize list of dataframes
     stint_stats_dfs = []
     stints_dfs = []
     players_dfs = []
+    extra_dfs = {name: [] for name in store.EXTRA_TABLES}   # tables where a game may have no rows
     games_data = []
+
+    # resume games committed by a previous run that did not finish (e.g., crashed or killed)
+    checkpoint = Checkpoint(data_dir)
+    if not resume:
+        checkpoint.clear()
+    resumed_games = checkpoint.load()
+    for game_id, tables in resumed_games.items():
+        if game_id in existing_games:   # already saved in tables, nothing to resume
+            continue
+        games_data.append(tables['games'])
+        players_dfs.append(tables['players'])
+        stints_dfs.append(tables['stints'])
+        stint_stats_dfs.append(tables['stint_stats'])
+        for name in store.EXTRA_TABLES:
+            extra_dfs[name].append(tables.get(name))
+    if resumed_games:
+        print(f"Number of games resumed from interrupted run: {len(resumed_games)}")
+        log.debug(f"Games resumed ({len(resumed_games)}): {list(resumed_games)}")
+
+    # games being computed (in order), as tuples (game id, round no, future result)
+    pending = []
+
+    def commit_games(wait=False):
+        """Collect computed games in order, add them to the tables and commit them to the checkpoint"""
+        while pending and (wait or pending[0][2].done()):
+            game_id, round_no, future = pending.pop(0)
+            game = future.result()
+            game_team1, game_team2 = game['teams']
+            metrics.METRICS.add_game(game_id, game['metrics'])
+
+            # Add tables to collected set of tables, one per game
+            stint_stats_dfs.append(game['stint_stats'])
+            stints_dfs.append(game['stints'])
+            players_dfs.append(game['players'])
+            for name in store.EXTRA_TABLES:
+                extra_dfs[name].append(game[name])
+
+            # Next build the record for the game dataframe
+            game_record = build_game_record(game_id, round_no, game['teams'])
+            print(f"Extracted game {game_id} for round {round_no}: {game_team1[0]} ({game_team1[1]}) vs {game_team2[0]} ({game_team2[1]}) on {game_record['date']}")
+            games_data.append(game_record)
+
+            # save the PBP of the game (one file per game, not kept in memory after)
+            if save:
+                with metrics.game(game_id), metrics.span('save_game_pbp'):
+                    pbp_store.save_game_pbp(data_dir, game_id, game['pbp'])
+
+            # commit the game so it is not lost if the run does not finish
+            with metrics.game(game_id), metrics.span('checkpoint'):
+                checkpoint.save(game_id, {'games': game_record,
+                                          'players': game['players'],
+                                          'stints': game['stints'],
+                                          'stint_stats': game['stint_stats'],
+                                          **{name: game[name] for name in store.EXTRA_TABLES}})
+
     current_round = -1
     active_round = True    # current round has a game played
 
@@ -204,14 +545,21 @@ if __name__=="__main__":
             game_id, round_no = game
         else:
             game_id = game
-            round_no = np.nan # no round info available
+            round_no = math.nan # no round info available
 
         # don't scrape game data if already loaded from file, skip it
-        if game_id in existing_games:
+        if game_id in existing_games or game_id in resumed_games:
             active_round = True
             log.debug(f"Game {game_id} was already saved on file; no scrapping...")
             continue
 
+        # don't probe games not due yet (e.g., not played or probed a moment ago), unless already on file
+        cached = os.path.exists(Path(data_dir, f"data-{game_id}.json"))
+        if scheduler is not None and not cached and not scheduler.due(game_id):
+            log.debug(f"Game {game_id} not due for a probe until {scheduler.next_probe(game_id)}")
+            print(f"Game {game_id} for round {round_no} not due yet!")
+            continue
+
         ##################################################################
         # !!! MAIN STEP: scrape and compute the actual stats for the game
         ##################################################################
@@ -219,58 +567,56 @@ if __name__=="__main__":
 
         # 1. Read game JSON file
         try:
-            game_json = tools.get_json_data(game_id, dir=data_dir)
+            with metrics.game(game_id):
+                if scheduler is None or cached:
+                    game_json = tools.get_json_data(game_id, dir=data_dir)
+                else:
+                    game_json = scheduler.probe(game_id)
             active_round = True
         except (HTTPError, ValueError) as e:
             log.debug(f"Game {game_id} JSON data not available yet for round: {round_no}: ", type(e), e)
             print(f"Game {game_id} for round {round_no} not available yet!")
             continue
 
-        result = bball_stats.build_game_stints_stats_df(game_json, game_id)
-        game_stint_stats_df = result['stint_stats_df']   #  this is basically what we care, the stint stats
-        game_stints_df = result['stints_df']
-        game_team1, game_team2 = result['teams']
-
-        # Add the game id column to game tables
-        game_stint_stats_df.insert(0, 'game_id', game_id)
-        game_stints_df.insert(0, 'game_id', game_id)
-
-        # Extract players in the game
-        players_df = bball_stats.get_players_stats(game_json)
-        players_df.insert(0, 'game_id', game_id)
-
-        # Add tables to collected set of tables, one per game
-        stint_stats_dfs.append(game_stint_stats_df)
-        stints_dfs.append(game_stints_df)
-        players_dfs.append(players_df)
-
-        # Next build the record for the game dataframe
-        # first, extract date of game from HTML page
-        try:
-            game_info = tools.get_game_info(game_id)
-        except:
-            log.warning("No venue/date available")
-            game_info = { "venue" : np.nan, "date": np.nan}
-
-        print(f"Extracted game {game_id} for round {round_no}: {game_team1[0]} ({game_team1[1]}) vs {game_team2[0]} ({game_team2[1]}) on {game_info['date']}")
-
-        games_data.append({"game_id": game_id,
-                            "date" : game_info['date'],
-                            "round": round_no,
-                            "team1": game_team1[0],
-                            "team2": game_team2[0],
-                            "s1": game_team1[1],
-                            "s2": game_team2[1],
-                            "winner": 1 if game_team1[1] > game_team2[1] else 2,
-                            "venue" : game_info["venue"]}
-                        )
+        # 2. Compute the game tables (in the compute pool, if any) and commit those already done
+        game_profiler = profiler if str(game_id) == str(profile_game) else None
+        if pool is None:
+            future = Future()
+            future.set_result(compute_game(game_json, game_id, game_profiler))
+        else:
+            future = pool.submit(compute_game, game_json, game_id, game_profiler)
+        pending.append((game_id, round_no, future))
+        commit_games()
 
+    commit_games(wait=True)
+    if scheduler is not None:
+        scheduler.save(existing_games | set(resumed_games) | {g['game_id'] for g in games_data})
 
     #################################
     # All games have been processed, now put all data-frames together
     #################################
     if len(games_data) == 0:
-        raise SystemExit("No new games scrapped! Finishing...")
+        checkpoint.clear()
+        print("No new games scrapped!")
+        return {**(saved_tables or {}), 'new_games': 0}
+
+    import pandas as pd
+
+    # load the saved tables to add new games to (new data of a game replaces any saved one)
+    if saved_tables is None and not reload:
+        saved_tables = load_saved_tables(FILES)
+    #   tables saved in parts are not loaded: only the rows of the new games are saved to them (see save_tables())
+    saved_games_df, saved_players_df, saved_stints_df, saved_stint_stats_df = None, None, None, None
+    saved_extra_dfs = {}
+    if saved_tables is not None:
+        new_games = [g['game_id'] for g in games_data]
+        saved_games_df, saved_players_df, saved_stints_df, saved_stint_stats_df = \
+            [saved_tables[name][~saved_tables[name].game_id.isin(new_games)] if name in saved_tables else None
+             for name in store.TABLES]
+        saved_extra_dfs = {name: saved_tables[name][~saved_tables[name].game_id.isin(new_games)]
+                           for name in store.EXTRA_TABLES if name in saved_tables}
+        if existing_games.difference(saved_games_df.game_id):
+            log.warning(f"Games listed as saved but not found in saved tables: {existing_games.difference(saved_games_df.game_id)}")
 
     # First, build a dataframe with all the game data collected
     games_scrapped_df = pd.DataFrame(games_data)    # games that have been scrapped from web
@@ -289,16 +635,32 @@ if __name__=="__main__":
     stints_df = pd.concat(stints_dfs + ([saved_stints_df] if saved_stints_df is not None else []))
     stints_df.reset_index(inplace=True, drop=True)
 
+    # Build anomalies, matchups, splits and team games dataframes (games of older runs may have none)
+    tables = {'games': games_df, 'players': players_df, 'stints': stints_df, 'stint_stats': stint_stats_df}
+    for name in store.EXTRA_TABLES:
+        dfs = [df for df in extra_dfs[name] + [saved_extra_dfs.get(name)] if df is not None]
+        tables[name] = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=['game_id'])
+
+    # Build the tables of the whole season: minutes in stints reconciled with the box score (to quarantine
+    #   games whose stints are broken) and lineup matchups matrix
+    old_team_games_df = saved_tables['team_games'][saved_tables['team_games'].game_id.isin(games_scrapped_df.game_id)] \
+                            if saved_tables is not None and 'team_games' in saved_tables else None
+    tables = build_season_tables(tables, FILES, ci, None if reload else list(games_scrapped_df.game_id), old_team_games_df)
+    games_df = tables['games']
+    quarantined = games_df.loc[games_df.quarantined & games_df.game_id.isin(games_scrapped_df.game_id), 'game_id'].tolist()
+
     msg = f"""
     Number of total games collected: {games_df.shape[0]}
     Number of NEW collected: {games_df.shape[0] - len(existing_games)}
     Number of PENDING/FAILED games {len(GAMES) - games_df.shape[0]}
+    Number of substitution anomalies in NEW games: {sum(df.shape[0] for df in extra_dfs['anomalies'] if df is not None)}
+    NEW games quarantined (stints far from box score minutes): {quarantined}
     {games_scrapped_df}
     """
     print(msg)
     log.info(msg)
 
-    if args.save:
+    if save:
         # make a backup of existing tables on files
         for pkl_file in FILES.values():
             for ext in ['.csv', '.xlsx', '.pkl']:
@@ -307,28 +669,353 @@ if __name__=="__main__":
                     # print("Backup file", file)
                     shutil.copy(file, str(file) + ".bak")
 
-        # dump stint stats dataframe
-        stint_stats_df.to_pickle(Path(data_dir, "stint_stats_df").with_suffix(".pkl"))
-        stint_stats_df.to_csv(Path(data_dir, "stint_stats_df").with_suffix(".csv"), index=False)
-        stint_stats_df.to_excel(Path(data_dir, "stint_stats_df").with_suffix(".xlsx"), index=False)
-
-        # dump stint stats dataframe
-        stints_df.to_pickle(Path(data_dir, "stints_df").with_suffix(".pkl"))
-        stints_df.to_csv(Path(data_dir, "stints_df").with_suffix(".csv"), index=False)
-        stints_df.to_excel(Path(data_dir, "stints_df").with_suffix(".xlsx"), index=False)
-
-        # dump game dataframe
-        games_df.to_pickle(Path(data_dir, "games_df").with_suffix(".pkl"))
-        games_df.to_csv(Path(data_dir, "games_df").with_suffix(".csv"), index=False)
-        games_df.to_excel(Path(data_dir, "games_df").with_suffix(".xlsx"), index=False)
-
-        # dump players dataframe
-        players_df.to_pickle(Path(data_dir, "players_df").with_suffix(".pkl"))
-        players_df.to_csv(Path(data_dir, "players_df").with_suffix(".csv"), index=False)
-        players_df.to_excel(Path(data_dir, "players_df").with_suffix(".xlsx"), index=False)
+        # dump all dataframes (each file written atomically: temp file first, then renamed)
+        #   games table goes last: a game is saved only once it is in the games table
+        save_tables(tables, FILES, [game_record['game_id'] for game_record in games_data], reload)
+        store.save_saved_games(data_dir, games_df.game_id)
+        tools.save_game_info_cache(Path(data_dir, GAME_INFO_FILE), games_df.game_id)
+
+        # update the registry of players, the SQL database and the stint index of the season with the new games
+        #   (see nbl.registry, nbl.query and nbl.stint_index)
+        with metrics.span('update_registry'):
+            registry.update_registry(data_dir, tables['players'], [game_record['game_id'] for game_record in games_data])
+        with metrics.span('update_db'):
+            query.update_db(data_dir, tables, [game_record['game_id'] for game_record in games_data])
+        with metrics.span('update_index'):
+            stint_index.update_index(data_dir, tables['stints'], [game_record['game_id'] for game_record in games_data])
 
         now = datetime.datetime.now() # current date and time
         date_time = now.strftime("%m/%d/%Y, %H:%M:%S")
 
         print(f"Saved tables in folder {data_dir} @ {date_time}")
-        log.info(f"Saved tables in folder {data_dir} @ {date_time}")
\ No newline at end of file
+        log.info(f"Saved tables in folder {data_dir} @ {date_time}")
+
+    # run finished: games are either saved in the tables or intentionally not saved (no --save)
+    checkpoint.clear()
+
+    return {**tables, 'new_games': len(games_data)}
+
+
+def refresh_season(GAMES: list, data_dir: str, game_ids: list, save=False, ci=False) -> dict:
+    """Fetch again some games of a season and, for those whose data changed, replace their rows in the tables
+
+    The data of a game changes when the feed corrects it (e.g., a missing game end event or wrong
+    substitutions). A game is recomputed only if the content hash of its new data differs from the
+    one saved in data_dir; rows of all other games are left as they are.
+
+    Args:
+        GAMES (list): games of the season, as tuples (game id, round number)
+        data_dir (str): folder to read/write JSON files and tables of the season
+        game_ids (list): ids of the games to refresh (those not in the season are ignored)
+        save (bool): save the tables (with the changed games) in data_dir
+        ci (bool): add bootstrap confidence intervals of ratings to the season lineup tables (see nbl.bootstrap)
+
+    Returns:
+        dict: tables of the season (games, players, stints, stint_stats, ...) and number of games changed
+            (new_games); tables saved in parts (store.PART_TABLES) have only the rows of the changed games
+    """
+    rounds = {str(game[0]): parse_round(game[1]) for game in GAMES if isinstance(game, tuple)}
+    season_games = [str(game[0] if isinstance(game, tuple) else game) for game in GAMES]
+    game_ids = [str(game_id) for game_id in game_ids if str(game_id) in season_games]
+    if not game_ids:
+        return {'new_games': 0}
+    print(f"Games to refresh in folder {data_dir}: {game_ids}")
+
+    tools.load_game_info_cache(Path(data_dir, GAME_INFO_FILE))
+
+    # 1. Fetch the games again and compute those whose data changed
+    changed = {}
+    for game_id in game_ids:
+        file_json = Path(data_dir, f"data-{game_id}.json")
+        old_hash = tools.json_hash(tools.get_json_data(game_id, dir=data_dir)) if file_json.exists() else None
+        try:
+            with metrics.game(game_id):
+                game_json = tools.fetch_json_data(game_id)
+        except (HTTPError, OSError, ValueError) as e:
+            print(f"Game {game_id} could not be fetched again: {e}")
+            continue
+        if tools.json_hash(game_json) == old_hash:
+            print(f"Game {game_id} has not changed")
+            continue
+
+        with store.atomic_path(file_json) as tmp, open(tmp, 'w') as f:
+            json.dump(game_json, f)
+        game = compute_game(game_json, game_id)
+        metrics.METRICS.add_game(game_id, game['metrics'])
+        changed[game_id] = {**game, 'games': build_game_record(game_id, rounds.get(game_id, math.nan), game['teams'])}
+        print(f"Game {game_id} has changed: {game['teams'][0][0]} ({game['teams'][0][1]}) vs {game['teams'][1][0]} ({game['teams'][1][1]})")
+
+    if not changed:
+        print("No games changed!")
+        return {'new_games': 0}
+
+    # 2. Replace the rows of the changed games in the saved tables
+    import pandas as pd
+
+    FILES = get_save_files(data_dir)
+    tables = load_saved_tables(FILES) or {}
+    if 'games' in tables:   # keep date and venue saved if they could not be scraped again
+        saved_info = tables['games'].set_index('game_id')[['date', 'venue']]
+        for game_id, game in changed.items():
+            if pd.isna(game['games']['date']) and game_id in saved_info.index:
+                game['games'].update(saved_info.loc[game_id].to_dict())
+    old_team_games_df = tables['team_games'][tables['team_games'].game_id.isin(changed)] if 'team_games' in tables else None
+    for name in store.TABLES + store.EXTRA_TABLES:
+        new_df = pd.DataFrame([game['games'] for game in changed.values()]) if name == 'games' \
+                    else pd.concat([game[name] for game in changed.values()])
+        tables[name] = store.replace_game_rows(tables[name], new_df, changed) if name in tables else new_df.reset_index(drop=True)
+    tables = build_season_tables(tables, FILES, ci, list(changed), old_team_games_df)
+
+    if save:
+        save_tables(tables, FILES, list(changed))
+        for game_id, game in changed.items():
+            pbp_store.save_game_pbp(data_dir, game_id, game['pbp'])
+        store.save_saved_games(data_dir, tables['games'].game_id)
+        tools.save_game_info_cache(Path(data_dir, GAME_INFO_FILE), tables['games'].game_id)
+        registry.update_registry(data_dir, tables['players'], list(changed))
+        query.update_db(data_dir, tables, list(changed))
+        stint_index.update_index(data_dir, tables['stints'], list(changed))
+        print(f"Saved tables with {len(changed)} games refreshed in folder {data_dir}")
+
+    return {**tables, 'new_games': len(changed)}
+
+
+def build_players_index(seasons: dict) -> pd.DataFrame:
+    """Build a cross-season index of players: names, seasons, teams and number of games played
+
+    Players are matched across seasons by their id (see nbl.registry), so a player whose name changed is
+    one player (with all names seen) and players sharing a name are not merged.
+
+    Args:
+        seasons (dict): tables of each season (as returned by scrape_season()), keyed by season name
+
+    Returns:
+        pd.DataFrame: a table with one row per player
+    """
+    import pandas as pd
+
+    dfs = []
+    for season, tables in seasons.items():
+        if tables.get('players') is None:
+            continue
+        # team name of each player in a game from the games table
+        teams_df = tables['games'][['game_id', 'team1', 'team2']].melt(id_vars='game_id', var_name='tno', value_name='team')
+        teams_df['tno'] = teams_df['tno'].str[-1]
+        df = tables['players'][['game_id', 'tno', 'player', 'player_id']].astype({'tno': str}).merge(teams_df, how='left')
+        df.insert(0, 'season', season)
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(columns=['player_id', 'player', 'names', 'no_seasons', 'seasons', 'teams', 'games'])
+
+    df = pd.concat(dfs).sort_values('game_id', key=lambda x: x.astype('int64'))
+    index_df = df.groupby('player_id').agg(player=('player', 'last'),     # last name seen
+                                           names=('player', lambda x: list(x.unique())),
+                                           no_seasons=('season', 'nunique'),
+                                           seasons=('season', lambda x: sorted(x.unique())),
+                                           teams=('team', lambda x: sorted(x.dropna().unique())),
+                                           games=('game_id', 'nunique'))
+    index_df.reset_index(inplace=True)
+
+    return index_df
+
+
+def parse_seasons(specs: list, data_dir: str) -> list:
+    """Get the (games module, data folder) of each season given in the command line
+
+    A season is given as MODULE or MODULE:DIR (MODULE can also be a competition id). With a single season, its folder is data_dir;
+    with many seasons, each season goes by default in a sub-folder of data_dir named as the module.
+
+    Args:
+        specs (list(str)): seasons as given in the command line
+        data_dir (str): data folder given in the command line
+
+    Returns:
+        list(tuple(str, str)): games module and data folder of each season
+    """
+    seasons = []
+    for spec in specs:
+        module, _, season_dir = spec.partition(':')
+        if not season_dir:
+            season_dir = data_dir if len(specs) == 1 else os.path.join(data_dir, module)
+            os.makedirs(season_dir, exist_ok=True)
+        seasons.append((module, season_dir))
+
+    return seasons
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=
+        'Statistics scrapper for  Australian NBL league. Computes players and stint lineups stats.\n'
+        'Examples:\n\n'
+        '\t python -m nbl.nbl_scrapper\n'
+        '\t python -m nbl.nbl_scrapper --games games_22_23\n'
+        '\t python -m nbl.nbl_scrapper --games games_22_23 --data-dir test --save\n'
+        '\t python -m nbl.nbl_scrapper --games games_22_23 games_23_24 --data-dir data --jobs 4 --save\n'
+        '\t python -m nbl.nbl_scrapper --games games_22_23:data-22_23 games_23_24:data-23_24 --save\n'
+        '\t python -m nbl.nbl_scrapper --games 34173:data-23_24 --save\n',
+        formatter_class=argparse.RawTextHelpFormatter
+        # formatter_class = argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--data-dir',
+        type=str,
+        default=DATA_DIR_DEFAULT,
+        help='Directory to read and write data (e.g., csv and json files) (default: %(default)s).\n'
+            'With many seasons, each season uses a sub-folder named as its games module.'
+    )
+    parser.add_argument(
+        '--games',
+        type=str,
+        nargs='+',
+        default=['games.py'],
+        help='File(s) containing the games to scrape (defines list variable GAMES), one per season (default: %(default)s).\n'
+            'Each season can be given as MODULE or MODULE:DIR to set its own data folder.\n'
+            'A season given as a number is a competition id: its games are discovered from the feed (see nbl.schedule).'
+    )
+    parser.add_argument(
+        '--reload',
+        action='store_true',
+        default=False,
+        help='Reload all games from scratch; do not use store files (default: %(default)s).'
+    )
+    parser.add_argument(
+        '--refresh',
+        type=str,
+        nargs='+',
+        metavar='GAME_ID',
+        help='Fetch these games again and, if their data changed, replace only their rows in the tables\n'
+            '(no other games are scraped) (default: no refresh).'
+    )
+    parser.add_argument(
+        '--probe-all',
+        action='store_true',
+        default=False,
+        help='Probe every game not yet stored, not only those due (see nbl.scheduler) (default: %(default)s).'
+    )
+    parser.add_argument(
+        '--save',
+        action='store_true',
+        default=False,
+        help='Append games scraped to current set of games (default: %(default)s).'
+    )
+    parser.add_argument(
+        '--ci',
+        action='store_true',
+        default=False,
+        help='Add bootstrap confidence intervals of ratings to the season lineups and on/off tables (default: %(default)s).'
+    )
+    parser.add_argument(
+        '--no-resume',
+        action='store_true',
+        default=False,
+        help='Discard games committed by a previous interrupted run instead of resuming it (default: %(default)s).'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of processes to compute games in, shared by all seasons (default: %(default)s).'
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        metavar='run|GAME_ID',
+        help='Profile the whole run (main process only) or the computation of one game;\n'
+            f'saved as {PROFILE_FILE}[-GAME_ID].prof (or .html for pyinstrument) (default: no profiling).'
+    )
+    parser.add_argument(
+        '--profiler',
+        choices=['cprofile', 'pyinstrument'],
+        default='cprofile',
+        help='Profiler to use with --profile; pyinstrument must be installed (default: %(default)s).'
+    )
+
+
+    args = parser.parse_args()
+    setup_logging()
+    log.debug(args)
+
+    # timing and counters of all stages are reported in REPORT_FILE, even if the run fails
+    profile_file = f"{PROFILE_FILE}.{'html' if args.profiler == 'pyinstrument' else 'prof'}"
+    try:
+        with metrics.profile(profile_file, args.profiler) if args.profile == 'run' else nullcontext():
+            run(args)
+    finally:
+        metrics.METRICS.save(REPORT_FILE)
+
+
+def run(args):
+    """Scrape all seasons given in the command line arguments and build the cross-season tables"""
+
+    if not os.path.exists(args.data_dir) and not all(':' in spec for spec in args.games):
+        log.error(f"Data folder *{args.data_dir}* does not exist! Exit...")
+        exit(1)
+    seasons = parse_seasons(args.games, args.data_dir)
+    for (_, season_dir) in seasons:
+        if not os.path.exists(season_dir):
+            log.error(f"Data folder *{season_dir}* does not exist! Exit...")
+            exit(1)
+
+    # HTTP session and game info cache (in tools) and compute pool are shared by all seasons
+    pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    try:
+        season_tables = {}
+        for (games_module, season_dir) in seasons:
+            scheduler = None if args.probe_all else GameScheduler(season_dir)
+            if games_module.isdigit():  # competition id: final games of its schedule (see nbl.schedule)
+                from nbl import schedule
+                season_schedule = schedule.get_schedule(games_module, season_dir)
+                GAMES = schedule.final_games(season_schedule)
+                if scheduler is not None:
+                    scheduler.add_schedule(season_schedule)
+            else:
+                GAMES = load_games(games_module)
+            if args.refresh:
+                season_tables[games_module] = refresh_season(GAMES, season_dir, args.refresh, save=args.save, ci=args.ci)
+                continue
+            season_tables[games_module] = scrape_season(GAMES, season_dir,
+                                                        reload=args.reload,
+                                                        save=args.save,
+                                                        resume=not args.no_resume,
+                                                        pool=pool,
+                                                        profile_game=args.profile,
+                                                        profiler=args.profiler,
+                                                        scheduler=scheduler,
+                                                        ci=args.ci)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if sum(tables['new_games'] for tables in season_tables.values()) == 0:
+        raise SystemExit("No games changed! Finishing..." if args.refresh else "No new games scrapped! Finishing...")
+
+    # cross-season tables
+    if len(seasons) > 1:
+        for (games_module, season_dir) in seasons:  # seasons with no new games: load their saved tables
+            if 'players' not in season_tables[games_module]:
+                season_tables[games_module].update(load_saved_tables(get_save_files(season_dir)) or {})
+        players_index_df = build_players_index(season_tables)
+        print(f"Number of players across {len(seasons)} seasons: {players_index_df.shape[0]}")
+
+        # RAPM over the player pool of all seasons (warm-started from the saved one), players matched by id
+        import pandas as pd
+        matchups_dfs = [tables['matchups'] for tables in season_tables.values() if tables.get('matchups') is not None]
+        rapm_df = None
+        if matchups_dfs:
+            games_df = pd.concat([tables['games'] for tables in season_tables.values()])
+            players = registry.PlayerRegistry()
+            for tables in season_tables.values():
+                players.add_players(tables['players'])
+            rapm_df = fit_rapm(pd.concat(matchups_dfs, ignore_index=True), games_df, Path(args.data_dir, "rapm_df.pkl"),
+                               players.name)
+            print(f"RAPM of {rapm_df.shape[0]} players across {len(seasons)} seasons")
+        if args.save:
+            store.save_table(players_index_df, Path(args.data_dir, "players_index_df"))
+            if rapm_df is not None:
+                store.save_table(rapm_df, Path(args.data_dir, "rapm_df"))
+            print(f"Saved cross-season tables in folder {args.data_dir}")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Season-wide play-by-play store: the PBP of each game annotated with the stints of both teams
+
+The PBP computed for the stint stats of a game (see bball_stats.build_game_stints_stats_df()) is saved
+per game under the PBP_DIR sub-folder of the season folder, in a compact columnar form:
+
+  - actions (actionType, subType, periodType) as categories;
+  - clock as an integer: hundredths of a second left in the period;
+  - players as integer ids (see nbl.registry, 0 for plays with no player) and team number;
+  - stint ids of both teams (stint1, stint2), as in the stint tables.
+
+Files are Parquet when pyarrow is installed, so load_pbp() reads only the columns asked for and pushes
+the filters on game, team and action down to the files (a whole season is never in memory). Without
+pyarrow, games are Pickle files read and filtered one at a time. To load some plays of a season:
+
+    python -m nbl.pbp_store data-22_23 --columns game_id tno player_id actionType stint1 --action 3pt
+"""
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
+import argparse
+from pathlib import Path
+
+from nbl import store, registry
+
+import logging
+log = logging.getLogger("main.pbp_store")
+
+PBP_DIR = "pbp"     # sub-folder of the season data folder with the PBP of each game
+
+PBP_CATEGORIES = ['game_id', 'periodType', 'actionType', 'subType']
+PBP_INTS = {'period': 'int8', 'clock': 'int32', 's1': 'int16', 's2': 'int16', 'tno': 'int8', 'pno': 'int16',
+            'player_id': 'int64', 'success': 'int8', 'scoring': 'int8', 'actionNumber': 'int32',
+            'stint1': 'int16', 'stint2': 'int16'}
+PBP_COLS = ['game_id', 'period', 'periodType', 'clock', 's1', 's2', 'tno', 'pno', 'player_id', 'success',
+            'actionType', 'subType', 'scoring', 'actionNumber', 'stint1', 'stint2']
+
+
+def has_parquet() -> bool:
+    """Whether Parquet files can be written and read (pyarrow installed and importable)"""
+    try:
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def compact_pbp_df(pbp_df: pd.DataFrame, game_json: dict, game_id) -> pd.DataFrame:
+    """Compact form of the annotated PBP of a game, to be stored
+
+    Args:
+        pbp_df (pd.DataFrame): PBP of the game with stint columns (see bball_stats.build_game_stints_stats_df())
+        game_json (dict): json dict data of the game (for the ids of the players)
+        game_id (str): id of the game
+
+    Returns:
+        pd.DataFrame: the plays in game order with the columns of PBP_COLS
+    """
+    import pandas as pd
+
+    df = pbp_df.reset_index(drop=True)
+    clock = pd.to_timedelta(df['clock'].astype(str)).dt.total_seconds()
+    ids = pd.Series(registry.game_player_ids(game_json), dtype='int64')
+    keys = pd.MultiIndex.from_arrays([df['tno'].astype(int), df['pno'].astype(int)])
+    compact_df = df.assign(game_id=str(game_id),
+                           clock=(clock * 100).round(),
+                           player_id=ids.reindex(keys).fillna(0).to_numpy() if len(ids) else 0)
+    compact_df = compact_df[PBP_COLS].astype(PBP_INTS)
+    return compact_df.astype({col: 'category' for col in PBP_CATEGORIES})
+
+
+def pbp_file(data_dir, game_id, parquet=None) -> Path:
+    """File of the PBP of a game in a season folder (Parquet or Pickle, see has_parquet())"""
+    parquet = has_parquet() if parquet is None else parquet
+    return Path(data_dir, PBP_DIR, f"{game_id}.{'parquet' if parquet else 'pkl'}")
+
+
+def save_game_pbp(data_dir, game_id, pbp_df: pd.DataFrame):
+    """Save (atomically) the compact PBP of a game in a season folder, replacing any saved one
+
+    Args:
+        data_dir (str | Path): season folder
+        game_id (str): id of the game
+        pbp_df (pd.DataFrame): compact PBP of the game (see compact_pbp_df())
+    """
+    parquet = has_parquet()
+    file = pbp_file(data_dir, game_id, parquet)
+    file.parent.mkdir(exist_ok=True)
+    with store.atomic_path(file) as tmp:
+        if parquet:
+            pbp_df.to_parquet(tmp, index=False)
+        else:
+            pbp_df.to_pickle(tmp)
+    other = pbp_file(data_dir, game_id, not parquet)    # a game saved before in the other format
+    if other.exists():
+        other.unlink()
+
+
+def saved_pbp_games(data_dir) -> list:
+    """Ids of the games with PBP saved in a season folder"""
+    return sorted(file.stem for file in Path(data_dir, PBP_DIR).glob('*') if file.suffix in ['.parquet', '.pkl'])
+
+
+def load_pbp(data_dir, columns: list = None, game_ids: list = None, tno: int = None,
+             action_types: list = None) -> pd.DataFrame:
+    """Load the saved PBP of a season, only the plays and columns asked for
+
+    Filters are pushed down to the Parquet files (only the row groups and columns needed are read); for
+    Pickle files, games are read and filtered one at a time.
+
+    Args:
+        data_dir (str | Path): season folder
+        columns (list(str)): columns to load (default: all, see PBP_COLS)
+        game_ids (list(str)): games to load (default: all saved)
+        tno (int): team of the plays to load (default: both teams and game events)
+        action_types (list(str)): action types of the plays to load (default: all)
+
+    Returns:
+        pd.DataFrame: the plays, game by game in game order
+    """
+    import pandas as pd
+
+    columns = list(columns or PBP_COLS)
+    pbp_dir = Path(data_dir, PBP_DIR)
+    game_ids = None if game_ids is None else [str(game_id) for game_id in game_ids]
+    dfs = []
+
+    parquet_files = sorted(pbp_dir.glob('*.parquet'))
+    if parquet_files and game_ids is not None:
+        parquet_files = [file for file in parquet_files if file.stem in game_ids]
+    if parquet_files:
+        import pyarrow.dataset as ds
+
+        filter = None
+        for expr in [ds.field('tno') == tno if tno is not None else None,
+                     ds.field('actionType').isin(action_types) if action_types is not None else None]:
+            if expr is not None:
+                filter = expr if filter is None else filter & expr
+        dataset = ds.dataset([str(file) for file in parquet_files], format='parquet')
+        dfs.append(dataset.to_table(columns=columns, filter=filter).to_pandas())
+
+    for file in sorted(pbp_dir.glob('*.pkl')):
+        if game_ids is not None and file.stem not in game_ids:
+            continue
+        df = pd.read_pickle(file)
+        mask = pd.Series(True, index=df.index)
+        if tno is not None:
+            mask &= df['tno'] == tno
+        if action_types is not None:
+            mask &= df['actionType'].isin(action_types)
+        dfs.append(df.loc[mask, columns])
+
+    if not dfs:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(dfs, ignore_index=True).astype({col: 'category' for col in PBP_CATEGORIES if col in columns})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load plays of the PBP saved in a season folder.")
+    parser.add_argument('data_dir', type=str,
+                        help='Season folder with the PBP saved (see --save of the scrapper).')
+    parser.add_argument('--columns', nargs='+', type=str,
+                        help=f'Columns to load (default: all, {PBP_COLS}).')
+    parser.add_argument('--games', nargs='+', type=str,
+                        help='Ids of the games to load (default: all).')
+    parser.add_argument('--tno', type=int,
+                        help='Team number of the plays to load (default: all).')
+    parser.add_argument('--action', nargs='+', type=str,
+                        help='Action types of the plays to load, e.g., 3pt 2pt (default: all).')
+    args = parser.parse_args()
+
+    import time
+    start = time.perf_counter()
+    pbp_df = load_pbp(args.data_dir, args.columns, args.games, args.tno, args.action)
+    print(f"Loaded {pbp_df.shape[0]} plays of {len(saved_pbp_games(args.data_dir))} games saved "
+          f"in {time.perf_counter() - start:.2f} seconds ({pbp_df.memory_usage(deep=True).sum() / 2**20:.1f} MB)")
+    print(pbp_df)
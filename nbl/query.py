@@ -0,0 +1,236 @@
+"""
+SQL query layer over the tables of a season, in an embedded SQLite database (DB_FILE in the season folder)
+
+The per-game tables (games, players, stints, stint_stats, anomalies, matchups, splits and team_games), the
+season tables, the players of each stint (stint_players) and the PBP saved (see nbl.pbp_store) are
+registered as SQL tables, with indexes on game_id, team, lineup and player. Lineups are stored as text,
+the players joined by LINEUP_SEP (their id in queries; lineup_ids with the ids of the players, see
+nbl.registry), and the players of each stint as rows of stint_players (with name and id), so stints with
+a player are found through the index.
+
+The scrapper updates the database when it saves the tables: the rows of the new (or refreshed) games are
+replaced and SQLite maintains the indexes; season tables are replaced whole. Tables saved in parts (see
+nbl.store) are read from their parts, only those with rows to load. Queries run in SQLite and only
+their results are loaded, e.g.:
+
+    python -m nbl query "SELECT team, lineup, SUM(mins) AS mins FROM stints GROUP BY team, lineup ORDER BY mins DESC LIMIT 10" --data-dir data-22_23
+
+or from Python: query(data_dir, sql, params).
+"""
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
+import datetime
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+from nbl import store, pbp_store, registry
+
+import logging
+log = logging.getLogger("main.query")
+
+DB_FILE = "nbl.sqlite"  # database file in the season data folder
+DB_TABLES = store.TABLES + store.EXTRA_TABLES   # per-game tables, updated by game (others replaced whole)
+DB_INDEXES = ['game_id', 'team', 'lineup', 'lineup_ids', 'player', 'player_id']  # columns indexed in every table with them
+LINEUP_SEP = ", "       # separator of the players of a lineup stored as text
+PBP_CHUNK = 100         # games of PBP loaded at once into the database
+
+
+def db_file(data_dir) -> Path:
+    """Database file of a season folder"""
+    return Path(data_dir, DB_FILE)
+
+
+def connect(data_dir, read_only=False) -> sqlite3.Connection:
+    """Connect to the database of a season folder (created if not read only)"""
+    if read_only:
+        file = db_file(data_dir)
+        if not file.exists():
+            raise FileNotFoundError(f"No database in {data_dir}: save the tables with the scrapper first (or build it with --build, see build_db())")
+        return sqlite3.connect(f"{file.resolve().as_uri()}?mode=ro", uri=True)
+    return sqlite3.connect(db_file(data_dir))
+
+
+def sql_value(value):
+    """Value of a cell as stored in SQL: lineups (lists of names or ids) as text, times as ISO text"""
+    if isinstance(value, (list, tuple)):
+        if all(isinstance(x, (str, int)) for x in value):
+            return LINEUP_SEP.join(str(x) for x in value)
+        return str(value)
+    if isinstance(value, datetime.time):
+        return value.isoformat()
+    return value
+
+
+def sql_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Table with columns SQLite can store (categories as text, lineups and times as text, see sql_value())"""
+    import pandas as pd
+
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+        if df[col].dtype == object:
+            df[col] = df[col].map(sql_value)
+    return df
+
+
+def stint_players_df(stints_df: pd.DataFrame, players_df: pd.DataFrame) -> pd.DataFrame:
+    """Players of each stint, one row per (game_id, tno, stint, player) with the id of the player"""
+    ids_df = registry.lineup_players_df(stints_df, players_df)
+    stints_df = stints_df[['id', 'team']].reset_index(drop=True).rename(columns={'id': 'stint'})
+    ids_df = ids_df.join(stints_df, on='row')
+    return ids_df[['game_id', 'tno', 'stint', 'team', 'player', 'player_id']]
+
+
+def table_columns(con: sqlite3.Connection, name: str) -> list:
+    """Columns of a table of the database (empty if there is no such table)"""
+    return [row[1] for row in con.execute(f'PRAGMA table_info("{name}")')]
+
+
+def delete_games(con: sqlite3.Connection, name: str, game_ids: list):
+    """Delete the rows of some games from a table"""
+    game_ids = list(game_ids)
+    for i in range(0, len(game_ids), 500):  # below the max number of parameters of a statement
+        chunk = game_ids[i:i + 500]
+        con.execute(f'DELETE FROM "{name}" WHERE game_id IN ({",".join("?" * len(chunk))})', chunk)
+
+
+def create_indexes(con: sqlite3.Connection, name: str):
+    """Create the indexes of a table on the columns of DB_INDEXES it has (SQLite keeps them updated)"""
+    for col in DB_INDEXES:
+        if col in table_columns(con, name):
+            con.execute(f'CREATE INDEX IF NOT EXISTS "idx_{name}_{col}" ON "{name}" ("{col}")')
+
+
+def replace_rows(con: sqlite3.Connection, name: str, df: pd.DataFrame, game_ids=None):
+    """Replace the rows of some games in a table of the database
+
+    The whole table is written again if game_ids is None, if the table does not exist yet or if its
+    columns changed.
+
+    Args:
+        con (sqlite3.Connection): connection to the database
+        name (str): name of the table
+        df (pd.DataFrame): the full table
+        game_ids (list(str)): games whose rows are replaced (all if None)
+    """
+    if game_ids is not None and 'game_id' in df.columns and table_columns(con, name) == list(df.columns):
+        delete_games(con, name, game_ids)
+        df = df[df['game_id'].isin(game_ids)]
+    else:
+        con.execute(f'DROP TABLE IF EXISTS "{name}"')
+    sql_df(df).to_sql(name, con, if_exists='append', index=False)
+    create_indexes(con, name)
+
+
+def replace_part_rows(con: sqlite3.Connection, data_dir, name: str, game_ids=None, saved_games=None):
+    """Replace the rows of some games in a table of the database with those saved in parts (see store.save_parts())
+
+    Only the parts with rows of the games are read, one at a time; all of them if the whole table is
+    written (game_ids is None, the table does not exist yet or its columns changed).
+
+    Args:
+        con (sqlite3.Connection): connection to the database
+        data_dir (str | Path): season folder
+        name (str): name of the table
+        game_ids (list(str)): games whose rows are replaced (all if None)
+        saved_games (iterable): games saved in the season (rows of other games in the parts are left out)
+    """
+    file = Path(data_dir, f"{name}_df.pkl")
+    columns = store.parts_columns(file)
+    if game_ids is not None and table_columns(con, name) == columns:
+        delete_games(con, name, game_ids)
+        saved_games = set(game_ids) if saved_games is None else set(game_ids) & set(saved_games)
+    else:
+        con.execute(f'DROP TABLE IF EXISTS "{name}"')
+    for part_df in store.iter_parts(file, columns, saved_games):
+        sql_df(part_df).to_sql(name, con, if_exists='append', index=False)
+    if not table_columns(con, name):    # no rows in the parts (e.g., no anomalies): the table has its columns only
+        import pandas as pd
+        pd.DataFrame(columns=columns).to_sql(name, con, index=False)
+    create_indexes(con, name)
+
+
+def update_pbp(con: sqlite3.Connection, data_dir, game_ids=None):
+    """Replace the PBP of some games (all if None) in the database with the PBP saved (see nbl.pbp_store)
+
+    The PBP is read from the files in chunks of PBP_CHUNK games, so the PBP of a season is never in memory.
+    """
+    saved = pbp_store.saved_pbp_games(data_dir)
+    if game_ids is not None and table_columns(con, 'pbp') == pbp_store.PBP_COLS:
+        delete_games(con, 'pbp', game_ids)
+        game_ids = [game_id for game_id in saved if game_id in set(game_ids)]
+    else:
+        con.execute('DROP TABLE IF EXISTS "pbp"')
+        game_ids = saved
+    for i in range(0, len(game_ids), PBP_CHUNK):
+        pbp_df = pbp_store.load_pbp(data_dir, game_ids=game_ids[i:i + PBP_CHUNK])
+        sql_df(pbp_df).to_sql('pbp', con, if_exists='append', index=False)
+    if not table_columns(con, 'pbp'):   # no PBP saved: the table has its columns only
+        import pandas as pd
+        pd.DataFrame(columns=pbp_store.PBP_COLS).to_sql('pbp', con, index=False)
+    create_indexes(con, 'pbp')
+
+
+def update_db(data_dir, tables: dict, game_ids=None):
+    """Update the database of a season folder with the tables of the season
+
+    The rows of the given games are replaced in the per-game tables (DB_TABLES, stint_players and pbp),
+    together with those of any game in the games table not yet in the database (e.g., a previous run
+    stopped before updating it). Other tables (e.g., season tables) are replaced whole.
+
+    Args:
+        data_dir (str | Path): season folder
+        tables (dict): tables of the season by name (see nbl_scrapper.scrape_season()); those saved in parts
+            are read from their parts instead (see replace_part_rows())
+        game_ids (list(str)): games new or changed since the last update (all if None)
+    """
+    with closing(connect(data_dir)) as con:
+        if game_ids is not None and 'games' in tables and table_columns(con, 'games'):
+            in_db = {row[0] for row in con.execute('SELECT DISTINCT game_id FROM games')}
+            game_ids = set(game_ids) | (set(tables['games']['game_id']) - in_db)
+        game_ids = None if game_ids is None else sorted(str(game_id) for game_id in game_ids)
+
+        with con:   # one transaction: the database is updated fully or not at all
+            for name, df in tables.items():
+                if df is None or name == 'new_games':
+                    continue
+                if name in store.PART_TABLES and store.has_parts(Path(data_dir, f"{name}_df.pkl")):
+                    replace_part_rows(con, data_dir, name, game_ids, set(tables['games']['game_id']))
+                else:
+                    replace_rows(con, name, df, game_ids if name in DB_TABLES else None)
+            if 'stints' in tables and 'players' in tables:
+                replace_rows(con, 'stint_players', stint_players_df(tables['stints'], tables['players']), game_ids)
+            update_pbp(con, data_dir, game_ids)
+    log.info(f"Database {db_file(data_dir)} updated with {'all' if game_ids is None else len(game_ids)} games")
+
+
+def build_db(data_dir):
+    """Build the database of a season folder from scratch, from the tables saved in it"""
+    import pandas as pd
+
+    tables = {file.name[:-len('_df.pkl')]: pd.read_pickle(file) for file in sorted(Path(data_dir).glob('*_df.pkl'))}
+    for file in sorted(Path(data_dir).glob(f'*_df{store.PARTS_SUFFIX}')):  # tables in parts, read part by part
+        if store.has_parts(file):
+            tables[file.name[:-len(f'_df{store.PARTS_SUFFIX}')]] = pd.DataFrame()
+    if 'games' not in tables:
+        raise FileNotFoundError(f"No tables saved in {data_dir}")
+    update_db(data_dir, tables)
+
+
+def query(data_dir, sql: str, params=()) -> pd.DataFrame:
+    """Run a SQL query on the database of a season folder
+
+    Args:
+        data_dir (str | Path): season folder
+        sql (str): the query, with ? for parameters
+        params (tuple): values of the parameters of the query
+
+    Returns:
+        pd.DataFrame: the result of the query
+    """
+    import pandas as pd
+
+    with closing(connect(data_dir, read_only=True)) as con:
+        return pd.read_sql_query(sql, con, params=params)
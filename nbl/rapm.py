@@ -0,0 +1,213 @@
+"""
+Regularized adjusted plus-minus (RAPM) of players, from the lineup matchups of one or many seasons
+
+Each observation is a pairing of an offense lineup with the defense lineup it faced (see nbl.matchups),
+with the offensive rating of the pairing (points per 100 possessions) as target and its possessions as
+weight. The design matrix has one column per player id (see nbl.registry, so players sharing a name are
+not merged across games or seasons): +1 for the players on offense and -1 for those on defense, so a
+player's coefficient is the points per 100 possessions the player adds on offense and saves on defense,
+adjusted for teammates and opponents.
+
+Pairings of the same two lineups are added up first (counts are additive), and the ridge problem
+
+    (X' W X + alpha I) b = X' W (y - mean(y))
+
+is solved with conjugate gradient over the sparse design (scipy.sparse if installed, otherwise plain
+NumPy index arrays), so it never builds a dense stint x player matrix. A previous solution (e.g., before
+new games were added) can warm-start the solver, which then converges in a few iterations. Example:
+
+    python -m nbl.rapm data-22_23 data-23_24 --alpha 2000
+"""
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
+import argparse
+from pathlib import Path
+
+import logging
+log = logging.getLogger("main.rapm")
+
+RAPM_ALPHA = 2000.0     # ridge penalty, in possessions (the prior weight pulling players to 0)
+RAPM_TOL = 1e-6         # relative residual at which the solver stops
+RAPM_MAXITER = 1000     # max conjugate gradient iterations
+
+
+def build_design(matchups_df: pd.DataFrame, players: list = None) -> dict:
+    """Build the sparse design of the RAPM regression from lineup matchups
+
+    Args:
+        matchups_df (pd.DataFrame): matchups with columns lineup_ids, opp_lineup_ids, pts and poss (one or many
+            games, see matchups.build_game_matchups_df(), or accumulated, see matchups.accumulate_matchups())
+        players (list(int)): ids of the players to put first, in this order (e.g., those of a previous fit)
+
+    Returns:
+        dict: players (id of the player of each column), rows, cols and vals (non-zero entries of the design), y
+            (offensive rating of each observation), w (its possessions) and poss_off/poss_def of each player
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = matchups_df.loc[matchups_df['poss'] > 0, ['lineup_ids', 'opp_lineup_ids', 'pts', 'poss']]
+    df = df.groupby(['lineup_ids', 'opp_lineup_ids'], sort=False)[['pts', 'poss']].sum().reset_index()
+
+    # one entry per player on court in each observation: +1 on offense, -1 on defense
+    off_s = df['lineup_ids'].explode()
+    def_s = df['opp_lineup_ids'].explode()
+    ids = pd.concat([off_s, def_s])
+    vals = np.concatenate([np.ones(len(off_s)), -np.ones(len(def_s))])
+    valid = ids.notna().to_numpy()      # empty lineups (broken games) explode to NaN
+    ids, vals = ids[valid].astype('int64'), vals[valid]
+    rows = ids.index.to_numpy()
+
+    players = list(players or [])
+    cols, uniques = pd.factorize(ids)
+    if players:     # keep the order of the given players, new ones go after them
+        uniques = pd.Index(players, dtype='int64').append(pd.Index(uniques).difference(players, sort=False))
+        cols = uniques.get_indexer(ids)
+
+    w = df['poss'].to_numpy(dtype=float)
+    n = len(uniques)
+    return {'players': list(uniques),
+            'rows': rows, 'cols': cols, 'vals': vals,
+            'y': 100 * df['pts'].to_numpy(dtype=float) / w,
+            'w': w,
+            'poss_off': np.bincount(cols[vals > 0], weights=w[rows[vals > 0]], minlength=n),
+            'poss_def': np.bincount(cols[vals < 0], weights=w[rows[vals < 0]], minlength=n)}
+
+
+def design_products(design: dict) -> tuple:
+    """Products X b and X' v of the design (as scipy.sparse CSR if installed, else NumPy index arrays)
+
+    Returns:
+        tuple(function, function): functions b -> X b and v -> X' v
+    """
+    import numpy as np
+
+    rows, cols, vals = design['rows'], design['cols'], design['vals']
+    shape = (len(design['y']), len(design['players']))
+    try:
+        from scipy import sparse
+    except ImportError:
+        return (lambda b: np.bincount(rows, weights=vals * b[cols], minlength=shape[0]),
+                lambda v: np.bincount(cols, weights=vals * v[rows], minlength=shape[1]))
+
+    X = sparse.csr_matrix((vals, (rows, cols)), shape=shape)
+    Xt = X.T.tocsr()
+    return (lambda b: X @ b, lambda v: Xt @ v)
+
+
+def solve_ridge(design: dict, alpha=RAPM_ALPHA, x0=None, tol=RAPM_TOL, maxiter=RAPM_MAXITER) -> tuple:
+    """Solve the weighted ridge regression of a design with conjugate gradient
+
+    Args:
+        design (dict): the design (see build_design())
+        alpha (float): ridge penalty
+        x0 (np.ndarray): starting solution (warm start), default all 0
+        tol (float): relative residual to stop at
+        maxiter (int): max iterations
+
+    Returns:
+        tuple(np.ndarray, float, int): the coefficients, the intercept (mean offensive rating) and the
+            number of iterations done
+    """
+    import numpy as np
+
+    X, Xt = design_products(design)
+    w = design['w']
+    intercept = np.average(design['y'], weights=w) if len(w) else 0.0
+
+    b = Xt(w * (design['y'] - intercept))
+    x = np.zeros(len(design['players'])) if x0 is None else np.asarray(x0, dtype=float).copy()
+    r = b - (Xt(w * X(x)) + alpha * x)
+    p = r.copy()
+    rr = r @ r
+    stop = (tol * np.linalg.norm(b)) ** 2
+    for i in range(maxiter):
+        if rr <= stop:
+            return x, intercept, i
+        Ap = Xt(w * X(p)) + alpha * p
+        step = rr / (p @ Ap)
+        x += step * p
+        r -= step * Ap
+        rr, rr_prev = r @ r, rr
+        p = r + (rr / rr_prev) * p
+    log.warning(f"RAPM solver did not converge in {maxiter} iterations (residual {np.sqrt(rr):.3g})")
+    return x, intercept, maxiter
+
+
+def fit_rapm(matchups_df: pd.DataFrame, alpha=RAPM_ALPHA, init_df: pd.DataFrame = None,
+             tol=RAPM_TOL, maxiter=RAPM_MAXITER, names=None) -> pd.DataFrame:
+    """Fit the RAPM of the players in a set of lineup matchups
+
+    Args:
+        matchups_df (pd.DataFrame): matchups of the games to fit (see build_design())
+        alpha (float): ridge penalty
+        init_df (pd.DataFrame): a previous fit to warm-start from (e.g., before new games were added);
+            players not in it start at 0 (a fit with no player ids is not used)
+        tol (float): relative residual to stop at
+        maxiter (int): max solver iterations
+        names (function): name to show of a player id (e.g., registry.PlayerRegistry.name()), if any
+
+    Returns:
+        pd.DataFrame: one row per player with id, name (if names given), RAPM (points per 100 possessions)
+            and possessions on offense and defense, sorted by RAPM
+    """
+    import pandas as pd
+
+    if init_df is not None and 'player_id' not in init_df.columns:     # fitted before players had ids
+        init_df = None
+    players = None if init_df is None else init_df['player_id'].tolist()
+    design = build_design(matchups_df, players)
+    x0 = None
+    if init_df is not None:
+        x0 = init_df.set_index('player_id')['rapm'].reindex(design['players']).fillna(0).to_numpy()
+    coefs, intercept, iters = solve_ridge(design, alpha, x0, tol, maxiter)
+    log.info(f"RAPM of {len(design['players'])} players from {len(design['y'])} lineup pairings: "
+             f"{iters} iterations (mean ortg {intercept:.1f})")
+
+    rapm_df = pd.DataFrame({'player_id': design['players'],
+                            'player': [names(id) for id in design['players']] if names else None,
+                            'rapm': coefs,
+                            'poss_off': design['poss_off'],
+                            'poss_def': design['poss_def']})
+    rapm_df = rapm_df[(rapm_df['poss_off'] + rapm_df['poss_def']) > 0]
+    if not names:
+        rapm_df = rapm_df.drop(columns='player')
+    return rapm_df.sort_values('rapm', ascending=False, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the RAPM of players from the matchups saved in season folders.")
+    parser.add_argument('data_dirs', nargs='+', type=str,
+                        help='Season folders with saved matchups and players tables (matchups_df.pkl, players_df.pkl).')
+    parser.add_argument('--alpha', type=float, default=RAPM_ALPHA,
+                        help='Ridge penalty, in possessions (default: %(default)s).')
+    parser.add_argument('--min-poss', type=float, default=0,
+                        help='Only show players with at least these possessions (default: %(default)s).')
+    parser.add_argument('--out', type=str,
+                        help='CSV file to save the RAPM table (default: printed).')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    import time
+    import pandas as pd
+
+    from nbl import registry
+
+    # matchups of all seasons (with the ids of the players, also if saved before ids existed)
+    players = registry.PlayerRegistry()
+    matchups_dfs = []
+    for data_dir in args.data_dirs:
+        tables = registry.intern_tables({'players': pd.read_pickle(Path(data_dir, "players_df.pkl")),
+                                         'matchups': pd.read_pickle(Path(data_dir, "matchups_df.pkl"))})
+        players.add_players(tables['players'])
+        matchups_dfs.append(tables['matchups'])
+    matchups_df = pd.concat(matchups_dfs)
+    start = time.perf_counter()
+    rapm_df = fit_rapm(matchups_df, args.alpha, names=players.name)
+    print(f"Fitted in {time.perf_counter() - start:.2f} seconds")
+    rapm_df = rapm_df[(rapm_df['poss_off'] + rapm_df['poss_def']) >= args.min_poss]
+    if args.out:
+        rapm_df.to_csv(args.out, index=False)
+        print(f"RAPM of {rapm_df.shape[0]} players saved in {args.out}")
+    else:
+        print(rapm_df.to_string())
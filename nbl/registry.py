@@ -0,0 +1,194 @@
+"""
+Registry of players: a stable integer id for each player, across games and seasons, with the names seen
+
+Players are named "{internationalFirstName} {internationalFamilyName}" (see tools.build_player_names()) in
+the PBP, lineups and players tables, so two players with the same name are merged and a player whose name
+is spelled differently in some games is split. The id of a player is the person id of the feed
+(personId), the same in all games and seasons; a player the feed has no person id for gets a negative id
+from the name (the same in all runs, see name_id()).
+
+Tables are interned with the ids next to the names (player_id in the players table, lineup_ids in the
+stints and stint stats tables, lineup_ids and opp_lineup_ids in the matchups table, player_id in the PBP
+stored, see nbl.pbp_store), so joins and set operations (e.g., nbl.stint_index, the minutes reconciliation,
+lineups, on/off and RAPM) go on integers and names are kept to show. The registry of a data
+folder (REGISTRY_FILE) keeps the names of each id, with the first and last game each name was seen in,
+and is updated by the scrapper with the players of new games.
+"""
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
+import json
+import zlib
+from pathlib import Path
+
+from nbl import store
+
+import logging
+log = logging.getLogger("main.registry")
+
+REGISTRY_FILE = "players_registry.json"     # names of each player id, in the data folder
+
+
+def name_id(name: str) -> int:
+    """Id of a player with no person id in the feed: negative, from the name (the same in all runs)"""
+    return -(zlib.crc32(str(name).encode()) + 1)
+
+
+def player_id(person_id, name: str) -> int:
+    """Id of a player: the person id of the feed, or the id from the name if the feed has none"""
+    try:
+        person_id = int(person_id)
+    except (TypeError, ValueError):     # None or NaN
+        person_id = 0
+    return person_id if person_id > 0 else name_id(name)
+
+
+def game_player_ids(game_json: dict) -> dict:
+    """Id of each player of a game, by team number and player number in the feed (tno, pno)
+
+    Args:
+        game_json (dict): json dict data of the game
+
+    Returns:
+        dict: id of each (tno, pno)
+    """
+    return {(int(tno), int(pno)): player_id(player.get('personId'),
+                                            f"{player.get('internationalFirstName')} {player.get('internationalFamilyName')}")
+            for tno in ['1', '2'] for (pno, player) in game_json['tm'][tno].get('pl', {}).items()}
+
+
+def player_ids(players_df: pd.DataFrame) -> pd.Series:
+    """Id of each player of a players table (columns player and, if the feed has it, personId)"""
+    import pandas as pd
+
+    person_ids = players_df['personId'] if 'personId' in players_df.columns else [None] * players_df.shape[0]
+    return pd.Series([player_id(person_id, name) for (person_id, name) in zip(person_ids, players_df['player'])],
+                     index=players_df.index, dtype='int64')
+
+
+def lineup_players_df(lineups_df: pd.DataFrame, players_df: pd.DataFrame) -> pd.DataFrame:
+    """Players of each lineup with their ids, one row per player of each lineup
+
+    Args:
+        lineups_df (pd.DataFrame): table with lineups (columns game_id, tno and lineup), e.g., stints
+        players_df (pd.DataFrame): players of the games (columns game_id, tno, player and player_id or personId)
+
+    Returns:
+        pd.DataFrame: columns row (position of the lineup in lineups_df), game_id, tno, player and player_id
+            (from the name for players not in players_df)
+    """
+    ids_df = players_df[['game_id', 'tno', 'player']].assign(
+        player_id=players_df['player_id'] if 'player_id' in players_df.columns else player_ids(players_df))
+    ids_df = ids_df.astype({'tno': int}).drop_duplicates(['game_id', 'tno', 'player'])
+
+    exploded_df = lineups_df[['game_id', 'tno', 'lineup']].reset_index(drop=True).rename_axis('row').explode('lineup')
+    exploded_df = exploded_df.dropna(subset=['lineup']).rename(columns={'lineup': 'player'}).astype({'tno': int})
+    merged_df = exploded_df.reset_index().merge(ids_df, on=['game_id', 'tno', 'player'], how='left')
+    missing = merged_df['player_id'].isna()
+    merged_df['player_id'] = merged_df['player_id'].fillna(merged_df.loc[missing, 'player'].map(name_id))
+    return merged_df.astype({'player_id': 'int64'})
+
+
+def lineup_ids(lineups_df: pd.DataFrame, players_df: pd.DataFrame) -> pd.Series:
+    """Ids of the players of each lineup, as sorted tuples (see lineup_players_df())"""
+    import pandas as pd
+
+    ids_df = lineup_players_df(lineups_df, players_df).sort_values(['row', 'player_id'])
+    ids = ids_df.groupby('row')['player_id'].agg(lambda x: tuple(x.tolist()))
+    return pd.Series([ids.get(row, ()) for row in range(lineups_df.shape[0])], index=lineups_df.index, dtype=object)
+
+
+def intern_tables(tables: dict) -> dict:
+    """Add the ids of the players to the tables that do not have them (e.g., saved before ids existed)
+
+    Adds player_id (after player) to the players table, lineup_ids (after lineup) to the stints and
+    stint stats tables, and lineup_ids and opp_lineup_ids (after opp_lineup) to the matchups table, in place.
+
+    Args:
+        tables (dict): tables by name (players, stints, stint_stats, matchups)
+
+    Returns:
+        dict: the same tables
+    """
+    players_df = tables.get('players')
+    if players_df is None:
+        return tables
+    if 'player_id' not in players_df.columns:
+        players_df.insert(players_df.columns.get_loc('player') + 1, 'player_id', player_ids(players_df))
+    for name in ['stints', 'stint_stats']:
+        df = tables.get(name)
+        if df is not None and 'lineup_ids' not in df.columns:
+            df.insert(df.columns.get_loc('lineup') + 1, 'lineup_ids', lineup_ids(df, players_df))
+    matchups_df = tables.get('matchups')
+    if matchups_df is not None and 'lineup' in matchups_df.columns and 'lineup_ids' not in matchups_df.columns:
+        opp_df = matchups_df[['game_id']].assign(tno=3 - matchups_df['tno'].astype(int), lineup=matchups_df['opp_lineup'])
+        matchups_df.insert(matchups_df.columns.get_loc('lineup') + 1, 'lineup_ids', lineup_ids(matchups_df, players_df))
+        matchups_df.insert(matchups_df.columns.get_loc('opp_lineup') + 1, 'opp_lineup_ids', lineup_ids(opp_df, players_df))
+    return tables
+
+
+class PlayerRegistry:
+    """Names of each player id seen in the games of a data folder, with the first and last game of each name
+
+    With no data folder, the registry is only in memory (e.g., of the players of some seasons in memory).
+    """
+
+    def __init__(self, data_dir=None):
+        self.file = Path(data_dir, REGISTRY_FILE) if data_dir is not None else None
+        self.players = {}   # id (as str, JSON keys) -> {name: [first game, last game]}
+        if self.file is not None and self.file.exists():
+            with open(self.file) as f:
+                self.players = json.load(f)
+
+    def add_players(self, players_df: pd.DataFrame):
+        """Add the players of some games to the registry
+
+        Args:
+            players_df (pd.DataFrame): players of the games (columns game_id, player and player_id)
+        """
+        games_df = players_df.astype({'game_id': 'int64'}).groupby(['player_id', 'player'])['game_id'].agg(['min', 'max'])
+        for (id, name), (first, last) in games_df.iterrows():
+            names = self.players.setdefault(str(id), {})
+            first, last = str(first), str(last)
+            if name in names:
+                first, last = min(names[name][0], first, key=int), max(names[name][1], last, key=int)
+            names[name] = [first, last]
+
+    def name(self, id) -> str:
+        """Last name seen of a player id (None if not in the registry)"""
+        names = self.players.get(str(id))
+        return max(names, key=lambda name: int(names[name][1])) if names else None
+
+    def ids(self, name: str) -> list:
+        """Ids of the players seen with a name (more than one if players share the name)"""
+        return sorted(int(id) for (id, names) in self.players.items() if name in names)
+
+    def registry_df(self) -> pd.DataFrame:
+        """Table of the registry: one row per player id with the last name seen, all names and first and last game"""
+        import pandas as pd
+
+        rows = [{'player_id': int(id),
+                 'player': self.name(id),
+                 'names': sorted(names, key=lambda name: int(names[name][0])),
+                 'first_game': min((games[0] for games in names.values()), key=int),
+                 'last_game': max((games[1] for games in names.values()), key=int)}
+                for (id, names) in self.players.items()]
+        return pd.DataFrame(rows, columns=['player_id', 'player', 'names', 'first_game', 'last_game'])
+
+    def save(self):
+        """Save the registry (atomically) in its data folder"""
+        with store.atomic_path(self.file) as tmp, open(tmp, 'w') as f:
+            json.dump(self.players, f, indent=1, sort_keys=True)
+
+
+def update_registry(data_dir, players_df: pd.DataFrame, game_ids: list):
+    """Add the players of some games (new or changed) to the registry of a data folder
+
+    Args:
+        data_dir (str | Path): data folder
+        players_df (pd.DataFrame): players of the season (with player_id, see intern_tables())
+        game_ids (list(str)): games new or changed since the last update
+    """
+    registry = PlayerRegistry(data_dir)
+    registry.add_players(players_df[players_df['game_id'].astype(str).isin({str(game_id) for game_id in game_ids})])
+    registry.save()
+    log.info(f"Registry {registry.file} updated with the players of {len(game_ids)} games ({len(registry.players)} players)")
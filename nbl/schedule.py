@@ -0,0 +1,214 @@
+"""
+Schedule of a season, discovered from the competition JSON of the data feed
+
+Instead of a hand-built GAMES module (extracted with the browser in extract_games.ipynb), the games of
+a season can be taken from the competition data of the feed:
+
+    https://livestats.dcd.shared.geniussports.com/data/competition/<competition_id>.json
+
+Each game of the schedule is a record with its id, round, status (final, live, scheduled, ...) and
+scheduled date. The schedule is cached in the season folder (SCHEDULE_FILE) and only fetched again when
+a game not yet final was scheduled to start before now, so a run in between games does no request at all.
+The scrapper then fetches only games that are final and not yet stored. Example:
+
+    python -m nbl.schedule 34173 --data-dir data-23_24 --module games_23_24.py
+"""
+import json
+import datetime
+import argparse
+from pathlib import Path
+
+from nbl.config import *
+from nbl import tools, store
+
+import logging
+log = logging.getLogger("main.schedule")
+
+SCHEDULE_FILE = "schedule.json"     # cached schedule, in the season data folder
+
+# fields of a match in the competition data (first one found is used) and keys holding the matches
+MATCHES_KEYS = ['matches', 'games', 'schedule']
+MATCH_FIELDS = {'game_id': ['matchId', 'id', 'gameId'],
+                'round': ['roundNumber', 'round', 'roundId'],
+                'status': ['matchStatus', 'status'],
+                'date': ['matchTime', 'matchTimeUTC', 'startTime', 'date']}
+
+# statuses of the feed for games over (as lowercase), all other statuses are taken as not played yet
+FINAL_STATUSES = {'complete', 'completed', 'final', 'finished', 'ended', 'result'}
+LIVE_STATUSES = {'in_progress', 'inprogress', 'live', 'running'}
+
+
+def competition_url(competition_id) -> str:
+    return f"{URL_LIVESTATS}/competition/{competition_id}.json"
+
+
+def parse_round(round_no):
+    """Round number as an int when it is a number (the feed gives them as strings, e.g., "1")"""
+    if isinstance(round_no, str) and round_no.strip().isdigit():
+        return int(round_no)
+    return round_no
+
+
+def parse_status(status) -> str:
+    """Normalize the status of a match to final, live or scheduled (or the status of the feed, lowercase)"""
+    status = str(status or '').strip().lower()
+    if status in FINAL_STATUSES:
+        return 'final'
+    if status in LIVE_STATUSES:
+        return 'live'
+    return status or 'scheduled'
+
+
+def parse_schedule(competition_json) -> list:
+    """Extract the schedule of the games from the competition data
+
+    Args:
+        competition_json (dict | list): competition data, with the list of matches
+
+    Returns:
+        list(dict): games with their id, round, status and scheduled date (ISO format), in order of date
+    """
+    matches = competition_json
+    if isinstance(competition_json, dict):
+        matches = next((competition_json[key] for key in MATCHES_KEYS if key in competition_json), [])
+        if isinstance(matches, dict):   # matches keyed by id
+            matches = list(matches.values())
+
+    schedule = []
+    for match in matches:
+        game = {field: next((match[key] for key in keys if match.get(key) is not None), None)
+                for (field, keys) in MATCH_FIELDS.items()}
+        if game['game_id'] is None:
+            log.warning(f"Match with no id in competition data, ignored: {match}")
+            continue
+        game['game_id'] = str(game['game_id'])
+        game['round'] = parse_round(game['round'])
+        game['status'] = parse_status(game['status'])
+        schedule.append(game)
+
+    return sorted(schedule, key=lambda game: game['date'] or '')
+
+
+def fetch_schedule(competition_id) -> list:
+    """Fetch the schedule of a competition from the server
+
+    Args:
+        competition_id (str): id of the competition (season), e.g., 34173
+
+    Returns:
+        list(dict): the games of the competition (see parse_schedule())
+    """
+    return parse_schedule(tools.http_get(competition_url(competition_id)).json())
+
+
+def load_schedule(data_dir) -> dict:
+    """Load the schedule cached in a season folder
+
+    Args:
+        data_dir (str | Path): season data folder
+
+    Returns:
+        dict: competition id, time fetched and games of the schedule, or None if not cached
+    """
+    file = Path(data_dir, SCHEDULE_FILE)
+    if not file.exists():
+        return None
+    with open(file) as f:
+        return json.load(f)
+
+
+def save_schedule(data_dir, schedule: dict):
+    with store.atomic_path(Path(data_dir, SCHEDULE_FILE)) as tmp, open(tmp, 'w') as f:
+        json.dump(schedule, f, indent=1)
+
+
+def is_stale(schedule: dict, now=None) -> bool:
+    """Whether a cached schedule may be out of date: some game not final was due to start before now
+
+    Args:
+        schedule (dict): cached schedule (see load_schedule())
+        now (datetime.datetime): current time (default: now)
+
+    Returns:
+        bool: True if the schedule should be fetched again
+    """
+    now = (now or datetime.datetime.now()).isoformat(sep=' ')
+    return any(game['status'] != 'final' and (game['date'] is None or game['date'].replace('T', ' ') <= now)
+               for game in schedule['games'])
+
+
+def get_schedule(competition_id, data_dir, refresh=False) -> list:
+    """Get the schedule of a season, from the cache in its folder unless it may be out of date
+
+    Args:
+        competition_id (str): id of the competition (season)
+        data_dir (str | Path): season data folder, where the schedule is cached
+        refresh (bool): fetch the schedule even if the cache is up to date
+
+    Returns:
+        list(dict): the games of the season (see parse_schedule())
+    """
+    schedule = load_schedule(data_dir)
+    if schedule is not None and str(schedule['competition_id']) != str(competition_id):
+        log.warning(f"Schedule cached in {data_dir} is for competition {schedule['competition_id']}, fetching it again")
+        schedule = None
+    if schedule is None or refresh or is_stale(schedule):
+        schedule = {'competition_id': str(competition_id),
+                    'fetched': datetime.datetime.now().isoformat(sep=' ', timespec='seconds'),
+                    'games': fetch_schedule(competition_id)}
+        save_schedule(data_dir, schedule)
+        log.info(f"Fetched schedule of competition {competition_id}: {len(schedule['games'])} games")
+    return schedule['games']
+
+
+def final_games(schedule: list, existing_games=()) -> list:
+    """Games of the schedule that are final and not yet stored, in the format of GAMES modules
+
+    Args:
+        schedule (list(dict)): the games of the season (see parse_schedule())
+        existing_games (iterable): ids of the games already stored
+
+    Returns:
+        list(tuple(str, int)): id and round of each game to scrape
+    """
+    existing_games = set(existing_games)
+    return [(game['game_id'], game['round']) for game in schedule
+            if game['status'] == 'final' and game['game_id'] not in existing_games]
+
+
+def save_games_module(file, competition_id, schedule: list):
+    """Save the games of a schedule as a GAMES module (as the hand-built games_xx_yy.py ones)
+
+    Args:
+        file (str | Path): module file
+        competition_id (str): id of the competition of the schedule
+        schedule (list(dict)): the games of the season (see parse_schedule())
+    """
+    with store.atomic_path(file) as tmp, open(tmp, 'w') as f:
+        f.write(f"# Games of competition {competition_id} (generated by nbl.schedule)\n")
+        f.write(f"#   Source: {competition_url(competition_id)}\n")
+        f.write("GAMES = []\n")
+        f.write(f"GAMES.extend({[(game['game_id'], game['round']) for game in schedule]})\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discover the schedule of a season from its competition data.")
+    parser.add_argument('competition_id', type=str,
+                        help='Id of the competition (season) in the feed, e.g., 34173.')
+    parser.add_argument('--data-dir', type=str, default='.',
+                        help='Season folder where the schedule is cached (default: %(default)s).')
+    parser.add_argument('--refresh', action='store_true', default=False,
+                        help='Fetch the schedule even if the cached one is up to date (default: %(default)s).')
+    parser.add_argument('--module', type=str,
+                        help='Save the games as a GAMES module file (default: not saved).')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    schedule = get_schedule(args.competition_id, args.data_dir, args.refresh)
+    statuses = {}
+    for game in schedule:
+        statuses[game['status']] = statuses.get(game['status'], 0) + 1
+    print(f"Competition {args.competition_id}: {len(schedule)} games {statuses}")
+    if args.module:
+        save_games_module(args.module, args.competition_id, schedule)
+        print(f"Games saved in module {args.module}")
@@ -0,0 +1,152 @@
+"""
+Scheduler of pending games: decides which games not yet stored are worth probing in a run
+
+Without it, every run of the scrapper downloads the full data of each game not yet stored, only to find
+most of them are not played or not finished yet. The scheduler keeps the state of each pending game in
+the season folder (STATE_FILE): its scheduled time (if known, see nbl.schedule), the last probe and its
+result. A game is due for a probe:
+
+  - if its scheduled time is known, only once it is expected to be over (scheduled time + GAME_LENGTH);
+  - after a probe that did not find it final, only after a back-off wait that doubles with each probe
+    (from PROBE_BACKOFF up to MAX_BACKOFF).
+
+Probes are conditional requests (see tools.probe_json_data()), so a game whose data did not change
+since the last probe costs no download at all.
+"""
+import json
+import datetime
+from pathlib import Path
+from urllib.error import HTTPError
+
+from nbl import tools, store
+from nbl.schedule import parse_round
+
+import logging
+log = logging.getLogger("main.scheduler")
+
+STATE_FILE = "games_state.json"     # state of the pending games, in the season data folder
+
+GAME_LENGTH = datetime.timedelta(hours=2, minutes=15)   # from tip-off to the data of the game being final
+PROBE_BACKOFF = datetime.timedelta(minutes=15)          # wait after the first probe not finding a game final
+MAX_BACKOFF = datetime.timedelta(days=1)                # longest wait between probes of a game
+
+
+def round_key(round_no) -> tuple:
+    """Sort key of a round: numbered rounds first (in order), then any other (e.g., nan or named rounds)"""
+    round_no = parse_round(round_no)
+    if isinstance(round_no, int):
+        return (0, round_no, '')
+    return (1, 0, str(round_no))
+
+
+def parse_time(time):
+    """Scheduled time of a game as a datetime (None if not known or not valid)"""
+    if isinstance(time, datetime.datetime) or time is None:
+        return time
+    try:
+        return datetime.datetime.fromisoformat(str(time)).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+class GameScheduler:
+    """State of the pending games of a season, persisted in its data folder"""
+
+    def __init__(self, data_dir, now=None):
+        self.file = Path(data_dir, STATE_FILE)
+        self.data_dir = data_dir
+        self.now = now or datetime.datetime.now()
+        self.games = {}
+        if self.file.exists():
+            with open(self.file) as f:
+                self.games = json.load(f)
+
+    def add_schedule(self, schedule: list):
+        """Set the scheduled time of the games of a schedule (see nbl.schedule)
+
+        Args:
+            schedule (list(dict)): games with their id and scheduled date
+        """
+        for game in schedule:
+            if game.get('date'):
+                self.games.setdefault(str(game['game_id']), {})['scheduled'] = str(game['date'])
+
+    def next_probe(self, game_id):
+        """Time from which a game is due for a probe
+
+        Args:
+            game_id (str): id of the game
+
+        Returns:
+            datetime.datetime: time of the next probe (None if due now, e.g., never probed and not scheduled)
+        """
+        state = self.games.get(str(game_id), {})
+        times = []
+        scheduled = parse_time(state.get('scheduled'))
+        if scheduled is not None:
+            times.append(scheduled + GAME_LENGTH)
+        if state.get('last_probe') and state.get('result') != 'final':
+            backoff = min(PROBE_BACKOFF * 2 ** max(state.get('probes', 1) - 1, 0), MAX_BACKOFF)
+            times.append(parse_time(state['last_probe']) + backoff)
+        return max(times, default=None)
+
+    def due(self, game_id) -> bool:
+        next_probe = self.next_probe(game_id)
+        return next_probe is None or next_probe <= self.now
+
+    def record(self, game_id, result: str, validators=None):
+        """Record the result of a probe of a game
+
+        Args:
+            game_id (str): id of the game
+            result (str): final, not_ended, unchanged (no new data) or unavailable
+            validators (dict): validators of the fetch, for the next conditional request
+        """
+        state = self.games.setdefault(str(game_id), {})
+        state['last_probe'] = self.now.isoformat(sep=' ', timespec='seconds')
+        state['result'] = result
+        state['probes'] = state.get('probes', 0) + 1
+        if validators is not None:
+            state['validators'] = validators
+
+    def probe(self, game_id) -> dict:
+        """Probe a game due and get its data if it is final (saved as data-<game_id>.json in the data folder)
+
+        Args:
+            game_id (str): id of the game
+
+        Raises:
+            HTTPError: if the game data is not available
+            ValueError: if the game has not finished yet (or its data did not change since the last probe)
+
+        Returns:
+            json-object: the data of the game
+        """
+        state = self.games.get(str(game_id), {})
+        try:
+            game_json, validators = tools.probe_json_data(game_id, state.get('validators'))
+        except HTTPError:
+            self.record(game_id, 'unavailable')
+            raise
+        if game_json is None:
+            self.record(game_id, 'unchanged')
+            raise ValueError('Game data has not changed since the last probe')
+        if not tools.game_ended(game_json):
+            self.record(game_id, 'not_ended', validators)
+            raise ValueError('Game has not finished yet')
+
+        self.record(game_id, 'final', validators)
+        with store.atomic_path(Path(self.data_dir, f"data-{game_id}.json")) as tmp, open(tmp, 'w') as f:
+            json.dump(game_json, f)
+        return game_json
+
+    def save(self, stored_games=()):
+        """Save the state of the pending games (games already stored are dropped)
+
+        Args:
+            stored_games (iterable): ids of the games stored in the tables
+        """
+        for game_id in set(map(str, stored_games)).intersection(self.games):
+            del self.games[game_id]
+        with store.atomic_path(self.file) as tmp, open(tmp, 'w') as f:
+            json.dump(self.games, f, indent=1)
@@ -0,0 +1,206 @@
+"""
+Inverted index of the stints of each player: for each player id (see nbl.registry), the sorted postings
+(game, team, stint) of the stints the player was on court in
+
+Finding the stints of a player by scanning the lineups (e.g., stints_df.apply(lambda x: player in
+x['lineup'], axis=1)) is a row-wise Python loop per player and query. With the index, the stints of a
+player are a slice of an array, and those with some players and without others (with/without splits of
+on/off analyses) are sorted array intersections and differences.
+
+Each posting is one int64 key: game_id * GAME_BASE + tno * TNO_BASE + stint, so postings sort by game,
+team and stint. The index is held as flat arrays (CSR layout: postings of all players one after the other,
+sorted by player and key, with the offset of each player) and saved in the season folder (INDEX_FILE).
+The scrapper updates it with the stints of each new or refreshed game, whose postings are replaced. E.g.:
+
+    python -m nbl.stint_index data-22_23 --with "Chris Goulding" "Jo Lual-Acuil" --without "Xavier Rathan-Mayes"
+
+(players given by name are looked up in the registry of players of the season folder, or give their ids).
+"""
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
+import argparse
+from pathlib import Path
+
+from nbl import store, registry
+
+import logging
+log = logging.getLogger("main.stint_index")
+
+INDEX_FILE = "stint_index.npz"  # index of the stints of each player, in the season data folder
+
+GAME_BASE = 10_000  # keys: game_id * GAME_BASE + tno * TNO_BASE + stint
+TNO_BASE = 1_000
+
+
+def encode(game_ids, tnos, stints):
+    """Keys of postings (game, team number, stint id)"""
+    import numpy as np
+
+    return (np.asarray(game_ids, dtype='int64') * GAME_BASE + np.asarray(tnos, dtype='int64') * TNO_BASE
+            + np.asarray(stints, dtype='int64'))
+
+
+def decode(keys) -> pd.DataFrame:
+    """Table of postings (game_id, tno, stint) from their keys"""
+    import numpy as np
+    import pandas as pd
+
+    keys = np.asarray(keys, dtype='int64')
+    return pd.DataFrame({'game_id': (keys // GAME_BASE).astype(str),
+                         'tno': (keys % GAME_BASE) // TNO_BASE,
+                         'stint': keys % TNO_BASE})
+
+
+class StintIndex:
+    """Inverted index player id -> sorted keys of the stints the player was on court in"""
+
+    def __init__(self, data_dir=None):
+        import numpy as np
+
+        self.file = None if data_dir is None else Path(data_dir, INDEX_FILE)
+        self.players = np.array([], dtype='int64')  # player ids, sorted
+        self.offsets = np.zeros(1, dtype='int64')   # postings of player i: keys[offsets[i]:offsets[i+1]]
+        self.keys = np.array([], dtype='int64')
+        if self.file is not None and self.file.exists():
+            with np.load(self.file, allow_pickle=False) as data:
+                self.players, self.offsets, self.keys = data['players'], data['offsets'], data['keys']
+
+    @classmethod
+    def from_stints(cls, stints_df: pd.DataFrame, col='lineup_ids') -> StintIndex:
+        """Index (not persisted) of the stints of a table (e.g., of a game, or of a season), see add_stints()"""
+        index = cls()
+        index.add_stints(stints_df, col=col)
+        return index
+
+    def add_stints(self, stints_df: pd.DataFrame, game_ids: list = None, col='lineup_ids'):
+        """Add the stints of some games, replacing any postings of those games already in the index
+
+        Args:
+            stints_df (pd.DataFrame): stints of the games (game_id, tno, id and the lineup column)
+            game_ids (list(str)): games replaced (default: those in stints_df; a game given with no stints
+                is removed from the index)
+            col (str): column with the players of each stint (default: their ids; 'lineup' for their names)
+        """
+        import numpy as np
+        import pandas as pd
+
+        players_df = stints_df[['game_id', 'tno', 'id', col]].explode(col).dropna(subset=[col])
+        new_keys = encode(players_df['game_id'], players_df['tno'], players_df['id'])
+        game_ids = pd.unique(pd.Series(stints_df['game_id'] if game_ids is None else list(game_ids)).astype('int64'))
+
+        # postings of all players as (player, key) pairs: old ones of other games and the new ones
+        old_players = np.repeat(self.players, np.diff(self.offsets))
+        keep = ~np.isin(self.keys // GAME_BASE, game_ids)
+        new_players = players_df[col].to_numpy(dtype=str if col == 'lineup' else 'int64')
+        players = np.concatenate([old_players[keep], new_players]) if keep.any() else new_players
+        keys = np.concatenate([self.keys[keep], new_keys])
+
+        self.players, codes = np.unique(players, return_inverse=True)
+        order = np.lexsort((keys, codes))
+        codes, keys = codes[order], keys[order]
+        unique = np.ones(len(keys), dtype=bool)     # a player twice in a stint (broken lineup) counts once
+        unique[1:] = (codes[1:] != codes[:-1]) | (keys[1:] != keys[:-1])
+        codes, self.keys = codes[unique], keys[unique]
+        self.offsets = np.searchsorted(codes, np.arange(len(self.players) + 1)).astype('int64')
+
+    def save(self):
+        """Save the index (atomically) in the season folder"""
+        import numpy as np
+
+        with store.atomic_path(self.file) as tmp:
+            with open(tmp, 'wb') as f:
+                np.savez(f, players=self.players, offsets=self.offsets, keys=self.keys)
+
+    def games(self) -> set:
+        """Ids of the games in the index"""
+        import numpy as np
+
+        return {str(game_id) for game_id in np.unique(self.keys // GAME_BASE)}
+
+    def postings(self, player) -> np.ndarray:
+        """Sorted keys of the stints of a player (empty if not in the index)"""
+        import numpy as np
+
+        i = np.searchsorted(self.players, player)
+        if i == len(self.players) or self.players[i] != player:
+            return self.keys[:0]
+        return self.keys[self.offsets[i]:self.offsets[i + 1]]
+
+    def stints(self, with_players: list, without_players: list = ()) -> np.ndarray:
+        """Keys of the stints with all of some players on court and none of others
+
+        Args:
+            with_players (list): players on court (at least one)
+            without_players (list): players not on court
+
+        Returns:
+            np.ndarray: sorted keys of the stints (see decode())
+        """
+        import numpy as np
+        from functools import reduce
+
+        postings = sorted((self.postings(player) for player in with_players), key=len)  # shortest first
+        keys = reduce(lambda x, y: np.intersect1d(x, y, assume_unique=True), postings)
+        for player in without_players:
+            keys = np.setdiff1d(keys, self.postings(player), assume_unique=True)
+        return keys
+
+    def stints_df(self, with_players: list, without_players: list = ()) -> pd.DataFrame:
+        """Table of the stints (game_id, tno, stint) with all of some players and none of others (see stints())"""
+        return decode(self.stints(with_players, without_players))
+
+
+def update_index(data_dir, stints_df: pd.DataFrame, game_ids: list):
+    """Update the stint index of a season folder with the stints of some games (new or changed)
+
+    Games of the stints table not yet in the index (e.g., a previous run stopped before updating it) are
+    added too.
+
+    Args:
+        data_dir (str | Path): season folder
+        stints_df (pd.DataFrame): stints of the season
+        game_ids (list(str)): games new or changed since the last update
+    """
+    index = StintIndex(data_dir)
+    game_ids = {str(game_id) for game_id in game_ids} | (set(stints_df['game_id'].astype(str)) - index.games())
+    index.add_stints(stints_df[stints_df['game_id'].astype(str).isin(game_ids)], game_ids)
+    index.save()
+    log.info(f"Stint index {index.file} updated with {len(game_ids)} games ({len(index.players)} players)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the stints with and without some players in a season folder.")
+    parser.add_argument('data_dir', type=str,
+                        help='Season folder with the stint index saved (see --save of the scrapper).')
+    parser.add_argument('--with', dest='with_players', nargs='+', type=str, required=True,
+                        help='Players on court (names or ids).')
+    parser.add_argument('--without', dest='without_players', nargs='+', type=str, default=[],
+                        help='Players not on court (names or ids).')
+    args = parser.parse_args()
+
+    import time
+    import pandas as pd
+
+    players = registry.PlayerRegistry(args.data_dir)
+
+    def player_id(player: str) -> int:
+        if player.lstrip('-').isdigit():
+            return int(player)
+        ids = players.ids(player)
+        if len(ids) != 1:
+            parser.error(f"Player {player} {'not found' if not ids else f'is many players, give one of their ids: {ids}'}")
+        return ids[0]
+
+    args.with_players = [player_id(player) for player in args.with_players]
+    args.without_players = [player_id(player) for player in args.without_players]
+
+    index = StintIndex(args.data_dir)
+    start = time.perf_counter()
+    keys_df = index.stints_df(args.with_players, args.without_players)
+    elapsed = time.perf_counter() - start
+
+    stints_df = pd.read_pickle(Path(args.data_dir, "stints_df.pkl"))
+    stints_df = keys_df.merge(stints_df.rename(columns={'id': 'stint'}), on=['game_id', 'tno', 'stint'])
+    print(f"{stints_df.shape[0]} stints ({stints_df['mins'].sum():.1f} minutes) found in {elapsed * 1000:.2f} ms "
+          f"(index of {len(index.players)} players, {len(index.keys)} postings)")
+    print(stints_df[['game_id', 'tno', 'stint', 'team', 'lineup', 'mins']].to_string())
@@ -0,0 +1,497 @@
+"""
+Storage of tables on disk, safe against crashes
+
+Tables are written to a temporary file in the same folder first and then renamed into place,
+so a run killed half-way (or a dropped Drive mount) never leaves a partially written table behind.
+
+Each game computed in a run is also checkpointed on its own file (under CHECKPOINT_DIR) as soon
+as it is computed, so an interrupted run can resume from the last game committed instead of starting over.
+Checkpoints are removed once the run finishes.
+
+Per-game tables that no season table is built from (PART_TABLES: stint stats, anomalies and splits, the
+largest ones) are saved in parts: a sub-folder next to the table file (PARTS_SUFFIX) with one Pickle file
+per save holding the rows of the games saved then, and an index of the games in each part (PARTS_INDEX).
+A run adds a part with the rows of its new (or refreshed) games, so the rows saved before are never loaded
+nor written again: memory and writes scale with the new games, not with the season. The newest part of a
+game has its rows (older ones are ignored); small parts are merged once there are more than PARTS_MAX. Tables
+in parts are read with read_table() (or iter_parts(), one part at a time), and their CSV and Excel
+exports are written a part at a time (see save_table_chunks()).
+"""
+import os
+import json
+import math
+import pickle
+import datetime
+import itertools
+from pathlib import Path
+from contextlib import contextmanager
+
+from nbl import metrics
+
+import logging
+log = logging.getLogger("main.store")
+
+SAVED_GAMES_FILE = "saved_games.json"   # list of games saved in the tables of a data folder
+CHECKPOINT_DIR = ".checkpoint"  # sub-folder of the data folder holding per-game checkpoints
+TABLES = ['games', 'players', 'stints', 'stint_stats']  # per-game tables kept in a checkpoint
+EXTRA_TABLES = ['anomalies', 'matchups', 'splits', 'team_games']    # per-game tables where a game may have no rows (not needed for a game to be saved)
+PART_TABLES = ['stint_stats', 'anomalies', 'splits']    # per-game tables saved in parts (no season table is built from them)
+PARTS_SUFFIX = ".parts"     # folder of the parts of a table, next to its file (e.g., splits_df.parts)
+PARTS_INDEX = "index.json"  # games in each part, in the folder of the parts
+PART_GAMES = 50     # max games in a part merged (see compact_parts())
+PARTS_MAX = 20      # parts of a table with less than PART_GAMES games before they are merged
+
+
+@contextmanager
+def atomic_path(path):
+    """Context manager giving a temporary path to write into; the file is moved to path on success
+
+    The temporary file lives in the same folder and keeps the suffix of path (writers like
+    pandas use it to choose the format). If writing fails, the temporary file is removed and
+    path is left untouched.
+
+    Args:
+        path (str | Path): final file path
+
+    Yields:
+        Path: temporary file path to write to
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.stem}.tmp{path.suffix}")
+    try:
+        yield tmp
+        with open(tmp, 'rb') as f:  # make sure data hit the disk before the rename
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def excel_value(value):
+    """Value of a cell as written to Excel by pandas (missing values as empty cells, lists as text, etc.)"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or hasattr(value, 'dtype') and value.dtype.kind == 'b':
+        return bool(value)
+    if isinstance(value, float) or hasattr(value, 'dtype') and value.dtype.kind == 'f':
+        value = float(value)
+        return None if math.isnan(value) else ('inf' if value > 0 else '-inf') if math.isinf(value) else value
+    if isinstance(value, int) or hasattr(value, 'dtype') and value.dtype.kind in 'iu':
+        return int(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return None if value != value else value    # NaT is a datetime too
+    if isinstance(value, datetime.timedelta):
+        return None if value != value else value.total_seconds() / 86400
+    return str(value)
+
+
+def write_excel(dfs, file):
+    """Write tables with the same columns as one Excel sheet, one table at a time
+
+    Rows are streamed to the file (openpyxl write-only mode), so only one table is in memory at a time,
+    and cells are written as pandas.DataFrame.to_excel() would (header in bold, no index).
+
+    Args:
+        dfs (iterable(pd.DataFrame)): tables to write, one after the other (columns of the first one)
+        file (str | Path): Excel file to write
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    columns = None
+    for df in dfs:
+        if columns is None:
+            columns = list(df.columns)
+            side = Side(style='thin')
+            header = []
+            for col in columns:
+                cell = WriteOnlyCell(sheet, value=excel_value(col))
+                cell.font = Font(bold=True)
+                cell.border = Border(left=side, right=side, top=side, bottom=side)
+                cell.alignment = Alignment(horizontal='center', vertical='top')
+                header.append(cell)
+            sheet.append(header)
+        for row in df.reindex(columns=columns).itertuples(index=False, name=None):
+            cells = []
+            for value in map(excel_value, row):
+                if isinstance(value, datetime.date):
+                    cell = WriteOnlyCell(sheet, value=value)
+                    cell.number_format = 'YYYY-MM-DD HH:MM:SS' if isinstance(value, datetime.datetime) else 'YYYY-MM-DD'
+                    value = cell
+                cells.append(value)
+            sheet.append(cells)
+    workbook.save(file)
+
+
+def save_table(df, file, exts=('.pkl', '.csv', '.xlsx')):
+    """Save a dataframe atomically in various formats (Pickle, CSV, Excel)
+
+    Args:
+        df (pd.DataFrame): table to save
+        file (str | Path): file path of the table (suffix is replaced for each format)
+        exts (tuple(str)): formats to save, as file extensions
+    """
+    for ext in exts:
+        with metrics.span(f"save_{ext[1:]}"), atomic_path(Path(file).with_suffix(ext)) as tmp:
+            if ext == '.pkl':
+                df.to_pickle(tmp)
+            elif ext == '.csv':
+                df.to_csv(tmp, index=False)
+            elif ext == '.xlsx':
+                write_excel([df], tmp)
+
+
+def save_table_chunks(dfs, file, columns: list, exts=('.csv', '.xlsx')):
+    """Save a table given in chunks atomically as CSV and Excel, one chunk in memory at a time
+
+    Args:
+        dfs (callable): function returning the chunks of the table (called once per format), e.g.,
+            lambda: iter_parts(file)
+        file (str | Path): file path of the table (suffix is replaced for each format)
+        columns (list(str)): columns of the table (those missing in a chunk are left empty)
+        exts (tuple(str)): formats to save, as file extensions
+    """
+    import pandas as pd
+
+    for ext in exts:
+        chunks = (df.reindex(columns=columns) for df in dfs())
+        with metrics.span(f"save_{ext[1:]}"), atomic_path(Path(file).with_suffix(ext)) as tmp:
+            if ext == '.csv':
+                with open(tmp, 'w', newline='') as f:
+                    pd.DataFrame(columns=columns).to_csv(f, index=False)
+                    for df in chunks:
+                        df.to_csv(f, index=False, header=False)
+            elif ext == '.xlsx':
+                write_excel(itertools.chain([pd.DataFrame(columns=columns)], chunks), tmp)
+
+
+def parts_dir(file) -> Path:
+    """Folder of the parts of a table (see save_parts())"""
+    return Path(file).with_suffix(PARTS_SUFFIX)
+
+
+def load_parts_index(file) -> list:
+    """Parts of a table, oldest first: file name, games, number of rows and columns of each (empty if not in parts)"""
+    index_file = Path(parts_dir(file), PARTS_INDEX)
+    if not index_file.exists():
+        return []
+    with open(index_file) as f:
+        return json.load(f)
+
+
+def _save_parts_index(file, index: list):
+    with atomic_path(Path(parts_dir(file), PARTS_INDEX)) as tmp, open(tmp, 'w') as f:
+        json.dump(index, f, indent=1)
+
+
+def _next_part(index: list) -> int:
+    return max([int(entry['part'][len('part-'):-len('.pkl')]) for entry in index], default=0) + 1
+
+
+def _write_part(file, no: int, df, game_ids) -> dict:
+    part = f"part-{no:05d}.pkl"
+    with atomic_path(Path(parts_dir(file), part)) as tmp:
+        df.reset_index(drop=True).to_pickle(tmp)
+    return {'part': part, 'games': [str(game_id) for game_id in game_ids], 'rows': df.shape[0],
+            'columns': [str(col) for col in df.columns]}
+
+
+def has_parts(file) -> bool:
+    """Whether a table is saved in parts"""
+    return Path(parts_dir(file), PARTS_INDEX).exists()
+
+
+def live_parts(index: list) -> dict:
+    """Part holding the rows of each game of a table in parts: the newest part the game is in"""
+    return {game_id: entry['part'] for entry in index for game_id in entry['games']}
+
+
+def parts_games(file) -> set:
+    """Ids of the games of a table saved in parts, without loading it"""
+    return set(live_parts(load_parts_index(file)))
+
+
+def parts_columns(file) -> list:
+    """Columns of a table saved in parts: those of its newest part with rows"""
+    index = load_parts_index(file)
+    entries = [entry for entry in index if entry['rows'] > 0] or index
+    return entries[-1]['columns'] if entries else ['game_id']
+
+
+def save_parts(file, df, game_ids):
+    """Save the rows of some games of a table as a new part (many, if more than PART_GAMES games), replacing
+    any rows of those games saved before
+
+    The part is written atomically before the index of the parts is updated, so a save interrupted leaves
+    the table as it was. Parts are merged once more than PARTS_MAX have less than PART_GAMES games (see
+    compact_parts()).
+
+    Args:
+        file (str | Path): file path of the table (its parts go in the folder of parts_dir())
+        df (pd.DataFrame): rows of the games, with a game_id column
+        game_ids (iterable): ids of the games saved (a game with no rows in df has none after)
+    """
+    parts_dir(file).mkdir(exist_ok=True)
+    index = load_parts_index(file)
+    game_ids = sorted({str(game_id) for game_id in game_ids}, key=lambda x: (len(x), x))
+    with metrics.span('save_part'):
+        for i in range(0, len(game_ids), PART_GAMES):   # many games (e.g., a whole season): many parts
+            part_games = game_ids[i:i + PART_GAMES]
+            part_df = df if len(game_ids) <= PART_GAMES else df[df['game_id'].astype(str).isin(part_games)]
+            index.append(_write_part(file, _next_part(index), part_df, part_games))
+        _save_parts_index(file, index)
+    log.debug(f"Table {file} saved with {df.shape[0]} rows of {len(game_ids)} games in part {index[-1]['part']}")
+    if sum(len(entry['games']) < PART_GAMES for entry in index) > PARTS_MAX:
+        compact_parts(file)
+
+
+def iter_parts(file, columns: list = None, game_ids=None):
+    """Read a table saved in parts one part at a time, only the current rows of each game
+
+    Args:
+        file (str | Path): file path of the table
+        columns (list(str)): columns to read (default: all)
+        game_ids (iterable): games to read (default: all)
+
+    Yields:
+        pd.DataFrame: rows of the games of each part with rows to read, oldest part first
+    """
+    import pandas as pd
+
+    index = load_parts_index(file)
+    live = live_parts(index)
+    game_ids = None if game_ids is None else {str(game_id) for game_id in game_ids}
+    for entry in index:
+        keep = [game_id for game_id in entry['games']
+                if live[game_id] == entry['part'] and (game_ids is None or game_id in game_ids)]
+        if not keep or entry['rows'] == 0:
+            continue
+        df = pd.read_pickle(Path(parts_dir(file), entry['part']))
+        if len(keep) < len(entry['games']):
+            df = df[df['game_id'].astype(str).isin(keep)]
+        yield df if columns is None else df.reindex(columns=columns)
+
+
+def read_table(file, columns: list = None, game_ids=None):
+    """Read a saved table, whether saved whole (Pickle file) or in parts
+
+    Args:
+        file (str | Path): file path of the table (Pickle)
+        columns (list(str)): columns to read (default: all)
+        game_ids (iterable): games to read (default: all)
+
+    Returns:
+        pd.DataFrame: the table
+    """
+    import pandas as pd
+
+    if has_parts(file):
+        columns = columns or parts_columns(file)
+        dfs = [df for df in iter_parts(file, columns, game_ids) if df.shape[0] > 0]
+        if not dfs:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0].reset_index(drop=True)
+    df = pd.read_pickle(file)
+    if game_ids is not None:
+        df = df[df['game_id'].astype(str).isin({str(game_id) for game_id in game_ids})]
+    return df if columns is None else df[columns]
+
+
+def compact_parts(file, game_ids=None):
+    """Merge the parts of a table into parts of PART_GAMES games, dropping rows replaced since
+
+    Parts are read one at a time, so at most about two parts are in memory.
+
+    Args:
+        file (str | Path): file path of the table
+        game_ids (iterable): games kept (default: all, e.g., only the games saved in the folder)
+    """
+    import pandas as pd
+
+    old_index = load_parts_index(file)
+    no = _next_part(old_index)
+    index, dfs, games = [], [], []
+
+    def flush():
+        index.append(_write_part(file, no + len(index), pd.concat(dfs, ignore_index=True) if dfs else
+                                 pd.DataFrame(columns=parts_columns(file)), games))
+        dfs.clear()
+        games.clear()
+
+    for df in iter_parts(file, game_ids=game_ids):
+        for game_id, game_df in df.groupby(df['game_id'].astype(str), sort=False):
+            dfs.append(game_df)
+            games.append(game_id)
+            if len(games) == PART_GAMES:
+                flush()
+    # games with no rows stay in the index (with no rows in the last part)
+    kept = {game_id for entry in index for game_id in entry['games']} | set(games)
+    game_ids = None if game_ids is None else {str(game_id) for game_id in game_ids}
+    games.extend(game_id for game_id in live_parts(old_index)
+                 if game_id not in kept and (game_ids is None or game_id in game_ids))
+    if games:
+        flush()
+
+    _save_parts_index(file, index)
+    for entry in old_index:
+        Path(parts_dir(file), entry['part']).unlink(missing_ok=True)
+    log.info(f"Parts of table {file} merged: {len(old_index)} parts into {len(index)}")
+
+
+def clear_parts(file):
+    """Remove the parts of a table (e.g., to save it again from scratch)"""
+    folder = parts_dir(file)
+    if not folder.exists():
+        return
+    Path(folder, PARTS_INDEX).unlink(missing_ok=True)
+    for part in folder.glob('part-*.pkl'):
+        part.unlink()
+
+
+def check_tables(tables: dict) -> set:
+    """Check saved tables are consistent and return the games that are fully saved
+
+    The games table is always saved last, so a game is fully saved only if it is in the
+    games table and has rows in all other tables. Rows of any other game are left-overs of
+    an interrupted save and should be discarded.
+
+    Args:
+        tables (dict): tables by name (games, players, stints, stint_stats); a table saved in parts
+            (see save_parts()) can be given as the set of its games (see parts_games())
+
+    Returns:
+        set: ids of the games fully saved
+    """
+    game_ids = set(tables['games']['game_id'])
+    for name in TABLES[1:]:
+        table_games = tables[name] if isinstance(tables[name], set) else set(tables[name]['game_id'])
+        if game_ids.difference(table_games):
+            log.warning(f"Games with no rows in table {name}: {game_ids.difference(table_games)}")
+        if table_games.difference(game_ids):
+            log.warning(f"Table {name} has rows of games not saved: {table_games.difference(game_ids)}")
+        game_ids &= table_games
+    return game_ids
+
+
+def replace_game_rows(df, new_df, game_ids):
+    """Replace the rows of some games in a table by their new rows, keeping the games where they were
+
+    Rows of other games are kept as they are; games not in the table are added at the end.
+
+    Args:
+        df (pd.DataFrame): table with a game_id column
+        new_df (pd.DataFrame): new rows of the games (possibly none for a game)
+        game_ids (iterable): ids of the games replaced
+
+    Returns:
+        pd.DataFrame: the table with the rows replaced
+    """
+    import pandas as pd
+
+    df = df.reset_index(drop=True)
+    first_row = df.reset_index().groupby('game_id')['index'].min()     # where each game starts in the table
+    kept_df = df.loc[~df['game_id'].isin(list(game_ids))]
+    position = pd.concat([kept_df.index.to_series(), new_df['game_id'].map(first_row).fillna(len(df))],
+                         ignore_index=True)
+    df = pd.concat([kept_df, new_df], ignore_index=True)
+    return df.iloc[position.argsort(kind='stable')].reset_index(drop=True)
+
+
+def load_saved_games(data_dir) -> set:
+    """Get the games saved in the tables of a data folder, without loading the tables
+
+    Args:
+        data_dir (str | Path): data folder
+
+    Returns:
+        set: ids of the games saved, or None if the folder has no list of saved games
+    """
+    file = Path(data_dir, SAVED_GAMES_FILE)
+    if not file.exists():
+        return None
+    with open(file) as f:
+        return set(json.load(f))
+
+
+def save_saved_games(data_dir, game_ids):
+    """Save the list of games saved in the tables of a data folder (after the tables are saved)
+
+    Args:
+        data_dir (str | Path): data folder
+        game_ids (iterable): ids of the games saved
+    """
+    with atomic_path(Path(data_dir, SAVED_GAMES_FILE)) as tmp, open(tmp, 'w') as f:
+        json.dump(sorted(str(g) for g in game_ids), f)
+
+
+class Checkpoint:
+    """Per-game checkpoints of a run, one Pickle file per game committed"""
+
+    def __init__(self, data_dir):
+        self.dir = Path(data_dir, CHECKPOINT_DIR)
+
+    def _file(self, game_id) -> Path:
+        return Path(self.dir, f"{game_id}.pkl")
+
+    def save(self, game_id, tables: dict):
+        """Commit the tables of a game computed
+
+        Args:
+            game_id (str): id of the game
+            tables (dict): game record (dict) and players, stints and stint stats dataframes of the game
+        """
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with atomic_path(self._file(game_id)) as tmp:
+            with open(tmp, 'wb') as f:
+                pickle.dump(tables, f)
+        log.debug(f"Game {game_id} committed to checkpoint {self._file(game_id)}")
+
+    def _valid(self, game_id, tables) -> bool:
+        if not isinstance(tables, dict) or not set(TABLES).issubset(tables):
+            return False
+        if tables['games']['game_id'] != game_id:
+            return False
+        return all((tables[name]['game_id'] == game_id).all() for name in TABLES[1:] + EXTRA_TABLES if name in tables)
+
+    def load(self) -> dict:
+        """Load all games committed in a previous (interrupted) run
+
+        Checkpoints that cannot be read or whose tables do not belong to the game are
+        discarded, so those games are computed again.
+
+        Returns:
+            dict: tables of each game committed, keyed by game id
+        """
+        games = {}
+        if not self.dir.exists():
+            return games
+
+        for file in sorted(self.dir.glob("*.pkl")):
+            game_id = file.stem
+            try:
+                with open(file, 'rb') as f:
+                    tables = pickle.load(f)
+            except Exception as e:
+                tables = e
+            if not self._valid(game_id, tables):
+                log.warning(f"Discarding inconsistent checkpoint of game {game_id}: {file}")
+                file.unlink()
+                continue
+            games[game_id] = tables
+
+        return games
+
+    def clear(self):
+        """Remove all checkpoints (e.g., once tables have been saved)"""
+        if not self.dir.exists():
+            return
+        for file in self.dir.glob("*.pkl"):
+            file.unlink()
+        try:
+            self.dir.rmdir()
+        except OSError:     # some other file left there, leave the folder
+            pass
@@ -0,0 +1,433 @@
+"""
+Synthetic game and season generator for scale testing
+
+Games are generated in the same JSON shape served by Genius Sports at:
+
+    https://fibalivestats.dcd.shared.geniussports.com/data/<GAME_ID>/data.json
+
+that is, a `tm` dictionary with both teams and their players (`pl`, including `starter`
+and `sMinutes`) and a `pbp` list of play-by-play events (newest first) with substitutions,
+shots, assists, rebounds, blocks, steals, turnovers, fouls and overtime periods.
+
+Generation is seeded so the same (seed, game id) always yields the same game. Example:
+
+    python -m nbl.synth --games 20000 --data-dir synth-data/ --seed 7
+"""
+import os
+import json
+import random
+import argparse
+
+from nbl import store
+
+import logging
+log = logging.getLogger("main.synth")
+
+GAME_ID_BASE = 9000000  # synthetic game ids start here so they never clash with real ones
+
+FIRST_NAMES = ["Jack", "Liam", "Noah", "Oliver", "Lachlan", "Thomas", "Mitch", "Bryce", "Xavier", "Tyrell",
+               "Nathan", "Chris", "Jordan", "Matthew", "Shea", "Jo", "Sam", "Tom", "Will", "Owen",
+               "Kyrie", "Angus", "Hugh", "Isaac", "Dejan", "Jesse", "Keanu", "Zylan", "Tanner", "Cameron"]
+FAMILY_NAMES = ["Smith", "Brown", "Kuol", "Sobey", "Cooks", "Dellavedova", "Besson", "Goulding", "Creek",
+                "Hodgson", "Bairstow", "Vasiljevic", "Froling", "Kay", "Wagstaff", "Gliddon", "Ili", "Ngor",
+                "Sobey", "Pinder", "Reuben", "Dickerson", "Lual-Acuil", "Cheatham", "Galloway", "Wilson",
+                "Daniels", "Heal", "Travers", "Marshall"]
+TEAMS = [("Melbourne United", "MEL"), ("Sydney Kings", "SYD"), ("Perth Wildcats", "PER"),
+         ("Tasmania JackJumpers", "TAS"), ("Brisbane Bullets", "BRI"), ("Adelaide 36ers", "ADL"),
+         ("Cairns Taipans", "CNS"), ("Illawarra Hawks", "ILL"), ("New Zealand Breakers", "NZB"),
+         ("South East Melbourne Phoenix", "SEM")]
+
+SHOT_2PT_SUBTYPES = ["jumpshot", "layup", "drivinglayup", "dunk", "hookshot", "fadeaway"]
+TOV_SUBTYPES = ["badpass", "ballhandling", "travel", "doubledribble", "offensive", "3sec", "8sec", "24sec", "outofbounds"]
+
+PERIOD_SECS = 10 * 60 * 100     # regular period length, in hundredths of a second
+OVERTIME_SECS = 5 * 60 * 100    # overtime period length, in hundredths of a second
+
+
+def _clock_str(cs: int) -> str:
+    """Convert hundredths of a second left in the period into a clock string MM:SS:CC"""
+    return f"{cs // 6000:02d}:{(cs // 100) % 60:02d}:{cs % 100:02d}"
+
+
+def _gt_str(cs: int) -> str:
+    """Convert hundredths of a second left in the period into a game time string MM:SS"""
+    return f"{cs // 6000:02d}:{(cs // 100) % 60:02d}"
+
+
+def _person_id(first: str, family: str) -> int:
+    """Person id of a synthetic player: the same for the same name in all games (as a real player)"""
+    return 100000 + FIRST_NAMES.index(first) * len(FAMILY_NAMES) + FAMILY_NAMES.index(family)
+
+
+def _build_roster(rng: random.Random, tno: int, size: int) -> dict:
+    """Build the `pl` dictionary of a team, keyed by player number (pno) as a string"""
+    roster = {}
+    used = set()
+    for pno in range(1, size + 1):
+        while True:
+            first, family = rng.choice(FIRST_NAMES), rng.choice(FAMILY_NAMES)
+            if (first, family) not in used:
+                used.add((first, family))
+                break
+        roster[str(pno)] = {
+            "personId": _person_id(first, family),
+            "name": f"{first[0]}. {family}",
+            "firstName": first,
+            "familyName": family,
+            "internationalFirstName": first,
+            "internationalFamilyName": family,
+            "firstNameInitial": first[0],
+            "familyNameInitial": family[0],
+            "internationalFirstNameInitial": first[0],
+            "internationalFamilyNameInitial": family[0],
+            "scoreboardName": f"{first[0]}. {family}",
+            "shirtNumber": str(rng.randint(0, 55)),
+            "playingPosition": rng.choice(["G", "F", "C"]),
+            "starter": 1 if pno <= 5 else 0,
+            "captain": 1 if pno == 1 else 0,
+            "active": 1,
+            "sMinutes": "00:00",
+            "sPoints": 0,
+            "sFieldGoalsMade": 0,
+            "sFieldGoalsAttempted": 0,
+            "sThreePointersMade": 0,
+            "sThreePointersAttempted": 0,
+            "sFreeThrowsMade": 0,
+            "sFreeThrowsAttempted": 0,
+            "sReboundsOffensive": 0,
+            "sReboundsDefensive": 0,
+            "sReboundsTotal": 0,
+            "sAssists": 0,
+            "sSteals": 0,
+            "sBlocks": 0,
+            "sTurnovers": 0,
+            "sFoulsPersonal": 0,
+        }
+    return roster
+
+
+class _GameSimulator:
+    """Simulates a game possession by possession, recording PBP events in chronological order"""
+
+    def __init__(self, rng: random.Random, roster_size: int, sub_rate: float):
+        self.rng = rng
+        self.sub_rate = sub_rate
+        self.rosters = {1: _build_roster(rng, 1, roster_size), 2: _build_roster(rng, 2, roster_size)}
+        self.on_court = {tno: [str(p) for p in range(1, 6)] for tno in [1, 2]}
+        self.on_since = {tno: {pno: None for pno in self.on_court[tno]} for tno in [1, 2]}
+        self.secs_played = {tno: {pno: 0 for pno in self.rosters[tno]} for tno in [1, 2]}
+        self.score = {1: 0, 2: 0}
+        self.events = []
+        self.period = 1
+        self.period_type = "REGULAR"
+        self.elapsed = 0    # hundredths played in previous periods
+
+    # -------------------------------------------------------
+    # event recording
+    # -------------------------------------------------------
+    def _event(self, clock, tno, pno, action, sub_type="", success=0, scoring=0, qualifier=None):
+        """Record one PBP event at given clock (hundredths left in period)"""
+        player = self.rosters[tno][pno] if tno in self.rosters and pno in self.rosters[tno] else None
+        action_no = len(self.events) + 1
+        event = {
+            "gt": _gt_str(clock),
+            "clock": _clock_str(clock),
+            "s1": self.score[1],
+            "s2": self.score[2],
+            "lead": self.score[1] - self.score[2],
+            "tno": tno,
+            "period": self.period,
+            "periodType": self.period_type,
+            "pno": int(pno) if player else 0,
+            "player": player["name"] if player else "",
+            "success": success,
+            "actionType": action,
+            "actionNumber": action_no,
+            "previousAction": str(action_no - 1) if action_no > 1 else "",
+            "qualifier": qualifier or [],
+            "subType": sub_type,
+            "scoring": scoring,
+            "shirtNumber": player["shirtNumber"] if player else "",
+        }
+        if tno != 0:    # team and player events carry the names (empty for team events)
+            for key in ["firstName", "familyName", "internationalFirstName", "internationalFamilyName",
+                        "firstNameInitial", "familyNameInitial", "internationalFirstNameInitial",
+                        "internationalFamilyNameInitial", "scoreboardName"]:
+                event[key] = player[key] if player else ""
+        self.events.append(event)
+        return event
+
+    def _stat(self, tno, pno, key, n=1):
+        self.rosters[tno][pno][key] += n
+
+    # -------------------------------------------------------
+    # lineup tracking
+    # -------------------------------------------------------
+    def _period_length(self):
+        return PERIOD_SECS if self.period_type == "REGULAR" else OVERTIME_SECS
+
+    def _start_on_court(self, clock):
+        for tno in [1, 2]:
+            for pno in self.on_court[tno]:
+                self.on_since[tno][pno] = clock
+
+    def _stop_on_court(self, clock):
+        for tno in [1, 2]:
+            for pno in self.on_court[tno]:
+                self.secs_played[tno][pno] += self.on_since[tno][pno] - clock
+
+    def _substitute(self, clock, tno, n_subs):
+        bench = [pno for pno in self.rosters[tno] if pno not in self.on_court[tno]]
+        outs = self.rng.sample(self.on_court[tno], n_subs)
+        ins = self.rng.sample(bench, n_subs)
+        for pno in outs:
+            self._event(clock, tno, pno, "substitution", "out")
+            self.secs_played[tno][pno] += self.on_since[tno][pno] - clock
+            self.on_court[tno].remove(pno)
+        for pno in ins:
+            self._event(clock, tno, pno, "substitution", "in")
+            self.on_since[tno][pno] = clock
+            self.on_court[tno].append(pno)
+
+    def _maybe_substitute(self, clock):
+        for tno in [1, 2]:
+            if self.rng.random() < self.sub_rate:
+                self._substitute(clock, tno, self.rng.choice([1, 1, 1, 2, 2, 3]))
+
+    # -------------------------------------------------------
+    # plays
+    # -------------------------------------------------------
+    def _shooter(self, tno):
+        return self.rng.choice(self.on_court[tno])
+
+    def _free_throws(self, clock, off, n):
+        shooter = self._shooter(off)
+        for i in range(1, n + 1):
+            made = self.rng.random() < 0.77
+            if made:
+                self.score[off] += 1
+                self._stat(off, shooter, "sPoints")
+                self._stat(off, shooter, "sFreeThrowsMade")
+            self._stat(off, shooter, "sFreeThrowsAttempted")
+            self._event(clock, off, shooter, "freethrow", f"{i}of{n}", success=int(made), scoring=int(made))
+            # occasionally subs happen between free throws, at the same clock
+            if i < n and self.rng.random() < 0.05:
+                self._maybe_substitute(clock)
+        return made
+
+    def _possession(self, clock, off) -> int:
+        """Play one possession for team off at clock; return the team with the next possession"""
+        rng = self.rng
+        dfn = 2 if off == 1 else 1
+        r = rng.random()
+        if r < 0.13:    # turnover, maybe a steal
+            pno = self._shooter(off)
+            sub_type = rng.choice(TOV_SUBTYPES)
+            self._event(clock, off, pno, "turnover", sub_type)
+            self._stat(off, pno, "sTurnovers")
+            if sub_type in ["badpass", "ballhandling"] and rng.random() < 0.6:
+                stealer = self._shooter(dfn)
+                self._event(clock, dfn, stealer, "steal")
+                self._stat(dfn, stealer, "sSteals")
+            return dfn
+        if r < 0.22:    # shooting foul and free throws
+            fouler = self._shooter(dfn)
+            self._event(clock, dfn, fouler, "foul", "personal", qualifier=["2freethrow"])
+            self._stat(dfn, fouler, "sFoulsPersonal")
+            self._free_throws(clock, off, 2)
+            return dfn
+
+        # field goal attempt
+        shooter = self._shooter(off)
+        three = rng.random() < 0.38
+        action = "3pt" if three else "2pt"
+        sub_type = "jumpshot" if three else rng.choice(SHOT_2PT_SUBTYPES)
+        made = rng.random() < (0.35 if three else 0.52)
+        points = 3 if three else 2
+        if made:
+            self.score[off] += points
+            self._stat(off, shooter, "sPoints", points)
+            self._stat(off, shooter, "sFieldGoalsMade")
+            if three:
+                self._stat(off, shooter, "sThreePointersMade")
+        self._stat(off, shooter, "sFieldGoalsAttempted")
+        if three:
+            self._stat(off, shooter, "sThreePointersAttempted")
+        self._event(clock, off, shooter, action, sub_type, success=int(made), scoring=int(made))
+        if made:
+            if rng.random() < 0.6:
+                assister = rng.choice([p for p in self.on_court[off] if p != shooter])
+                self._event(clock, off, assister, "assist")
+                self._stat(off, assister, "sAssists")
+            if rng.random() < 0.05:     # and-one
+                self._free_throws(clock, off, 1)
+            return dfn
+
+        if not three and rng.random() < 0.08:
+            blocker = self._shooter(dfn)
+            self._event(clock, dfn, blocker, "block")
+            self._stat(dfn, blocker, "sBlocks")
+        # rebound: offensive, defensive or a team rebound
+        offensive = rng.random() < 0.27
+        reb_team = off if offensive else dfn
+        if rng.random() < 0.08:
+            self._event(clock, reb_team, None, "rebound", "offensive" if offensive else "defensive", qualifier=["team"])
+        else:
+            rebounder = self._shooter(reb_team)
+            self._event(clock, reb_team, rebounder, "rebound", "offensive" if offensive else "defensive")
+            self._stat(reb_team, rebounder, "sReboundsOffensive" if offensive else "sReboundsDefensive")
+            self._stat(reb_team, rebounder, "sReboundsTotal")
+        return off if offensive else dfn
+
+    def play_period(self):
+        length = self._period_length()
+        clock = length
+        self._event(clock, 0, None, "period", "start")
+        self._start_on_court(clock)
+        off = self.rng.choice([1, 2])
+        while True:
+            clock -= self.rng.randint(400, 2400)    # 4 to 24 seconds per possession
+            if clock <= 0:
+                break
+            off = self._possession(clock, off)
+            if self.rng.random() < 0.25:    # dead ball: chance of substitutions
+                self._maybe_substitute(clock)
+        self._stop_on_court(0)
+        self._event(0, 0, None, "period", "end")
+
+    def play(self):
+        for period in range(1, 5):
+            self.period = period
+            self.play_period()
+        ot = 0
+        while self.score[1] == self.score[2]:   # overtime until there is a winner
+            ot += 1
+            self.period, self.period_type = ot, "OVERTIME"
+            self.play_period()
+        self._event(0, 0, None, "game", "end")
+
+
+def generate_game(seed: int = 0, game_id: int = GAME_ID_BASE, roster_size: int = 10, sub_rate: float = 0.35,
+                  string_scores: bool = False) -> dict:
+    """Generate a synthetic finished game in Genius Sports JSON shape
+
+    Args:
+        seed (int): random seed of the season; the game id is mixed in so each game differs
+        game_id (int): id of the game to generate
+        roster_size (int): number of players per team (at least 6)
+        sub_rate (float): probability that a team substitutes in a dead ball
+        string_scores (bool): give the running scores of the PBP (s1, s2, lead) as strings, as feeds may do
+
+    Returns:
+        dict: JSON structure like the one served in data.json
+    """
+    rng = random.Random(f"{seed}-{game_id}")
+    sim = _GameSimulator(rng, max(roster_size, 6), sub_rate)
+    sim.play()
+
+    if string_scores:
+        for event in sim.events:
+            event.update({key: str(event[key]) for key in ["s1", "s2", "lead"]})
+
+    team_1, team_2 = rng.sample(TEAMS, 2)
+    tm = {}
+    for tno, (name, short_name) in [(1, team_1), (2, team_2)]:
+        for pno, player in sim.rosters[tno].items():
+            secs = sim.secs_played[tno][pno] // 100
+            player["sMinutes"] = f"{secs // 60:02d}:{secs % 60:02d}"
+        tm[str(tno)] = {
+            "name": name,
+            "nameInternational": name,
+            "shortName": short_name,
+            "code": short_name,
+            "score": sim.score[tno],
+            "full_score": sim.score[tno],
+            "pl": sim.rosters[tno],
+        }
+
+    return {
+        "clock": "00:00",
+        "period": sim.period,
+        "periodLength": 10,
+        "periodType": sim.period_type,
+        "inOT": int(sim.period_type == "OVERTIME"),
+        "tm": tm,
+        "pbp": list(reversed(sim.events)),  # feed lists newest events first
+        "disableMatch": 0,
+        "attendance": rng.randint(2000, 15000),
+        "periodsMax": 4,
+        "periodLengthREGULAR": 10,
+        "periodLengthOVERTIME": 5,
+    }
+
+
+def generate_season(data_dir: str, no_games: int, seed: int = 0, games_per_round: int = 5, **kwargs) -> list:
+    """Generate a season of synthetic games and save them as data-<GAME_ID>.json files
+
+    Files already in data_dir are kept, so a season can be generated in several runs.
+
+    Args:
+        data_dir (str): folder where to write JSON files
+        no_games (int): number of games to generate
+        seed (int): random seed of the season
+        games_per_round (int): number of games in each round
+        kwargs: extra options passed to generate_game()
+
+    Returns:
+        list(tuple(str, int)): GAMES list for the season, as (game id, round number)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    games = []
+    for i in range(no_games):
+        game_id = GAME_ID_BASE + i
+        round_no = i // games_per_round + 1
+        games.append((str(game_id), round_no))
+
+        file_json = os.path.join(data_dir, f"data-{game_id}.json")
+        if os.path.exists(file_json):
+            continue
+        with store.atomic_path(file_json) as tmp, open(tmp, 'w') as f:   # no partial file left if killed
+            json.dump(generate_game(seed, game_id, **kwargs), f)
+        if (i + 1) % 1000 == 0:
+            log.info(f"Generated {i + 1} synthetic games in {data_dir}")
+
+    return games
+
+
+def save_games_module(file: str, games: list, seed: int = 0):
+    """Save a GAMES list as a Python module usable with the scrapper --games option
+
+    Args:
+        file (str): module file to write (e.g., games_synth.py)
+        games (list(tuple(str, int))): GAMES list, as (game id, round number)
+        seed (int): random seed the season was generated with (recorded in the header)
+    """
+    with open(file, 'w') as f:
+        f.write(f"# Synthetic season of {len(games)} games (seed {seed}), generated with nbl.synth\n")
+        f.write(f"GAMES = {games}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic season of games in Genius Sports JSON shape.")
+    parser.add_argument('--games', type=int, default=200,
+                        help='Number of games to generate (default: %(default)s).')
+    parser.add_argument('--data-dir', type=str, default='synth-data/',
+                        help='Folder where to write data-<GAME_ID>.json files (default: %(default)s).')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of the season (default: %(default)s).')
+    parser.add_argument('--games-per-round', type=int, default=5,
+                        help='Number of games in each round (default: %(default)s).')
+    parser.add_argument('--roster-size', type=int, default=10,
+                        help='Number of players per team, at least 6 (default: %(default)s).')
+    parser.add_argument('--sub-rate', type=float, default=0.35,
+                        help='Probability that a team substitutes in a dead ball (default: %(default)s).')
+    parser.add_argument('--module', type=str,
+                        help='Also write a games module with the GAMES list (e.g., games_synth.py).')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    games = generate_season(args.data_dir, args.games, args.seed, args.games_per_round,
+                            roster_size=args.roster_size, sub_rate=args.sub_rate)
+    if args.module:
+        save_games_module(args.module, games, args.seed)
+    print(f"Generated {len(games)} synthetic games in {args.data_dir}")
@@ -1,14 +1,65 @@
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
 import os
+import hashlib
 import datetime
-from urllib.request import urlopen
+from urllib.error import HTTPError
 import json  # https://docs.python.org/3/library/json.html
-import pandas as pd
 from functools import reduce
 
 from nbl.config import *
+from nbl.store import atomic_path
+from nbl import metrics
+
+import logging
+log = logging.getLogger("main.tools")
 
 percent = lambda part, whole: round(100* (part / whole), 2)
 
+# HTTP session shared by all requests of the process (keeps connections alive across games and seasons)
+_http_session = None
+
+# cache of game info (date and venue) scraped from HTML pages, by game id
+_game_info_cache = {}
+
+
+def http_session():
+    """Get the HTTP session shared by all requests done in the process
+
+    Returns:
+        requests.Session: the shared session, with a pool of connections
+    """
+    global _http_session
+    if _http_session is None:
+        import requests
+        _http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+        _http_session.mount('http://', adapter)
+        _http_session.mount('https://', adapter)
+    return _http_session
+
+
+def http_get(url: str, headers=None):
+    """Get a URL using the shared HTTP session
+
+    Args:
+        url (str): the URL to get
+        headers (dict): extra headers of the request, if any
+
+    Raises:
+        HTTPError: if the server does not answer with success
+
+    Returns:
+        requests.Response: response of the server
+    """
+    with metrics.span('http'):
+        response = http_session().get(url, timeout=HTTP_TIMEOUT, headers=headers)
+    metrics.count('http_requests')
+    metrics.count('http_bytes', len(response.content))
+    if not response.ok:
+        raise HTTPError(url, response.status_code, response.reason, response.headers, None)
+    return response
+
 # stats_df.merge(stints1_df)s
 def time_to_datetime(time : datetime.time) -> datetime.datetime:
     """Convert datetime.time to datetime.datetime
@@ -19,6 +70,8 @@ def time_to_datetime(time : datetime.time) -> datetime.datetime:
     Returns:
         datetime.datetime: converted object
     """
+    import pandas as pd
+
     try:
         return pd.to_datetime(time, format='%H:%M:%S.%f')
     except:
@@ -43,39 +96,117 @@ def intervals_to_mins(intervals: list) -> float:
 def get_json_data(game_id: int, dir='.') :
     """Load a game into a JSON object.
         Data will be loaded from local file data-{game_id}.json if exists
-        Otherwise will be fetched from server
+        Otherwise will be fetched from server (and saved atomically in that file)
+        A local file that is not valid JSON (e.g., partially written) is removed and fetched again
 
     Args:
         game_id (int): id of the game
-        dir (str): folder where to check and save a copy
+        dir (str): folder where to check and save a copy (None to not use local files)
 
     Returns:
         json-object: An object with JSON structure dict/list
     """
+    if dir is None:
+        return fetch_json_data(game_id)
+
     file_json = os.path.join(dir, f"data-{game_id}.json")
-    game_url = f"{URL_LIVESTATS}/{str(game_id)}/data.json"
 
     if os.path.exists(file_json):
-        game_json = json.load(open(file_json))
-        # print(f"Game data loaded from local file: {game_file}")
-    else:   # get if from URL
-        # store the response of URL
-        response = urlopen(game_url)
+        try:
+            with metrics.span('json_load'), open(file_json) as f:
+                game_json = json.load(f)
+            metrics.count('json_cache_hits')
+            return game_json
+        except json.JSONDecodeError as e:   # e.g., written by an older version killed while writing it
+            log.warning(f"Discarding broken JSON file of game {game_id} ({e}), fetching it again: {file_json}")
+            os.remove(file_json)
+
+    # get it from URL, and save it atomically (temp file first, then renamed) so no partial file is left
+    game_json = fetch_json_data(game_id)
+    with atomic_path(file_json) as tmp, open(tmp, 'w') as f:
+        json.dump(game_json, f)
 
-        # storing the JSON response
-        # from url in data
-        game_json = json.loads(response.read())
+    return game_json
+
+
+def fetch_json_data(game_id: int):
+    """Fetch the JSON data of a finished game from the server
+
+    Args:
+        game_id (int): id of the game
+
+    Raises:
+        ValueError: if the game has not finished yet
 
-        # assume no json file if game is not yet over!
-        if not game_ended(game_json):
-            raise ValueError('Game has not finished yet')
+    Returns:
+        json-object: An object with JSON structure dict/list
+    """
+    game_json = fetch_live_json_data(game_id)
 
-        with open(file_json, 'w') as f:
-            json.dump(game_json, f)
-        # print(f"Game data loaded from URL: {game_url}")
+    # assume no json file if game is not yet over!
+    if not game_ended(game_json):
+        raise ValueError('Game has not finished yet')
 
     return game_json
 
+
+def fetch_live_json_data(game_id: int):
+    """Fetch the JSON data of a game from the server, whether it has finished or is still in progress
+
+    Args:
+        game_id (int): id of the game
+
+    Returns:
+        json-object: An object with JSON structure dict/list
+    """
+    game_url = f"{URL_LIVESTATS}/{str(game_id)}/data.json"
+
+    # store the response of URL
+    response = http_get(game_url)
+
+    # storing the JSON response
+    # from url in data
+    return response.json()
+
+
+def probe_json_data(game_id: int, validators=None) -> tuple:
+    """Fetch the JSON data of a game from the server only if it changed since the last fetch
+
+    A conditional request is done with the validators (ETag and Last-Modified) of the last fetch, so
+    the server answers with no data if the game has not changed since then.
+
+    Args:
+        game_id (int): id of the game
+        validators (dict): ETag and Last-Modified headers of the last fetch, if any
+
+    Returns:
+        tuple(json-object, dict): the game data (None if not changed) and the validators of this fetch
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get('ETag'):
+        headers['If-None-Match'] = validators['ETag']
+    if validators.get('Last-Modified'):
+        headers['If-Modified-Since'] = validators['Last-Modified']
+
+    response = http_get(f"{URL_LIVESTATS}/{str(game_id)}/data.json", headers=headers)
+    if response.status_code == 304:     # not modified
+        return None, validators
+    return response.json(), {key: response.headers[key] for key in ['ETag', 'Last-Modified'] if key in response.headers}
+
+
+def json_hash(game_json) -> str:
+    """Content hash of the JSON data of a game (independent of key order and formatting)
+
+    Args:
+        game_json (json-object): JSON data of a game
+
+    Returns:
+        str: SHA-256 hex digest of the data
+    """
+    return hashlib.sha256(json.dumps(game_json, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
 def game_ended(game_json) -> bool:
     """
     Checks if the game has ended
@@ -88,16 +219,25 @@ def game_ended(game_json) -> bool:
         return True
 
     # new (March 2023) games like https://fibalivestats.dcd.shared.geniussports.com/data/139002/data.json
-    # check last 5 PBPs
-    for i in range(5):
-        if game_json['pbp'][i]['actionType'] == "game" and game_json['pbp'][i]['subType'] == "end":
-            return True
-
-    return False
+    # the game end may not be the latest PBP (e.g., followed by late corrections), so check them all
+    return any(pbp['actionType'] == "game" and pbp['subType'] == "end" for pbp in game_json['pbp'])
 
 
 def get_game_info(game_id : int) -> dict:
-    import requests
+    """Get date and venue of a game, by scraping its HTML page
+
+    Results are kept in a cache (see load_game_info_cache()), so each game page is fetched once.
+
+    Args:
+        game_id (int): id of the game
+
+    Returns:
+        dict: date and venue of the game
+    """
+    if str(game_id) in _game_info_cache:
+        metrics.count('game_info_cache_hits')
+        return _game_info_cache[str(game_id)]
+
     from bs4 import BeautifulSoup # https://stackabuse.com/guide-to-parsing-html-with-beautifulsoup-in-python/
     import re
     import datetime
@@ -105,7 +245,7 @@ def get_game_info(game_id : int) -> dict:
     url = f"https://fibalivestats.dcd.shared.geniussports.com/u/NBL/{game_id}/"
 
     # get HTML text
-    r = requests.get(url)
+    r = http_get(url)
     html_text = r.text
 
     # parse to find and extract date
@@ -132,9 +272,35 @@ def get_game_info(game_id : int) -> dict:
     #     print(x)
     #     print("==========")
 
+    _game_info_cache[str(game_id)] = game_dict
     return game_dict
 
 
+def load_game_info_cache(file):
+    """Add the game info (date and venue) saved in a JSON file to the game info cache
+
+    Args:
+        file (str | Path): JSON file with the game info of a set of games
+    """
+    if not os.path.exists(file):
+        return
+    with open(file) as f:
+        for game_id, info in json.load(f).items():
+            _game_info_cache[game_id] = {"venue": info['venue'], "date": datetime.datetime.fromisoformat(info['date'])}
+
+
+def save_game_info_cache(file, game_ids: list):
+    """Save the game info (date and venue) cached for a set of games into a JSON file
+
+    Args:
+        file (str | Path): JSON file to save
+        game_ids (list): the games to save (those not in the cache are skipped)
+    """
+    info = {str(g): _game_info_cache[str(g)] for g in game_ids if str(g) in _game_info_cache}
+    with atomic_path(file) as tmp, open(tmp, 'w') as f:
+        json.dump({g: {"venue": x['venue'], "date": x['date'].isoformat()} for (g, x) in info.items()}, f, indent=1)
+
+
 def build_player_names(x : pd.Series | pd.DataFrame) -> pd.Series | pd.DataFrame:
     """Output the standarized name of a player
 
@@ -144,6 +310,8 @@ def build_player_names(x : pd.Series | pd.DataFrame) -> pd.Series | pd.DataFrame
     Returns:
         pd.Series | pd.DataFrame : a series with standarized names of each player
     """
+    import pandas as pd
+
     if isinstance(x, pd.Series):
     # return f"{x['internationalFirstNameInitial']}. {x['internationalFamilyName']}"
         return f"{x['internationalFirstName']} {x['internationalFamilyName']}"
@@ -0,0 +1,359 @@
+"""
+Substitution consistency checks of the play-by-play data, in bulk
+
+The PBP of a game (or of a whole season, as all checks group by game) is checked in vectorized form and
+every problem found becomes a row of an anomalies table, stored with the other tables of the season:
+
+    duplicate_sub    a player subbed more than once at the same clock (only the last sub is used)
+    sub_imbalance    number of players in and out at a clock differ
+    lineup_size      a team does not have 5 players on court after the subs at a clock (or at the start)
+    in_on_court      a player coming in who is already on court
+    out_off_court    a player going out who is not on court
+    event_off_court  a player with a play (shot, rebound, foul, ...) while not on court
+    minutes_mismatch minutes of a player in the stints far from the minutes of the box score (sMinutes)
+
+As in the stint extraction (see bball_stats.pbp_stints_extract()), a play at the clock of a sub belongs
+to the lineup before the sub.
+
+The minutes of each player in the stints are also reconciled with the box score for a whole season in one
+pass, and each game is scored by the minutes misplaced in its stints: a broken chain of subs corrupts the
+lineup stats of the whole game, so games over QUARANTINE_MINUTES are quarantined (flagged in the games table).
+Example, to validate the games cached in a season folder:
+
+    python -m nbl.validate data-22_23/
+"""
+from __future__ import annotations  # type hints are not evaluated, so pandas is not needed to import this module
+
+import argparse
+from pathlib import Path
+
+from nbl.config import *
+from nbl import tools, store, registry
+
+import logging
+log = logging.getLogger("main.validate")
+
+ANOMALIES_COLS = ['game_id', 'tno', 'period', 'clock', 'player', 'anomaly', 'detail']
+LINEUP_SIZE = 5
+MINUTES_THRESHOLD = 1.0     # minutes a player can be off between stints and box score
+QUARANTINE_MINUTES = 3.0    # minutes misplaced in the stints of a game from which the game is quarantined
+PERIOD_SECS = 1000          # game time key of a play: period * PERIOD_SECS - seconds left (longer than any period)
+
+
+def game_time(pbp_df: pd.DataFrame) -> pd.Series:
+    """Key increasing with game time of each play (period, then clock running down)"""
+    import pandas as pd
+
+    return pbp_df['period'] * PERIOD_SECS - pd.to_timedelta(pbp_df['clock'].astype(str)).dt.total_seconds()
+
+
+def anomalies(df: pd.DataFrame, anomaly: str, detail) -> pd.DataFrame:
+    """Rows of the anomalies table for the rows of df (with the columns of ANOMALIES_COLS it has)"""
+    import pandas as pd
+
+    rows_df = pd.DataFrame({col: df[col] if col in df else None for col in ANOMALIES_COLS})
+    rows_df['anomaly'] = anomaly
+    rows_df['detail'] = detail
+    return rows_df
+
+
+def get_starters_df(game_json: dict, game_id) -> pd.DataFrame:
+    """Starters of both teams of a game, as a table (game_id, tno, player)"""
+    import pandas as pd
+    from nbl.bball_stats import get_starters
+
+    return pd.DataFrame([{'game_id': game_id, 'tno': tno, 'player': player}
+                         for tno in [1, 2] for player in sorted(get_starters(game_json, tno))],
+                        columns=['game_id', 'tno', 'player'])
+
+
+def check_subs(pbp_df: pd.DataFrame, starters_df: pd.DataFrame) -> tuple:
+    """Check the substitutions of the games and get the on-court state of each player after each sub
+
+    Args:
+        pbp_df (pd.DataFrame): PBP of the games, with a game_id column
+        starters_df (pd.DataFrame): starters of each game and team (game_id, tno, player)
+
+    Returns:
+        tuple(pd.DataFrame, pd.DataFrame): anomalies found and subs (one per player and clock) with the game
+            time and the number of times the player is on court after it (1 if on court, if subs are consistent)
+    """
+    import numpy as np
+    import pandas as pd
+
+    keys = ['game_id', 'tno', 'period', 'clock']
+    subs_df = pbp_df.loc[pbp_df['actionType'] == 'substitution', keys + ['player', 'subType', 'actionNumber']]
+    subs_df = subs_df.assign(time=game_time(subs_df)).sort_values(['game_id', 'tno', 'time', 'actionNumber'], kind='stable')
+    found = []
+
+    # 1. duplicate subs of a player at a clock: keep the last (as the stint extraction does)
+    duplicated = subs_df.duplicated(subset=keys + ['player'], keep='last')
+    found.append(anomalies(subs_df[duplicated], 'duplicate_sub', subs_df.loc[duplicated, 'subType']))
+    subs_df = subs_df[~duplicated].copy()
+    subs_df['delta'] = np.where(subs_df['subType'] == 'in', 1, -1)
+
+    # 2. players in and out at each clock, and size of the lineup after them
+    clocks_df = subs_df.assign(n_in=subs_df['delta'] == 1, n_out=subs_df['delta'] == -1) \
+                    .groupby(keys, sort=False)[['time', 'n_in', 'n_out']].agg({'time': 'first', 'n_in': 'sum', 'n_out': 'sum'}) \
+                    .reset_index().sort_values(['game_id', 'tno', 'time'], kind='stable')
+    imbalanced = clocks_df['n_in'] != clocks_df['n_out']
+    found.append(anomalies(clocks_df[imbalanced], 'sub_imbalance',
+                           clocks_df.loc[imbalanced, 'n_in'].astype(str) + ' in, ' + clocks_df.loc[imbalanced, 'n_out'].astype(str) + ' out'))
+
+    no_starters = starters_df.groupby(['game_id', 'tno']).size().rename('starters')
+    teams_df = no_starters.reindex(pd.MultiIndex.from_frame(pbp_df.loc[pbp_df['tno'].isin([1, 2]), ['game_id', 'tno']].drop_duplicates()),
+                                   fill_value=0).reset_index()
+    bad_starters = teams_df[teams_df['starters'] != LINEUP_SIZE]
+    found.append(anomalies(bad_starters.assign(period=1), 'lineup_size', bad_starters['starters'].astype(str) + ' starters'))
+
+    clocks_df = clocks_df.merge(teams_df, on=['game_id', 'tno'], how='left')
+    clocks_df['size'] = clocks_df['starters'].fillna(0).astype(int) + \
+                        (clocks_df['n_in'] - clocks_df['n_out']).groupby([clocks_df['game_id'], clocks_df['tno']]).cumsum()
+    bad_size = clocks_df['size'] != LINEUP_SIZE
+    found.append(anomalies(clocks_df[bad_size], 'lineup_size', clocks_df.loc[bad_size, 'size'].astype(str) + ' on court'))
+
+    # 3. on-court state of each player before and after each of its subs
+    starters = starters_df.assign(starter=1).drop_duplicates(['game_id', 'tno', 'player'])
+    subs_df = subs_df.merge(starters, on=['game_id', 'tno', 'player'], how='left')
+    subs_df['state'] = subs_df['starter'].fillna(0).astype(int) + \
+                       subs_df.groupby(['game_id', 'tno', 'player'], sort=False)['delta'].cumsum()
+    before = subs_df['state'] - subs_df['delta']
+    found.append(anomalies(subs_df[(subs_df['delta'] == 1) & (before > 0)], 'in_on_court', 'sub in'))
+    found.append(anomalies(subs_df[(subs_df['delta'] == -1) & (before <= 0)], 'out_off_court', 'sub out'))
+
+    return pd.concat(found, ignore_index=True), subs_df[['game_id', 'tno', 'player', 'time', 'state']]
+
+
+def check_events(pbp_df: pd.DataFrame, starters_df: pd.DataFrame, subs_df: pd.DataFrame) -> pd.DataFrame:
+    """Check players with plays while not on court
+
+    Args:
+        pbp_df (pd.DataFrame): PBP of the games, with a game_id column
+        starters_df (pd.DataFrame): starters of each game and team (game_id, tno, player)
+        subs_df (pd.DataFrame): on-court state of each player after each of its subs (see check_subs())
+
+    Returns:
+        pd.DataFrame: anomalies found
+    """
+    import pandas as pd
+
+    events_df = pbp_df.loc[~pbp_df['actionType'].isin(ACT_NON_STATS) & (pbp_df['pno'].fillna(0) > 0),
+                           ['game_id', 'tno', 'period', 'clock', 'player', 'actionType']]
+    events_df = events_df.assign(time=game_time(events_df)).sort_values('time', kind='stable')
+
+    # state after the last sub of the player strictly before the play (a play at a sub clock is before the sub)
+    events_df = pd.merge_asof(events_df, subs_df.sort_values('time'), on='time', by=['game_id', 'tno', 'player'],
+                              allow_exact_matches=False)
+    starters = starters_df.assign(starter=1).drop_duplicates(['game_id', 'tno', 'player'])
+    events_df = events_df.merge(starters, on=['game_id', 'tno', 'player'], how='left')
+    state = events_df['state'].fillna(events_df['starter'].fillna(0))
+
+    return anomalies(events_df[state <= 0], 'event_off_court', events_df.loc[state <= 0, 'actionType'])
+
+
+def player_minutes_df(stints_df: pd.DataFrame) -> pd.DataFrame:
+    """Minutes on court of each player from the time intervals of the stints of the games
+
+    Intervals are added up with vectorized group sums (over any number of games), to the hundredth of a second.
+
+    Args:
+        stints_df (pd.DataFrame): stints of the games (game_id, tno, lineup_ids, intervals)
+
+    Returns:
+        pd.DataFrame: minutes of each player in each game (game_id, tno, player_id, mins)
+    """
+    import pandas as pd
+
+    intervals_df = stints_df[['game_id', 'tno', 'intervals']].explode('intervals').dropna(subset=['intervals'])
+    ends_df = pd.DataFrame(intervals_df['intervals'].tolist(), columns=['period', 'from', 'to'], index=intervals_df.index)
+    secs = pd.to_timedelta(ends_df['from'].astype(str)) - pd.to_timedelta(ends_df['to'].astype(str))
+    stint_mins = (secs.dt.total_seconds() / 60).groupby(level=0).sum()  # minutes of each stint (row of stints_df)
+
+    return stints_df[['game_id', 'tno', 'lineup_ids']].assign(mins=stint_mins.reindex(stints_df.index, fill_value=0)) \
+                .explode('lineup_ids').dropna(subset=['lineup_ids']).rename(columns={'lineup_ids': 'player_id'}) \
+                .astype({'player_id': 'int64'}).groupby(['game_id', 'tno', 'player_id'], as_index=False)['mins'].sum()
+
+
+def box_minutes(players_df: pd.DataFrame) -> pd.Series:
+    """Minutes of each player in the box score (sMinutes, as MM:SS)"""
+    import pandas as pd
+
+    return pd.to_timedelta(players_df['sMinutes'].astype(str)).dt.total_seconds() / 60
+
+
+def reconcile_minutes(stints_df: pd.DataFrame, players_df: pd.DataFrame) -> pd.DataFrame:
+    """Join the minutes of each player in the stints with the minutes in the box score, for all games in one pass
+
+    Players are joined by id (see nbl.registry); the name of those in the stints but not in the box score of
+    the game is the one of their id in other games, or the one their id comes from.
+
+    Args:
+        stints_df (pd.DataFrame): stints of the games (with lineup_ids)
+        players_df (pd.DataFrame): players of the games, with their box score (and player_id)
+
+    Returns:
+        pd.DataFrame: minutes of each player (name and id) in each game in the stints (mins) and in the box
+            score (box_mins), and their difference (diff); players missing in one of them have 0 minutes there
+    """
+    players_df = players_df[['game_id', 'tno', 'player', 'player_id']].assign(tno=players_df['tno'].astype(int), box_mins=box_minutes(players_df))
+    minutes_df = player_minutes_df(stints_df).astype({'tno': int}).merge(players_df, on=['game_id', 'tno', 'player_id'], how='outer')
+    missing = minutes_df['player'].isna()
+    if missing.any():
+        names = {registry.name_id(name): name for name in stints_df['lineup'].explode().dropna().unique()}
+        names.update(players_df.drop_duplicates('player_id', keep='last').set_index('player_id')['player'])
+        minutes_df.loc[missing, 'player'] = minutes_df.loc[missing, 'player_id'].map(names)
+    minutes_df = minutes_df[['game_id', 'tno', 'player', 'player_id', 'mins', 'box_mins']].fillna({'mins': 0, 'box_mins': 0})
+    minutes_df['diff'] = minutes_df['mins'] - minutes_df['box_mins']
+    return minutes_df
+
+
+def score_games(minutes_df: pd.DataFrame, threshold=MINUTES_THRESHOLD, quarantine=QUARANTINE_MINUTES) -> pd.DataFrame:
+    """Score how far the stints of each game are from its box score, and flag games to quarantine
+
+    Args:
+        minutes_df (pd.DataFrame): minutes of each player in stints and box score (see reconcile_minutes())
+        threshold (float): minutes of difference from which a player is off
+        quarantine (float): minutes misplaced in a game from which it is quarantined
+
+    Returns:
+        pd.DataFrame: for each game, the minutes misplaced in its stints (sum of the player differences),
+            the max difference of a player, the players off and whether the game is quarantined
+    """
+    abs_diff = minutes_df['diff'].abs()
+    games_df = minutes_df.assign(abs_diff=abs_diff, off=abs_diff > threshold).groupby('game_id', as_index=False) \
+                    .agg(minutes_dev=('abs_diff', 'sum'), max_dev=('abs_diff', 'max'), players_off=('off', 'sum'))
+    games_df['minutes_dev'] = games_df['minutes_dev'].round(2)
+    games_df['max_dev'] = games_df['max_dev'].round(2)
+    games_df['quarantined'] = games_df['minutes_dev'] > quarantine
+    return games_df
+
+
+def check_minutes(stints_df: pd.DataFrame, players_df: pd.DataFrame, threshold=MINUTES_THRESHOLD) -> pd.DataFrame:
+    """Check the minutes of each player in the stints against the minutes in the box score
+
+    Args:
+        stints_df (pd.DataFrame): stints of the games
+        players_df (pd.DataFrame): players of the games, with their box score
+        threshold (float): minutes of difference from which it is an anomaly
+
+    Returns:
+        pd.DataFrame: anomalies found
+    """
+    minutes_df = reconcile_minutes(stints_df, players_df)
+    bad = minutes_df['diff'].abs() > threshold
+    return anomalies(minutes_df[bad], 'minutes_mismatch',
+                     minutes_df.loc[bad, 'mins'].round(2).astype(str) + ' in stints, ' +
+                     minutes_df.loc[bad, 'box_mins'].round(2).astype(str) + ' in box score')
+
+
+def validate(pbp_df: pd.DataFrame, starters_df: pd.DataFrame, stints_df=None, players_df=None,
+             threshold=MINUTES_THRESHOLD) -> pd.DataFrame:
+    """Check the substitutions of a set of games (e.g., a game or a season) and report the anomalies found
+
+    Args:
+        pbp_df (pd.DataFrame): PBP of the games, with a game_id column
+        starters_df (pd.DataFrame): starters of each game and team (game_id, tno, player)
+        stints_df (pd.DataFrame): stints of the games, to check minutes (not checked if None)
+        players_df (pd.DataFrame): players of the games, to check minutes (not checked if None)
+        threshold (float): minutes of difference between stints and box score from which it is an anomaly
+
+    Returns:
+        pd.DataFrame: the anomalies found (see ANOMALIES_COLS), in order of game, team and game time
+    """
+    import pandas as pd
+
+    found_df, subs_df = check_subs(pbp_df, starters_df)
+    found = [found_df, check_events(pbp_df, starters_df, subs_df)]
+    if stints_df is not None and players_df is not None:
+        found.append(check_minutes(stints_df, players_df, threshold))
+
+    found = [df for df in found if not df.empty]
+    if not found:
+        return pd.DataFrame(columns=ANOMALIES_COLS)
+    anomalies_df = pd.concat(found, ignore_index=True)
+    anomalies_df = anomalies_df.assign(time=game_time(anomalies_df.fillna({'period': 0, 'clock': '00:00:00'})))
+    anomalies_df.loc[anomalies_df['period'].isna(), 'time'] = float('inf')     # game level (e.g., minutes) at the end
+    return anomalies_df.sort_values(['game_id', 'tno', 'time'], kind='stable').drop(columns='time').reset_index(drop=True)
+
+
+def validate_game(game_json: dict, game_id, pbp_df=None, stints_df=None, players_df=None) -> pd.DataFrame:
+    """Check the substitutions of a game and report the anomalies found
+
+    Args:
+        game_json (dict): json dict data of the game
+        game_id (str): id of the game
+        pbp_df (pd.DataFrame): PBP of the game, if already extracted
+        stints_df (pd.DataFrame): stints of the game, to check minutes (not checked if None)
+        players_df (pd.DataFrame): players of the game, to check minutes (not checked if None)
+
+    Returns:
+        pd.DataFrame: the anomalies found (see validate())
+    """
+    from nbl.bball_stats import get_pbp_df
+
+    pbp_df = get_pbp_df(game_json) if pbp_df is None else pbp_df
+    return validate(pbp_df.assign(game_id=game_id), get_starters_df(game_json, game_id), stints_df, players_df)
+
+
+def validate_season(data_dir, threshold=MINUTES_THRESHOLD) -> pd.DataFrame:
+    """Check the substitutions of the games cached in a season folder, all in one pass
+
+    Minutes are checked too if the stints and players tables are saved in the folder.
+
+    Args:
+        data_dir (str | Path): folder of the season, with files data-<game_id>.json
+        threshold (float): minutes of difference between stints and box score from which it is an anomaly
+
+    Returns:
+        pd.DataFrame: the anomalies found (see validate())
+    """
+    import pandas as pd
+    from nbl.bball_stats import get_pbp_df
+
+    pbp_dfs, starters_dfs = [], []
+    for file in sorted(Path(data_dir).glob("data-*.json")):
+        game_id = file.stem[len("data-"):]
+        game_json = tools.get_json_data(game_id, dir=data_dir)
+        pbp_dfs.append(get_pbp_df(game_json).assign(game_id=game_id))
+        starters_dfs.append(get_starters_df(game_json, game_id))
+    if not pbp_dfs:
+        return pd.DataFrame(columns=ANOMALIES_COLS)
+
+    stints_df, players_df = None, None
+    if Path(data_dir, "stints_df.pkl").exists() and Path(data_dir, "players_df.pkl").exists():
+        stints_df = pd.read_pickle(Path(data_dir, "stints_df.pkl"))
+        players_df = pd.read_pickle(Path(data_dir, "players_df.pkl"))
+        registry.intern_tables({'players': players_df, 'stints': stints_df})    # saved before ids existed
+
+    return validate(pd.concat(pbp_dfs, ignore_index=True), pd.concat(starters_dfs, ignore_index=True),
+                    stints_df, players_df, threshold)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the substitutions of the games cached in a season folder.")
+    parser.add_argument('data_dir', type=str,
+                        help='Season folder with cached game files data-<game_id>.json.')
+    parser.add_argument('--threshold', type=float, default=MINUTES_THRESHOLD,
+                        help='Minutes of difference between stints and box score reported (default: %(default)s).')
+    parser.add_argument('--quarantine', type=float, default=QUARANTINE_MINUTES,
+                        help='Minutes misplaced in the stints of a game from which it is quarantined (default: %(default)s).')
+    parser.add_argument('--out', type=str,
+                        help='File to save the anomalies table to, as .csv or .pkl (default: not saved).')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    anomalies_df = validate_season(args.data_dir, args.threshold)
+    print(f"Anomalies found in {anomalies_df['game_id'].nunique()} games:")
+    print(anomalies_df.groupby('anomaly').size().to_string() if not anomalies_df.empty else "    none")
+
+    if Path(args.data_dir, "stints_df.pkl").exists() and Path(args.data_dir, "players_df.pkl").exists():
+        import pandas as pd
+
+        tables = registry.intern_tables({'stints': pd.read_pickle(Path(args.data_dir, "stints_df.pkl")),
+                                         'players': pd.read_pickle(Path(args.data_dir, "players_df.pkl"))})
+        games_df = score_games(reconcile_minutes(tables['stints'], tables['players']), args.threshold, args.quarantine)
+        print(f"Games quarantined ({games_df['quarantined'].sum()} of {games_df.shape[0]}, over {args.quarantine} minutes misplaced):")
+        print(games_df[games_df['quarantined']].to_string(index=False) if games_df['quarantined'].any() else "    none")
+    if args.out:
+        store.save_table(anomalies_df, args.out, exts=(Path(args.out).suffix or '.csv',))
+        print(f"Anomalies saved in {args.out}")